@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python3
+
+####################################################################
+#                                                                  #
+#                      Camera Geometry Check                       #
+#                                                                  #
+#  This program checks that the rectangle and ball libraries,      #
+#  measuring through a camera's shared geometry (FRCWebCam         #
+#  context), give the same distances, angles and offsets as the    #
+#  original per object FOV formulas for every camera in the        #
+#  camera settings file.  No camera hardware is needed.            #
+#                                                                  #
+#  Usage: CameraGeometryTest.py [camera file] [vision file]        #
+#                                                                  #
+#  @Version: 1.0                                                   #
+#  @Created: 2023-03-04                                            #
+#  @Author: Team 4121                                              #
+#                                                                  #
+####################################################################
+
+'''FRC 4121 - Check of camera geometry against the original formulas'''
+
+# System imports
+import sys
+import os
+import math
+
+# Setup paths
+sys.path.append('/home/pi/.local/lib/python3.7/site-packages')
+sys.path.append('/home/pi/Team4121/Libraries')
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Vision'))
+
+# Module imports
+import cv2 as cv
+import numpy as np
+
+# Team 4121 module imports
+from FRCVisionBase import VisionBase, PreprocessContext
+from FRCCameraLibrary import FRCWebCam
+from RectVisionLibrary import RectVisionLibrary
+from BallVisionLibrary import BallOnlyVisionLibrary
+
+# Check settings
+settingsDir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Vision')
+cameraFile = os.path.join(settingsDir, '2023CameraSettings.txt')
+visionFile = os.path.join(settingsDir, '2023VisionSettings.txt')
+tolerance = 1e-9
+
+# Ball settings for the check (not in the 2023 settings file)
+ballSettings = {'RADIUS': '4.75', 'MINRADIUS': '10', 'HMIN': '89', 'HMAX': '114',
+                'SMIN': '89', 'SMAX': '255', 'VMIN': '0', 'VMAX': '255'}
+
+
+# Make an uncalibrated camera with its settings and context, but without
+# opening the camera or its log and video files
+def settings_camera(name):
+    cam = FRCWebCam.__new__(FRCWebCam)
+    cam.name = name
+    cam.settings = cam.compile_settings()
+    cam.width, cam.height, cam.fov = cam.settings.width, cam.settings.height, cam.settings.fov
+    cam.undistorter = None
+    cam.undistort_img = False
+    cam.context = PreprocessContext()
+    cam.build_geometry()
+    return cam
+
+
+# Original rectangle metrics (x, y, w, h box) as (distance, angle, offset)
+def rect_formula(x, w, width, cameraWidth, cameraFOV):
+    inches_per_pixel = float(width) / w
+    distanceToTargetPlane = inches_per_pixel * (cameraWidth / (2 * math.tan(math.radians(cameraFOV))))
+    offsetInInches = inches_per_pixel * ((x + (w / 2)) - (cameraWidth / 2))
+    angleToObject = -1 * math.degrees(math.atan((offsetInInches / distanceToTargetPlane)))
+    distanceToObject = math.cos(math.radians(angleToObject)) * distanceToTargetPlane
+    return distanceToObject, angleToObject, -offsetInInches
+
+
+# Original ball metrics (center x, radius) as (distance, angle, offset)
+def ball_formula(x, radius, ballRadius, cameraWidth, cameraFOV):
+    inches_per_pixel = float(ballRadius) / radius
+    distanceToTargetPlane = inches_per_pixel * (cameraWidth / (2 * math.tan(math.radians(cameraFOV))))
+    offsetInInches = inches_per_pixel * (x - cameraWidth / 2)
+    angleToBall = math.degrees(math.atan((offsetInInches / distanceToTargetPlane)))
+    distanceToBall = math.cos(math.radians(angleToBall)) * distanceToTargetPlane
+    return distanceToBall, angleToBall, -offsetInInches
+
+
+# Return the largest difference between measured and expected values
+def difference(obj, expected):
+    return max(abs(value - reference) for value, reference in zip((obj.distance, obj.angle, obj.offset), expected))
+
+
+# Check the libraries on one camera, returning True if all match
+def check_camera(cam):
+
+    passed = True
+    width, height = cam.width, cam.height
+    hsv = VisionBase.config['CUBE']
+    cubeColor = ((int(hsv['HMIN']) + int(hsv['HMAX'])) // 2, 200, 200)
+    cube = RectVisionLibrary("CUBE")
+    cube.context = cam.context
+    cubeWidth = cube.params().width
+    for left in (20, width // 2 - 50, width - 190):
+        hsvFrame = np.zeros((height, width, 3), dtype=np.uint8)
+        cv.rectangle(hsvFrame, (left, height // 2 - 50), (left + 99, height // 2 + 49), cubeColor, -1)
+        frame = cv.cvtColor(hsvFrame, cv.COLOR_HSV2BGR)
+        cam.context.set_frame(frame, left)
+        found = list(cube.detect(frame, width, height, cam.fov))
+        if len(found) != 1:
+            print("{} cube at x={}: found {} objects".format(cam.name, left, len(found)))
+            passed = False
+            continue
+        obj = found[0]
+        diff = difference(obj, rect_formula(obj.x, obj.w, cubeWidth, width, cam.fov))
+        print("{} cube at x={}..{}: {:.1f} in, {:.1f} deg, max difference {:.3g}".format(
+            cam.name, obj.x, obj.x + obj.w - 1, obj.distance, obj.angle, diff))
+        passed = passed and diff < tolerance
+
+    ball = BallOnlyVisionLibrary(2)
+    ball.context = cam.context
+    ballRadius = ball.params().radius
+    for center in (60, width // 2, width - 60):
+        hsvFrame = np.zeros((height, width, 3), dtype=np.uint8)
+        cv.circle(hsvFrame, (center, height // 2), 40, (100, 200, 200), -1)
+        frame = cv.cvtColor(hsvFrame, cv.COLOR_HSV2BGR)
+        cam.context.set_frame(frame, 1000 + center)
+        found = list(ball.detect(frame, width, height, cam.fov))
+        if len(found) != 1:
+            print("{} ball at x={}: found {} objects".format(cam.name, center, len(found)))
+            passed = False
+            continue
+        obj = found[0]
+        diff = difference(obj, ball_formula(obj.x, obj.radius, ballRadius, width, cam.fov))
+        print("{} ball at x={:.1f}: {:.1f} in, {:.1f} deg, max difference {:.3g}".format(
+            cam.name, obj.x, obj.distance, obj.angle, diff))
+        passed = passed and diff < tolerance
+
+    return passed
+
+
+# Define main method
+def main():
+
+    FRCWebCam.read_config_file(sys.argv[1] if len(sys.argv) >= 2 else cameraFile)
+    VisionBase.read_vision_file(sys.argv[2] if len(sys.argv) >= 3 else visionFile)
+    VisionBase.config.setdefault('BALL2', dict(ballSettings))
+
+    passed = True
+    for name in FRCWebCam.config:
+        if name == "":
+            continue
+        passed = check_camera(settings_camera(name)) and passed
+
+    print("PASSED" if passed else "FAILED")
+    sys.exit(0 if passed else 1)
+
+
+#define main function
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python3
+
+####################################################################
+#                                                                  #
+#                 Rectangle Vision Microbenchmark                  #
+#                                                                  #
+#  This program compares the original per-contour loop with the    #
+#  vectorized batch path of RectVisionLibrary on frames            #
+#  containing hundreds of contours, and checks that both return    #
+#  the same objects.                                               #
+#                                                                  #
+#  Usage: RectVisionBenchmark.py [vision file]                     #
+#                                                                  #
+#  @Version: 1.0                                                   #
+#  @Created: 2023-03-04                                            #
+#  @Author: Team 4121                                              #
+#                                                                  #
+####################################################################
+
+'''FRC 4121 - Microbenchmark of rectangle contour filtering'''
+
+# System imports
+import sys
+import os
+import time
+import math
+
+# Setup paths
+sys.path.append('/home/pi/.local/lib/python3.7/site-packages')
+sys.path.append('/home/pi/Team4121/Libraries')
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Vision'))
+
+# Module imports
+import cv2 as cv
+import numpy as np
+
+# Team 4121 module imports
+from FRCVisionBase import VisionBase, PreprocessContext, FoundObject
+from RectVisionLibrary import RectVisionLibrary
+
+# Benchmark settings
+visionFile = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Vision', '2023VisionSettings.txt')
+blobCounts = [100, 300, 1000]
+frameCount = 30
+width = 640
+height = 480
+fov = 24.5
+
+
+# Draw a frame with the given number of separate, randomly sized blobs
+# in a color inside the library's HSV range
+def make_frame(rng, blobs, hsvMin, hsvMax):
+    hsv = np.zeros((height, width, 3), dtype=np.uint8)
+    color = tuple(int((low + high) // 2) for low, high in zip(hsvMin, hsvMax))
+    columns = int(np.ceil(np.sqrt(blobs * width / height)))
+    rows = int(np.ceil(blobs / columns))
+    cellW = width // columns
+    cellH = height // rows
+    for count in range(blobs):
+        x = (count % columns) * cellW
+        y = (count // columns) * cellH
+        w = int(rng.integers(max(2, cellW // 3), cellW - 1))
+        h = int(rng.integers(max(2, cellH // 3), cellH - 1))
+        cv.rectangle(hsv, (x, y), (x + w - 1, y + h - 1), color, -1)
+    return cv.cvtColor(hsv, cv.COLOR_HSV2BGR)
+
+
+# Locate the objects of a rectangle library one contour at a time
+# Reference version of RectVisionLibrary.find_objects (the original loop)
+def find_objects_loop(lib, imgRaw, cameraWidth, cameraHeight, cameraFOV):
+
+    HSVMin, HSVMax, minArea, tolerance, minVis, width, height, recip = lib.read_params()
+    aspect    = height / width
+    
+    # Initialize variables
+    data = []
+
+    # Find contours in the mask and clean up the return style from OpenCV
+    contours = lib.process_image_contours(imgRaw, HSVMin, HSVMax, False, False)
+    if len(contours) > 0:
+
+        contours.sort(key=cv.contourArea, reverse=True)
+        for contour in contours:
+            x, y, w, h = cv.boundingRect(contour)
+            
+            if w * h < minArea: # in pixel units
+                break
+            
+            if (abs(h / w / aspect - 1.0) > tolerance and (not recip and abs(w / h / aspect - 1.0) > tolerance)) or cv.contourArea(contour) / (w * h) < minVis:
+                continue
+
+            # Calculate metrics
+            inches_per_pixel = float(width) / w # set up a general conversion factor
+            distanceToTargetPlane = inches_per_pixel * (cameraWidth / (2 * math.tan(math.radians(cameraFOV))))
+            offsetInInches = inches_per_pixel * ((x + (w / 2)) - (cameraWidth / 2))
+            angleToObject = -1 * math.degrees(math.atan((offsetInInches / distanceToTargetPlane)))
+            distanceToObject = math.cos(math.radians(angleToObject)) * distanceToTargetPlane
+            screenPercent = w * h / (cameraWidth * cameraHeight)
+            offset = -offsetInInches
+            
+            data.append(FoundObject(lib.name, x, y,
+                w=w,
+                h=h,
+                distance=distanceToObject,
+                angle=angleToObject,
+                offset=offset,
+                percent=screenPercent
+            ))
+    
+    return data
+
+
+# Compare two lists of found objects field by field
+# Returns (same objects and integer fields, largest float difference)
+def compare(expected, actual):
+    if len(expected) != len(actual):
+        return False, float('inf')
+    maxDiff = 0.0
+    for a, b in zip(expected, actual):
+        if (a.x, a.y, a.w, a.h) != (b.x, b.y, b.w, b.h):
+            return False, float('inf')
+        for field in ('distance', 'angle', 'offset', 'percent'):
+            maxDiff = max(maxDiff, abs(getattr(a, field) - getattr(b, field)))
+    return True, maxDiff
+
+
+# Define main method
+def main():
+
+    file = sys.argv[1] if len(sys.argv) >= 2 else visionFile
+    VisionBase.read_vision_file(file)
+
+    # Use a permissive copy of the cube settings so most blobs pass the filters
+    VisionBase.config["BENCH"] = dict(VisionBase.config["CUBE"], MINAREA="0", TOLERANCE="1.0", MINVIS="0.5")
+    lib = RectVisionLibrary("BENCH")
+    hsvMin, hsvMax = lib.read_params()[:2]
+    lib.context = PreprocessContext()
+    rng = np.random.default_rng(4121)
+
+    for blobs in blobCounts:
+
+        frames = [make_frame(rng, blobs, hsvMin, hsvMax) for _ in range(4)]
+        contours = len(lib.process_image_contours(frames[0], hsvMin, hsvMax, False, False))
+
+        # Check results match
+        same = True
+        maxDiff = 0.0
+        for frame in frames:
+            lib.context.set_frame(frame, id(frame))
+            match, diff = compare(find_objects_loop(lib, frame, width, height, fov),
+                                  lib.find_objects(frame, width, height, fov))
+            same = same and match
+            maxDiff = max(maxDiff, diff)
+
+        # Time both paths on the same contours, so only the per-contour
+        # metrics and filtering are measured
+        contourLists = [lib.process_image_contours(frame, hsvMin, hsvMax, False, False) for frame in frames]
+        times = {}
+        for name, method in (("loop", lambda *args: find_objects_loop(lib, *args)), ("batch", lib.find_objects)):
+            start = time.perf_counter()
+            for count in range(frameCount):
+                cached = contourLists[count % len(frames)]
+                lib.process_image_contours = lambda *args: list(cached)
+                method(frames[count % len(frames)], width, height, fov)
+            times[name] = (time.perf_counter() - start) / frameCount * 1000
+        del lib.process_image_contours
+
+        print("{:5d} contours: loop {:7.3f} ms, batch {:7.3f} ms, speedup {:5.2f}x, same objects {}, max float diff {:.3g}".format(
+            contours, times["loop"], times["batch"], times["loop"] / times["batch"], same, maxDiff))
+
+
+#define main function
+if __name__ == '__main__':
+    main()
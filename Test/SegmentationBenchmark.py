@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python3
+
+####################################################################
+#                                                                  #
+#                   Segmentation Backend Benchmark                 #
+#                                                                  #
+#  This program compares the findContours and                      #
+#  connectedComponentsWithStats segmentation backends of the       #
+#  rectangle vision libraries on recorded match video.  If no      #
+#  video files are given, synthetic frames are used.               #
+#                                                                  #
+#  Usage: SegmentationBenchmark.py [video files...]                #
+#                                                                  #
+#  @Version: 1.0                                                   #
+#  @Created: 2023-03-04                                            #
+#  @Author: Team 4121                                              #
+#                                                                  #
+####################################################################
+
+'''FRC 4121 - Benchmark of contour vs connected component segmentation'''
+
+# System imports
+import sys
+import os
+import time
+
+# Setup paths
+sys.path.append('/home/pi/.local/lib/python3.7/site-packages')
+sys.path.append('/home/pi/Team4121/Libraries')
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Vision'))
+
+# Module imports
+import cv2 as cv
+import numpy as np
+
+# Team 4121 module imports
+from FRCVisionBase import VisionBase, PreprocessContext
+from RectVisionLibrary import RectVisionLibrary
+
+# Benchmark settings
+visionFile = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Vision', '2023VisionSettings.txt')
+maxFrames = 300
+fov = 24.5
+
+
+# Read frames from the given video files
+def read_frames(files):
+    frames = []
+    for file in files:
+        video = cv.VideoCapture(file)
+        while len(frames) < maxFrames:
+            grabbed, frame = video.read()
+            if not grabbed:
+                break
+            frames.append(frame)
+        video.release()
+    return frames
+
+
+# Make frames with blobs in the colors of every rectangle class
+def synthetic_frames(sections, count = 30):
+    rng = np.random.default_rng(4121)
+    frames = []
+    for _ in range(count):
+        hsv = np.zeros((480, 640, 3), dtype=np.uint8)
+        hsv[..., 2] = rng.integers(0, 60, (480, 640), dtype=np.uint8)
+        for section in sections:
+            config = VisionBase.config[section]
+            color = ((int(config['HMIN']) + int(config['HMAX'])) // 2,
+                     (int(config['SMIN']) + int(config['SMAX'])) // 2,
+                     (int(config['VMIN']) + int(config['VMAX'])) // 2)
+            for blob in range(int(rng.integers(1, 6))):
+                x, y = int(rng.integers(0, 560)), int(rng.integers(0, 400))
+                w, h = int(rng.integers(10, 80)), int(rng.integers(10, 80))
+                cv.rectangle(hsv, (x, y), (x + w, y + h), color, -1)
+        frames.append(cv.cvtColor(hsv, cv.COLOR_HSV2BGR))
+    return frames
+
+
+# Run a library over all frames with the given backend
+# Returns (ms per frame, list of results)
+def run_backend(lib, frames, backend):
+    VisionBase.config[lib.name]['SEGMENTATION'] = backend
+    results = []
+    start = time.perf_counter()
+    for count, frame in enumerate(frames):
+        lib.context.set_frame(frame, count)
+        height, width = frame.shape[:2]
+        results.append(lib.find_objects(frame, width, height, fov))
+    return (time.perf_counter() - start) / len(frames) * 1000, results
+
+
+# Define main method
+def main():
+
+    VisionBase.read_vision_file(visionFile)
+    sections = ['CUBE', 'CONE', 'TAPE']
+
+    if len(sys.argv) >= 2:
+        frames = read_frames(sys.argv[1:])
+        print("{} recorded frames".format(len(frames)))
+    else:
+        frames = synthetic_frames(sections)
+        print("{} synthetic frames".format(len(frames)))
+    if len(frames) == 0:
+        return
+
+    print("library  contours ms  components ms  speedup  same boxes")
+    for section in sections:
+        lib = RectVisionLibrary(section)
+        lib.context = PreprocessContext()
+        contourTime, contourResults = run_backend(lib, frames, 'CONTOURS')
+        componentTime, componentResults = run_backend(lib, frames, 'COMPONENTS')
+        same = sum(1 for a, b in zip(contourResults, componentResults)
+                   if [(o.x, o.y, o.w, o.h) for o in a] == [(o.x, o.y, o.w, o.h) for o in b])
+        print("{:7s}  {:11.3f}  {:13.3f}  {:6.2f}x  {:5.1f}%".format(
+            section, contourTime, componentTime, contourTime / componentTime, 100.0 * same / len(frames)))
+        VisionBase.config[section].pop('SEGMENTATION', None)
+
+
+#define main function
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,392 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python3
+
+####################################################################
+#                                                                  #
+#                    Synthetic Vision Scene Generator              #
+#                                                                  #
+#  This program renders frames of cubes, cones, balls and tape     #
+#  strips at known distances and angles, using the HSV ranges and  #
+#  sizes of the vision settings and the pinhole geometry of the    #
+#  camera (FOV or focal length), with noise, blur and distractors. #
+#  Each frame comes with the FoundObjects the libraries should     #
+#  return, so distance and angle errors can be scored alongside    #
+#  the frame rate.  Run on its own it scores the libraries.        #
+#                                                                  #
+#  Usage: SyntheticScene.py [vision file] [frames]                 #
+#                                                                  #
+#  @Version: 1.0                                                   #
+#  @Created: 2023-03-04                                            #
+#  @Author: Team 4121                                              #
+#                                                                  #
+####################################################################
+
+'''FRC 4121 - Synthetic scenes with ground truth for the vision libraries'''
+
+# System imports
+import sys
+import os
+import math
+import time
+
+# Setup paths
+sys.path.append('/home/pi/.local/lib/python3.7/site-packages')
+sys.path.append('/home/pi/Team4121/Libraries')
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Vision'))
+
+# Module imports
+import cv2 as cv
+import numpy as np
+
+# Team 4121 module imports
+from FRCVisionBase import VisionBase, FoundObject, PreprocessContext
+from FRCCameraGeometry import CameraGeometry
+from RectVisionLibrary import RectVisionLibrary
+from BallVisionLibrary import BallVisionLibrary, BallOnlyVisionLibrary
+
+# Scene settings
+visionFile = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Vision', '2023VisionSettings.txt')
+sceneFrames = 100
+fov = 24.5
+
+# Settings of the 2022 balls, which are not in the 2023 settings file
+ballSettings = {'RADIUS': '4.75', 'MINRADIUS': '10', 'HMIN': '89', 'HMAX': '114',
+                'SMIN': '89', 'SMAX': '255', 'VMIN': '0', 'VMAX': '255'}
+
+# Objects rendered in each scene (kind: (fewest, most))
+scene_counts = {'CUBE': (0, 2), 'CONE': (0, 2), 'BALL': (0, 2), 'TAPE': (0, 2)}
+
+
+# Define the scene generator class
+# Objects are placed by their horizontal distance (inches) from the camera
+# to the center of their front face and their bearing (degrees, right
+# positive).  The front face is drawn square to the camera, sitting on
+# the floor (tape centered at its mount height), mountHeight inches below
+# the camera.  Expected objects use each library's conventions: rectangle
+# objects have a top left box and an angle positive to the left, balls a
+# center, radius and an angle positive to the right; offsets are inches
+# left of the camera axis for both.
+class SceneGenerator:
+
+    # Define initialization
+    # Uses focalLength (pixels) when given, otherwise the FOV as the
+    # libraries do.  noise is the pixel noise sigma, blur the Gaussian
+    # blur sigma (0 for none) and distractors the number of off color
+    # shapes and in range specks too small to be targets in each scene.
+    def __init__(self, width = 640, height = 480, fov = fov, focalLength = None, mountHeight = 0.0,
+                 mountAngle = 0.0, ballColor = 2, tapeHeight = None, noise = 4.0, blur = 0.8,
+                 distractors = 6, minPixels = 8, seed = 4121):
+        self.width = width
+        self.height = height
+        self.fov = fov
+        if focalLength is None:
+            focalLength = CameraGeometry.from_fov(width, height, fov).focalX
+        self.geometry = CameraGeometry(width, height, focalLength, mountAngle=mountAngle, mountHeight=mountHeight)
+        self.noise = noise
+        self.blur = blur
+        self.distractors = distractors
+        self.minPixels = minPixels
+        self.rng = np.random.default_rng(seed)
+
+        # Sizes, colors and detection limits of each kind from the settings
+        self.kinds = {}
+        for kind in ('CUBE', 'CONE', 'TAPE'):
+            params = RectVisionLibrary(kind).params()
+            self.kinds[kind] = {'width': params.width, 'height': params.height, 'minArea': params.minArea,
+                                'hsvMin': params.hsvMin, 'hsvMax': params.hsvMax}
+        # (balls fall back to ballSettings when the vision settings have no
+        # section for their color, such as the 2023 file)
+        ball = BallVisionLibrary(ballColor)
+        if ball.name in VisionBase.config:
+            params = ball.params()
+        else:
+            params = ball.schema.compile(ballSettings, ball.name, [])
+        self.kinds['BALL'] = {'width': 2 * params.radius, 'height': 2 * params.radius,
+                              'minRadius': params.minRadius, 'hsvMin': params.hsvMin, 'hsvMax': params.hsvMax}
+        self.tapeHeight = tapeHeight if tapeHeight is not None else mountHeight
+
+
+    # Return the (nearest, farthest) distance at which a kind fits in the
+    # frame and is still large enough for its library's filters
+    def distance_range(self, kind):
+        size = self.kinds[kind]
+        focal = self.geometry.focalX
+        nearest = focal * max(size['width'] / (0.5 * self.width), size['height'] / (0.5 * self.height))
+        farthest = focal * min(size['width'], size['height']) / self.minPixels
+        if 'minArea' in size:
+            farthest = min(farthest, focal * math.sqrt(size['width'] * size['height'] / (1.5 * size['minArea'])))
+        if 'minRadius' in size:
+            farthest = min(farthest, focal * size['width'] / 2 / (1.2 * size['minRadius'] + 1))
+        return nearest, farthest
+
+
+    # Return the image placement of an object as (center x, center y,
+    # pixel width, pixel height), or None if it is not fully in the frame
+    def project(self, kind, distance, angle):
+        size = self.kinds[kind]
+        geometry = self.geometry
+        depth = distance * math.cos(math.radians(angle))
+        if depth <= 0:
+            return None
+        centerHeight = self.tapeHeight if kind == 'TAPE' else size['height'] / 2
+        elevation = math.atan((centerHeight - geometry.mountHeight) / depth)
+        x = geometry.centerX + geometry.focalX * math.tan(math.radians(angle))
+        y = geometry.centerY + geometry.focalY * math.tan(math.radians(geometry.mountAngle) - elevation)
+        w = geometry.focalX * size['width'] / depth
+        h = geometry.focalY * size['height'] / depth
+        if x - w / 2 < 1 or y - h / 2 < 1 or x + w / 2 > self.width - 1 or y + h / 2 > self.height - 1:
+            return None
+        return x, y, w, h
+
+
+    # Return the FoundObject a library should return for an object
+    def expected_object(self, kind, distance, angle, placement):
+        x, y, w, h = placement
+        offset = -distance * math.sin(math.radians(angle))
+        if kind == 'BALL':
+            radius = w / 2
+            return FoundObject("BALL", x, y, radius=radius, distance=distance, angle=angle, offset=offset,
+                               percent=math.pi * radius * radius / (self.width * self.height))
+        return FoundObject(kind, int(round(x - w / 2)), int(round(y - h / 2)), w=int(round(w)), h=int(round(h)),
+                           distance=distance, angle=-angle, offset=offset,
+                           percent=w * h / (self.width * self.height))
+
+
+    # Return a color inside the middle of a kind's HSV range, as BGR
+    def object_color(self, kind):
+        hsvMin, hsvMax = self.kinds[kind]['hsvMin'], self.kinds[kind]['hsvMax']
+        limits = (179, 255, 255)
+        color = []
+        for low, high, limit in zip(hsvMin, hsvMax, limits):
+            low, high = min(low, limit), min(high, limit)
+            margin = (high - low) * 0.25
+            color.append(int(self.rng.uniform(low + margin, high - margin)))
+        return tuple(int(value) for value in cv.cvtColor(np.uint8([[color]]), cv.COLOR_HSV2BGR)[0, 0])
+
+
+    # Draw an object (sub-pixel positions use 4 fractional bits)
+    @staticmethod
+    def draw_object(frame, kind, placement, color):
+        x, y, w, h = placement
+        shift = 4
+        scale = 1 << shift
+        if kind == 'BALL':
+            cv.circle(frame, (int(round(x * scale)), int(round(y * scale))), int(round(w / 2 * scale)),
+                      color, -1, cv.LINE_8, shift)
+            return
+        left, top, right, bottom = x - w / 2, y - h / 2, x + w / 2 - 1, y + h / 2 - 1
+        if kind == 'CONE':
+            points = [(x - 0.5, top), (right, bottom), (left, bottom)]
+        else:
+            points = [(left, top), (right, top), (right, bottom), (left, bottom)]
+        cv.fillPoly(frame, [np.rint(np.array(points) * scale).astype(np.int32)], color, cv.LINE_8, shift)
+
+
+    # Place objects at random distances and bearings without overlapping
+    # Returns a list of (kind, distance, angle, placement)
+    def random_objects(self, counts = None):
+        counts = scene_counts if counts is None else counts
+        halfAngle = math.degrees(math.atan(self.width / 2 / self.geometry.focalX))
+        placed = []
+        for kind, (fewest, most) in counts.items():
+            nearest, farthest = self.distance_range(kind)
+            if nearest >= farthest:
+                continue
+            for _ in range(int(self.rng.integers(fewest, most + 1))):
+                for _ in range(20):
+                    distance = float(self.rng.uniform(nearest, farthest))
+                    angle = float(self.rng.uniform(-0.9, 0.9) * halfAngle)
+                    placement = self.project(kind, distance, angle)
+                    if placement is not None and not any(self.overlaps(placement, other[3]) for other in placed):
+                        placed.append((kind, distance, angle, placement))
+                        break
+        return placed
+
+
+    # Return True if two placements are closer than the libraries' blur
+    @staticmethod
+    def overlaps(first, second, pad = 14):
+        x0, y0, w0, h0 = first
+        x1, y1, w1, h1 = second
+        return abs(x0 - x1) < (w0 + w1) / 2 + pad and abs(y0 - y1) < (h0 + h1) / 2 + pad
+
+
+    # Render a frame of the given objects (kind, distance, angle, placement)
+    # Returns (frame, {kind: expected FoundObjects nearest first})
+    def render(self, objects):
+        rng = self.rng
+        height, width = self.height, self.width
+
+        # Dark, low saturation background with a gradient
+        base = rng.uniform(15, 60) + rng.uniform(-4, 4, 3)
+        gradient = np.linspace(0, rng.uniform(0, 30), width, dtype=np.float32)
+        frame = np.empty((height, width, 3), dtype=np.uint8)
+        frame[:] = np.clip(base[None, None, :] + gradient[None, :, None], 0, 255).astype(np.uint8)
+
+        # Distractors: gray shapes outside every HSV range and in range
+        # specks below the size of any target
+        for _ in range(self.distractors):
+            x, y = int(rng.integers(0, width)), int(rng.integers(0, height))
+            size = int(rng.integers(10, max(11, width // 8)))
+            gray = int(rng.integers(80, 200))
+            tint = rng.integers(-6, 7, 3)
+            color = tuple(int(value) for value in np.clip(gray + tint, 0, 255))
+            if rng.random() < 0.5:
+                cv.rectangle(frame, (x, y), (x + size, y + size // 2), color, -1)
+            else:
+                cv.circle(frame, (x, y), size // 2, color, -1)
+        for _ in range(self.distractors):
+            kind = str(rng.choice(list(self.kinds)))
+            x, y = int(rng.integers(0, width - 3)), int(rng.integers(0, height - 3))
+            if not any(self.overlaps((x + 1, y + 1, 3, 3), placement, 20) for _, _, _, placement in objects):
+                cv.rectangle(frame, (x, y), (x + 2, y + 2), self.object_color(kind), -1)
+
+        # Targets, farthest first, and their expected objects
+        expected = {kind: [] for kind in self.kinds}
+        for kind, distance, angle, placement in sorted(objects, key=lambda obj: -obj[1]):
+            self.draw_object(frame, kind, placement, self.object_color(kind))
+            expected[kind].append(self.expected_object(kind, distance, angle, placement))
+        for found in expected.values():
+            found.reverse()
+
+        # Lens blur and sensor noise
+        if self.blur > 0:
+            frame = cv.GaussianBlur(frame, (0, 0), self.blur)
+        if self.noise > 0:
+            noisy = frame.astype(np.int16) + rng.normal(0, self.noise, frame.shape).astype(np.int16)
+            frame = np.clip(noisy, 0, 255).astype(np.uint8)
+
+        return frame, expected
+
+
+    # Return (frame, expected) for a scene of random objects
+    def random_scene(self, counts = None):
+        return self.render(self.random_objects(counts))
+
+
+# Return the image center of a found object (boxes for rectangles,
+# centers for balls)
+def object_center(obj):
+    if obj.w is not None and obj.h is not None:
+        return obj.x + obj.w / 2, obj.y + obj.h / 2
+    return obj.x, obj.y
+
+
+# Match found objects to expected objects by image center
+# Returns a list of (expected, found) pairs and the number of found
+# objects with no expected object within maxPixels (plus half its size)
+def match_objects(expected, found, maxPixels = 10.0):
+    pairs = []
+    unmatched = list(found)
+    for target in expected:
+        tx, ty = object_center(target)
+        limit = maxPixels + (target.w / 2 if target.w is not None else target.radius)
+        best = None
+        bestDistance = limit
+        for obj in unmatched:
+            fx, fy = object_center(obj)
+            pixelDistance = math.hypot(fx - tx, fy - ty)
+            if pixelDistance <= bestDistance:
+                best = obj
+                bestDistance = pixelDistance
+        if best is not None:
+            unmatched.remove(best)
+            pairs.append((target, best))
+    return pairs, len(unmatched)
+
+
+# Define the scene score class
+# Adds up matches over frames and reports recall, false positives and
+# the distance (percent), angle (degrees) and offset (inches) errors
+class SceneScore:
+
+    # Define initialization
+    def __init__(self):
+        self.expected = 0
+        self.matched = 0
+        self.falsePositives = 0
+        self.frames = 0
+        self.distanceErrors = []
+        self.angleErrors = []
+        self.offsetErrors = []
+
+    # Score the objects found in one frame
+    def add(self, expected, found):
+        pairs, extra = match_objects(expected, list(found))
+        self.frames += 1
+        self.expected += len(expected)
+        self.matched += len(pairs)
+        self.falsePositives += extra
+        for target, obj in pairs:
+            if obj.distance is not None:
+                self.distanceErrors.append(100.0 * abs(obj.distance - target.distance) / target.distance)
+            if obj.angle is not None:
+                self.angleErrors.append(abs(obj.angle - target.angle))
+            if obj.offset is not None:
+                self.offsetErrors.append(abs(obj.offset - target.offset))
+
+    # Return the score as a dictionary (errors are mean and p95)
+    def summary(self):
+        def errors(values):
+            if len(values) == 0:
+                return None, None
+            return float(np.mean(values)), float(np.percentile(values, 95))
+        distanceMean, distanceP95 = errors(self.distanceErrors)
+        angleMean, angleP95 = errors(self.angleErrors)
+        offsetMean, offsetP95 = errors(self.offsetErrors)
+        return {
+            'expected': self.expected,
+            'recall': self.matched / self.expected if self.expected else None,
+            'false_positives_per_frame': self.falsePositives / self.frames if self.frames else None,
+            'distance_error_pct': distanceMean,
+            'distance_error_pct_p95': distanceP95,
+            'angle_error_deg': angleMean,
+            'angle_error_deg_p95': angleP95,
+            'offset_error_in': offsetMean,
+            'offset_error_in_p95': offsetP95,
+        }
+
+
+# Format an optional number for the score table
+def show(value, form = "{:7.2f}"):
+    return form.format(value) if value is not None else "      -"
+
+
+# Define main method
+def main():
+
+    file = sys.argv[1] if len(sys.argv) >= 2 else visionFile
+    frameCount = int(sys.argv[2]) if len(sys.argv) >= 3 else sceneFrames
+    VisionBase.read_vision_file(file)
+    VisionBase.config.setdefault('BALL2', dict(ballSettings))
+
+    generator = SceneGenerator()
+    scenes = [generator.random_scene() for _ in range(frameCount)]
+    for kind in generator.kinds:
+        print("{:5s} placed {:.0f} to {:.0f} inches".format(kind, *generator.distance_range(kind)))
+
+    libraries = [("CUBE", "CUBE", RectVisionLibrary("CUBE")),
+                 ("CONE", "CONE", RectVisionLibrary("CONE")),
+                 ("TAPE", "TAPE", RectVisionLibrary("TAPE")),
+                 ("BALL", "BALL", BallVisionLibrary(2)),
+                 ("BALLONLY", "BALL", BallOnlyVisionLibrary(2))]
+
+    print("library    ms/frame  recall  false/frame  distance %  angle deg  offset in")
+    for name, kind, lib in libraries:
+        lib.context = PreprocessContext()
+        lib.context.geometry = generator.geometry
+        score = SceneScore()
+        start = time.perf_counter()
+        for count, (frame, expected) in enumerate(scenes):
+            lib.context.set_frame(frame, count)
+            score.add(expected[kind], lib.detect(frame, generator.width, generator.height, generator.fov))
+        elapsed = (time.perf_counter() - start) / len(scenes) * 1000
+        summary = score.summary()
+        print("{:9s}  {:8.3f}  {}  {}      {}    {}    {}".format(
+            name, elapsed, show(summary['recall'], "{:6.3f}"), show(summary['false_positives_per_frame']),
+            show(summary['distance_error_pct']), show(summary['angle_error_deg']), show(summary['offset_error_in'])))
+
+
+#define main function
+if __name__ == '__main__':
+    main()
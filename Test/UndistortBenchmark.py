@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python3
+
+####################################################################
+#                                                                  #
+#                    Undistortion Benchmark                        #
+#                                                                  #
+#  This program compares the frame rate of the old per-frame       #
+#  undistort path (getOptimalNewCameraMatrix + undistort) with     #
+#  the cached remap tables used by FRCWebCam.                      #
+#                                                                  #
+#  Usage: UndistortBenchmark.py [matrix file] [coeffs file]        #
+#                                                                  #
+#  @Version: 1.0                                                   #
+#  @Created: 2023-03-04                                            #
+#  @Author: Team 4121                                              #
+#                                                                  #
+####################################################################
+
+'''FRC 4121 - Benchmark of camera undistortion methods'''
+
+# System imports
+import sys
+import os
+import time
+
+# Setup paths
+sys.path.append('/home/pi/.local/lib/python3.7/site-packages')
+sys.path.append('/home/pi/Team4121/Libraries')
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Vision'))
+
+# Module imports
+import cv2 as cv
+import numpy as np
+
+# Team 4121 module imports
+from FRCCameraLibrary import UndistortMap
+
+# Benchmark settings
+frameSizes = [(320, 240), (640, 480)]
+frameCount = 200
+
+
+# Old undistort path, as previously done in FRCWebCam.read_frame
+def old_undistort(frame, cam_matrix, distort_coeffs):
+    h, w = frame.shape[:2]
+    new_matrix, roi = cv.getOptimalNewCameraMatrix(cam_matrix, distort_coeffs,
+                                                    (w,h),1,(w,h))
+    newFrame = cv.undistort(frame, cam_matrix, distort_coeffs, None, new_matrix)
+    x,y,w,h = roi
+    return newFrame[y:y+h,x:x+w]
+
+
+# Time a function over a list of frames and return frames per second
+def run_fps(func, frames):
+    start = time.perf_counter()
+    for frame in frames:
+        func(frame)
+    return len(frames) / (time.perf_counter() - start)
+
+
+# Define main method
+def main():
+
+    # Load calibration or make up a typical webcam calibration
+    if len(sys.argv) >= 3:
+        undistorter = UndistortMap.from_files(sys.argv[1], sys.argv[2])
+        if undistorter is None:
+            print("Unable to read calibration files")
+            return
+    else:
+        undistorter = None
+
+    for (width, height) in frameSizes:
+
+        if len(sys.argv) < 3:
+            cam_matrix = np.array([[width, 0, width / 2], [0, width, height / 2], [0, 0, 1]], dtype=np.float64)
+            distort_coeffs = np.array([-0.35, 0.15, 0.001, 0.001, -0.03], dtype=np.float64)
+            undistorter = UndistortMap(cam_matrix, distort_coeffs)
+
+        # Random frames so both paths touch real data
+        rng = np.random.default_rng(4121)
+        frames = [rng.integers(0, 255, (height, width, 3), dtype=np.uint8) for _ in range(8)]
+        frames = frames * (frameCount // len(frames))
+
+        # Check that both paths give the same image
+        expected = old_undistort(frames[0], undistorter.cam_matrix, undistorter.distort_coeffs)
+        actual = undistorter.undistort(frames[0])
+        maxDiff = int(np.max(cv.absdiff(expected, actual)))
+
+        oldFps = run_fps(lambda f: old_undistort(f, undistorter.cam_matrix, undistorter.distort_coeffs), frames)
+        newFps = run_fps(undistorter.undistort, frames)
+
+        print("{}x{}: old {:8.1f} fps, remap {:8.1f} fps, speedup {:5.2f}x, max pixel diff {}".format(
+            width, height, oldFps, newFps, newFps / oldFps, maxDiff))
+
+
+#define main function
+if __name__ == '__main__':
+    main()
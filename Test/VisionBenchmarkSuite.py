@@ -0,0 +1,250 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python3
+
+####################################################################
+#                                                                  #
+#                     Offline Vision Benchmark Suite               #
+#                                                                  #
+#  This program runs every vision library (CUBE, CONE and TAPE     #
+#  rectangles, balls, ball only, four vision tape and black tape)  #
+#  over a corpus of frames at several resolutions and reports the  #
+#  frame rate, latency percentiles and peak traced memory of each. #
+#  The corpus is read from recorded .avi files, or rendered with   #
+#  SyntheticScene.py if none are given, in which case the distance #
+#  and angle errors are scored too.  Results are also saved as     #
+#  JSON (by default in Test/BenchmarkResults, which git ignores),  #
+#  so runs can be compared across commits.                         #
+#                                                                  #
+#  Usage: VisionBenchmarkSuite.py [results.json] [video files...]  #
+#                                                                  #
+#  @Version: 1.0                                                   #
+#  @Created: 2023-03-04                                            #
+#  @Author: Team 4121                                              #
+#                                                                  #
+####################################################################
+
+'''FRC 4121 - Offline benchmark of all vision libraries'''
+
+# System imports
+import sys
+import os
+import time
+import json
+import platform
+import datetime
+import subprocess
+import tracemalloc
+
+# Setup paths
+sys.path.append('/home/pi/.local/lib/python3.7/site-packages')
+sys.path.append('/home/pi/Team4121/Libraries')
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Vision'))
+
+# Module imports
+import cv2 as cv
+import numpy as np
+
+# Team 4121 module imports
+from FRCVisionBase import VisionBase, PreprocessContext
+from FRCCameraGeometry import CameraGeometry
+from RectVisionLibrary import RectVisionLibrary
+from BallVisionLibrary import BallVisionLibrary, BallOnlyVisionLibrary
+from FourVisionTapeRectVisionLibrary import FourVisionTapeRectVisionLibrary
+from BlackTapeRectVisionLibrary import BlackTapeRectVisionLibrary
+from SyntheticScene import SceneGenerator, SceneScore, ballSettings
+
+# Benchmark settings
+visionFile = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Vision', '2023VisionSettings.txt')
+resultsDir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'BenchmarkResults')
+resultsFile = "VisionBenchmark_{}.json"
+resolutions = [(320, 240), (640, 480), (1280, 720)]
+corpusFrames = 60
+warmupFrames = 5
+minFrames = 120
+fov = 24.5
+mountHeight = 20.0
+
+# Settings of the 2022 ball and vision tape libraries, which are not in
+# the 2023 settings file (the tape libraries share the TAPE section)
+extraSettings = {
+    'BALL2': ballSettings,
+    'TAPE': {'TAPEWIDTH': '5', 'GOALHEIGHT': '98.0', 'LOCKTOLERANCE': '5.0'},
+}
+
+
+# Return the libraries to benchmark as (name, scene object kind, library)
+# for a resolution.  The 2022 tape libraries take the focal length in
+# pixels of the frames, and measure distance to a raised goal rather than
+# to the object, so they are not scored.
+def make_libraries(width, height):
+    focalLength = CameraGeometry.from_fov(width, height, fov).focalX
+    return [("CUBE", "CUBE", RectVisionLibrary("CUBE")),
+            ("CONE", "CONE", RectVisionLibrary("CONE")),
+            ("TAPE", "TAPE", RectVisionLibrary("TAPE")),
+            ("BALL", "BALL", BallVisionLibrary(2)),
+            ("BALLONLY", "BALL", BallOnlyVisionLibrary(2)),
+            ("FOURVISIONTAPE", None, FourVisionTapeRectVisionLibrary(focalLength, mountHeight)),
+            ("BLACKTAPE", None, BlackTapeRectVisionLibrary(focalLength, mountHeight))]
+
+
+# Read up to corpusFrames frames from the given video files
+def read_frames(files):
+    frames = []
+    for file in files:
+        video = cv.VideoCapture(file)
+        while len(frames) < corpusFrames:
+            grabbed, frame = video.read()
+            if not grabbed:
+                break
+            frames.append(frame)
+        video.release()
+    return frames
+
+
+# Render scenes of cubes, cones, balls and tape strips with the expected
+# objects of each frame
+def synthetic_frames(width, height, count = corpusFrames):
+    generator = SceneGenerator(width, height, fov)
+    scenes = [generator.random_scene() for _ in range(count)]
+    return [frame for frame, _ in scenes], [expected for _, expected in scenes]
+
+
+# Return the number of objects in a library result
+def object_count(result):
+    return len(result) if result is not None else 0
+
+
+# Run a library over the frames on its own preprocessing context
+# With the expected objects of each frame, the first pass over the
+# frames is scored into score
+# Returns (per frame seconds, objects found)
+def run_library(lib, frames, count, expected = None, score = None):
+    lib.context = PreprocessContext()
+    times = []
+    found = 0
+    for number in range(count):
+        frame = frames[number % len(frames)]
+        height, width = frame.shape[:2]
+        start = time.perf_counter()
+        lib.context.set_frame(frame, number)
+        result = lib.detect(frame, width, height, fov)
+        times.append(time.perf_counter() - start)
+        found += object_count(result)
+        if score is not None and number < len(frames):
+            score.add(expected[number], result)
+    return times, found
+
+
+# Benchmark a library on the frames of one resolution
+# expected is the list of expected objects of each frame (synthetic
+# corpus and scored libraries only)
+def benchmark(name, lib, frames, expected = None):
+
+    # Warm up (first use compiles settings and allocates buffers)
+    run_library(lib, frames, warmupFrames)
+
+    # Time at least minFrames frames
+    count = max(minFrames, len(frames))
+    score = SceneScore() if expected is not None else None
+    times, found = run_library(lib, frames, count, expected, score)
+    latency = np.array(times) * 1000.0
+
+    # Peak memory allocated while processing the corpus once
+    tracemalloc.start()
+    run_library(lib, frames, len(frames))
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    height, width = frames[0].shape[:2]
+    p50, p95, p99 = np.percentile(latency, (50, 95, 99)).tolist()
+    result = {
+        'library': name,
+        'resolution': "{}x{}".format(width, height),
+        'frames': count,
+        'fps': count / (latency.sum() / 1000.0),
+        'mean_ms': float(latency.mean()),
+        'p50_ms': p50,
+        'p95_ms': p95,
+        'p99_ms': p99,
+        'max_ms': float(latency.max()),
+        'peak_memory_kib': peak / 1024.0,
+        'objects_per_frame': found / count,
+    }
+    if score is not None:
+        result.update(score.summary())
+    return result
+
+
+# Return the current git commit of the repository, if there is one
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except Exception:
+        return None
+
+
+# Define main method
+def main():
+
+    output = None
+    videos = []
+    for arg in sys.argv[1:]:
+        if arg.lower().endswith('.json'):
+            output = arg
+        else:
+            videos.append(arg)
+
+    VisionBase.read_vision_file(visionFile)
+    for section, values in extraSettings.items():
+        VisionBase.config.setdefault(section, {}).update(values)
+
+    recorded = read_frames(videos) if videos else []
+    if videos and len(recorded) == 0:
+        print("No frames could be read from {}".format(", ".join(videos)))
+        return
+    print("{} {} frames per resolution".format(len(recorded) if videos else corpusFrames,
+                                               "recorded" if videos else "synthetic"))
+
+    results = []
+    print("library         resolution      fps   p50 ms   p95 ms   p99 ms   peak KiB  objects  recall  dist %  angle")
+    for width, height in resolutions:
+        if videos:
+            frames = [cv.resize(frame, (width, height), interpolation=cv.INTER_AREA) for frame in recorded]
+            scenes = None
+        else:
+            frames, scenes = synthetic_frames(width, height)
+        for name, kind, lib in make_libraries(width, height):
+            expected = [scene[kind] for scene in scenes] if scenes is not None and kind is not None else None
+            result = benchmark(name, lib, frames, expected)
+            results.append(result)
+            accuracy = ""
+            if result.get('recall') is not None:
+                accuracy = "  {:6.3f}  {:6.2f}  {:5.2f}".format(
+                    result['recall'], result['distance_error_pct'] or 0.0, result['angle_error_deg'] or 0.0)
+            print("{:15s} {:>10s} {:8.1f} {:8.3f} {:8.3f} {:8.3f} {:10.1f} {:8.2f}{}".format(
+                name, result['resolution'], result['fps'], result['p50_ms'], result['p95_ms'],
+                result['p99_ms'], result['peak_memory_kib'], result['objects_per_frame'], accuracy))
+
+    commit = git_commit()
+    report = {
+        'commit': commit,
+        'date': datetime.datetime.now().isoformat(timespec='seconds'),
+        'corpus': videos if videos else "synthetic",
+        'machine': platform.machine(),
+        'python': platform.python_version(),
+        'opencv': cv.__version__,
+        'numpy': np.__version__,
+        'results': results,
+    }
+    if output is None:
+        os.makedirs(resultsDir, exist_ok=True)
+        output = os.path.join(resultsDir, resultsFile.format(commit or datetime.datetime.now().strftime("%Y%m%d_%H%M%S")))
+    with open(output, 'w') as out_file:
+        json.dump(report, out_file, indent=2)
+    print("Results saved to {}".format(output))
+
+
+#define main function
+if __name__ == '__main__':
+    main()
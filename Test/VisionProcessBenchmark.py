@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python3
+
+####################################################################
+#                                                                  #
+#                  Vision Process Scaling Benchmark                #
+#                                                                  #
+#  This program measures how the total vision frame rate scales    #
+#  as cameras are added, running each camera's libraries either    #
+#  on a worker thread (VisionPipeline) or in its own process with  #
+#  shared memory frames (VisionProcess).  Synthetic cameras are    #
+#  used so no hardware is needed.                                  #
+#                                                                  #
+#  Usage: VisionProcessBenchmark.py [vision file] [max cameras]    #
+#                                                                  #
+#  @Version: 1.0                                                   #
+#  @Created: 2023-03-04                                            #
+#  @Author: Team 4121                                              #
+#                                                                  #
+####################################################################
+
+'''FRC 4121 - Benchmark of threaded vs multi-process vision'''
+
+# System imports
+import sys
+import os
+import time
+import threading
+
+# Setup paths
+sys.path.append('/home/pi/.local/lib/python3.7/site-packages')
+sys.path.append('/home/pi/Team4121/Libraries')
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Vision'))
+
+# Module imports
+import cv2 as cv
+import numpy as np
+
+# Team 4121 module imports
+from FRCVisionBase import VisionBase, PreprocessContext
+from FRCVisionPipeline import VisionPipeline
+from FRCVisionProcess import VisionProcess
+from RectVisionLibrary import CubeVisionLibrary, ConeVisionLibrary, TapeVisionLibrary
+
+# Benchmark settings
+visionFile = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Vision', '2023VisionSettings.txt')
+runSeconds = 5.0
+
+
+# Synthetic camera that always has a new frame ready
+# Frames are noisy color blobs so the libraries find many contours
+class SyntheticCamera:
+
+    def __init__(self, width = 640, height = 480, fov = 24.5, seed = 4121):
+        self.width = width
+        self.height = height
+        self.fov = fov
+        self.frameSeq = 0
+        self.frameTime = 0.0
+        self.context = PreprocessContext()
+        rng = np.random.default_rng(seed)
+        self.frames = []
+        for count in range(4):
+            small = rng.integers(0, 255, (height // 16, width // 16, 3), dtype=np.uint8)
+            self.frames.append(cv.resize(small, (width, height), interpolation=cv.INTER_NEAREST))
+
+    def read_latest(self, after = None, timeout = None, copy = False):
+        self.frameSeq += 1
+        self.frameTime = time.monotonic()
+        frame = self.frames[self.frameSeq % len(self.frames)]
+        return (self.frameSeq, self.frameTime, frame.copy() if copy else frame)
+
+    def use_libs(self, *libs, after = None, timeout = None, copy = False):
+        _, _, frame = self.read_latest(after, timeout, copy)
+        self.context.set_frame(frame, self.frameSeq, self.frameTime)
+        for lib in libs:
+            lib.context = self.context
+        return (frame, *[lib.detect(frame, self.width, self.height, self.fov) for lib in libs])
+
+
+# Run cameraCount cameras in the given mode and return the total results per second
+def run_mode(mode, cameraCount):
+
+    workers = []
+    for count in range(cameraCount):
+        camera = SyntheticCamera(seed=count)
+        libs = (CubeVisionLibrary(), ConeVisionLibrary(), TapeVisionLibrary())
+        if mode == "thread":
+            workers.append(VisionPipeline(camera, *libs, name="cam{}".format(count), freeRun=True, copyFrames=False))
+        else:
+            workers.append(VisionProcess(camera, *libs, name="cam{}".format(count)))
+    for worker in workers:
+        worker.start()
+
+    # Let processes finish starting up before timing
+    for worker in workers:
+        worker.latest(0, 30.0)
+    startCounts = [worker.resultSeq for worker in workers]
+    start = time.perf_counter()
+    time.sleep(runSeconds)
+    elapsed = time.perf_counter() - start
+    total = sum(worker.resultSeq - startCount for worker, startCount in zip(workers, startCounts))
+
+    for worker in workers:
+        worker.stop()
+
+    return total / elapsed
+
+
+# Define main method
+def main():
+
+    file = sys.argv[1] if len(sys.argv) >= 2 else visionFile
+    maxCameras = int(sys.argv[2]) if len(sys.argv) >= 3 else 4
+    VisionBase.read_vision_file(file)
+    cv.setNumThreads(1)
+
+    # Scaling is the total rate relative to one camera in the same mode
+    # (ideal is the camera count), ratio the process rate over the thread rate
+    print("cameras  thread fps  scaling  process fps  scaling  process/thread")
+    firstFps = None
+    for cameraCount in range(1, maxCameras + 1):
+        threadFps = run_mode("thread", cameraCount)
+        processFps = run_mode("process", cameraCount)
+        if firstFps is None:
+            firstFps = (threadFps, processFps)
+        print("{:7d}  {:10.1f}  {:6.2f}x  {:11.1f}  {:6.2f}x  {:13.2f}x".format(
+            cameraCount, threadFps, threadFps / firstFps[0], processFps, processFps / firstFps[1],
+            processFps / threadFps))
+
+
+#define main function
+if __name__ == '__main__':
+    main()
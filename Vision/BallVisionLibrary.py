@@ -1,27 +1,59 @@
 from FRCVisionBase import *
+from FRCVisionConfig import ball_schema
+
+# Make a ball FoundObject with its real world metrics
+# x and y are the ball's center and radius its radius, in pixels
+# geometry is the CameraGeometry of the frame (angles are looked up)
+def ball_object(x, y, radius, ballRadius, cameraWidth, cameraHeight, geometry):
+    column = int(geometry.column_index(x))
+    inches_per_pixel = float(ballRadius)/radius #set up a general conversion factor [ballRadius{in inches} / radius{in pixels}]
+    distanceToTargetPlane = inches_per_pixel * geometry.focalX #distanceToBall = targetPlaneSize/(2*tangent of half of viewing angle
+    offsetInInches = distanceToTargetPlane * float(geometry.columnTan[column])
+    angleToBall = float(geometry.columnAngle[column])
+    distanceToBall = float(geometry.columnCos[column]) * distanceToTargetPlane
+    screenPercent = math.pi * radius * radius / (cameraWidth * cameraHeight)
+    ballOffset = -offsetInInches
+    return FoundObject("BALL", x, y,
+        radius=radius,
+        distance=distanceToBall,
+        angle=angleToBall,
+        offset=ballOffset,
+        percent=screenPercent
+    )
+
+
+# Measure balls moved to new boxes (optical flow mode)
+def remeasure_balls(lib, boxes, cameraWidth, cameraHeight, cameraFOV):
+    ballRadius = lib.params().radius
+    geometry = lib.geometry(cameraWidth, cameraHeight, cameraFOV)
+    return [ball_object(x + w / 2, y + h / 2, max(w, h) / 2, ballRadius, cameraWidth, cameraHeight, geometry)
+            for x, y, w, h in boxes]
+
 
 class BallOnlyVisionLibrary(VisionBase):
 
+    # Define the settings of the ball sections
+    schema = ball_schema
+
     # Define class initialization
     def __init__(self, color):
         self.color = color
+        self.name = "BALL{}".format(color)
+
+    # Measure balls moved to new boxes (optical flow mode)
+    def remeasure(self, objects, boxes, cameraWidth, cameraHeight, cameraFOV):
+        return remeasure_balls(self, boxes, cameraWidth, cameraHeight, cameraFOV)
 
     # Locates the cubes and cones in the game (2023)
     # returns a tuple containing (cubes, cones)
     def find_objects(self, imgRaw, cameraWidth, cameraHeight, cameraFOV):
         
-        config = VisionBase.config["BALL" + str(self.color)]
+        params = self.params()
+        geometry = self.geometry(cameraWidth, cameraHeight, cameraFOV)
 
         # Define variables
-        hMin = config["HMIN"]
-        hMax = config["HMAX"]
-        sMin = config["SMIN"]
-        sMax = config["SMAX"]
-        vMin = config["VMIN"]
-        vMax = config["VMAX"]
-
-        ballHSVMin = (hMin, sMin, vMin)
-        ballHSVMax = (hMax, sMax, vMax)
+        ballHSVMin = params.hsvMin
+        ballHSVMax = params.hsvMax
         
         # Initialize variables
         distanceToBall = 0 #inches
@@ -31,7 +63,7 @@ class BallOnlyVisionLibrary(VisionBase):
         ballData = []
 
         # Find contours in the mask and clean up the return style from OpenCV
-        ballContours = self.process_image_contours(imgRaw, ballHSVMin, ballHSVMax,False)
+        ballContours = self.process_image_contours(imgRaw, ballHSVMin, ballHSVMax, False, False)
 
         # Only proceed if at least one contour was found
         if len(ballContours) > 0:
@@ -46,29 +78,14 @@ class BallOnlyVisionLibrary(VisionBase):
                 ((x, y), radius) = cv.minEnclosingCircle(contour)
 
                 #Get ball radius values
-                minRadius = config["MINRADIUS"]
-                ballRadius = config["RADIUS"]
+                minRadius = params.minRadius
+                ballRadius = params.radius
 
                 #Proceed if circle meets minimum radius requirement
                 if radius > float(minRadius):
             
-                    #Calculate ball metrics
-                    inches_per_pixel = float(ballRadius)/radius #set up a general conversion factor
-                    distanceToTargetPlane = inches_per_pixel * (cameraWidth / (2 * math.tan(math.radians(cameraFOV))))
-                    offsetInInches = inches_per_pixel * (x - cameraWidth / 2)
-                    angleToBall = math.degrees(math.atan((offsetInInches / distanceToTargetPlane)))
-                    distanceToBall = math.cos(math.radians(angleToBall)) * distanceToTargetPlane
-                    screenPercent = math.pi * radius * radius / (cameraWidth * cameraHeight)
-                    ballOffset = -offsetInInches
-
-                    #Add dictionary to return list
-                    ballData.append(FoundObject("BALL", x, y,
-                        radius=radius,
-                        distance=distanceToBall,
-                        angle=angleToBall,
-                        offset=ballOffset,
-                        percent=screenPercent
-                    ))
+                    #Calculate ball metrics and add to return list
+                    ballData.append(ball_object(x, y, radius, ballRadius, cameraWidth, cameraHeight, geometry))
         
                 else:
                     #No more contours meet criteria so break loop
@@ -78,6 +95,9 @@ class BallOnlyVisionLibrary(VisionBase):
 
 class BallVisionLibrary(VisionBase):
 
+    # Define the settings of the ball sections
+    schema = ball_schema
+
     # Define class fields
     ball_values = []
 
@@ -85,22 +105,21 @@ class BallVisionLibrary(VisionBase):
     # Define class initialization
     def __init__(self, color):
         self.color = color
+        self.name = "BALL{}".format(color)
+
+    # Measure balls moved to new boxes (optical flow mode)
+    def remeasure(self, objects, boxes, cameraWidth, cameraHeight, cameraFOV):
+        return remeasure_balls(self, boxes, cameraWidth, cameraHeight, cameraFOV)
 
     # Locates the cubes and cones in the game (2023)
     # returns a tuple containing (cubes, cones)
     def find_objects(self, imgRaw, cameraWidth, cameraHeight, cameraFOV):
-        config = VisionBase.config["BALL{}".format(self.color)]
+        params = self.params()
+        geometry = self.geometry(cameraWidth, cameraHeight, cameraFOV)
 
         # Define variables
-        hMin = config["HMIN"]
-        hMax = config["HMAX"]
-        sMin = config["SMIN"]
-        sMax = config["SMAX"]
-        vMin = config["VMIN"]
-        vMax = config["VMAX"]
-
-        ballHSVMin = (hMin, sMin, vMin)
-        ballHSVMax = (hMax, sMax, vMax)
+        ballHSVMin = params.hsvMin
+        ballHSVMax = params.hsvMax
         
         # Initialize variables
         distanceToBall = 0 #inches
@@ -131,8 +150,8 @@ class BallVisionLibrary(VisionBase):
                 if (aspectRatio >= 1 - ballTolerance) and (aspectRatio <= 1 + ballTolerance):
 
                     #Get ball radius values
-                    minRadius = config["MINRADIUS"]
-                    ballRadius = config["RADIUS"]
+                    minRadius = params.minRadius
+                    ballRadius = params.radius
 
                     #Proceed if circle meets minimum radius requirement
                     radius = contourW / 2
@@ -140,23 +159,8 @@ class BallVisionLibrary(VisionBase):
                     y = contourY + contourH / 2 #y of center of circle
                     if radius > float(minRadius): #in pixel units
                 
-                        #Calculate ball metrics
-                        inches_per_pixel = float(ballRadius)/radius #set up a general conversion factor [ballRadius{in inches} / radius{in pixels}]
-                        distanceToTargetPlane = inches_per_pixel * (cameraWidth / (2 * math.tan(math.radians(cameraFOV)))) #distanceToBall = targetPlaneSize/(2*tangent of half of viewing angle
-                        offsetInInches = inches_per_pixel * (x - cameraWidth / 2)
-                        angleToBall = math.degrees(math.atan((offsetInInches / distanceToTargetPlane)))
-                        distanceToBall = math.cos(math.radians(angleToBall)) * distanceToTargetPlane
-                        screenPercent = math.pi * radius * radius / (cameraWidth * cameraHeight)
-                        ballOffset = -offsetInInches
-
-                        #Add dictionary to return list
-                        ballData.append(FoundObject("BALL", x, y,
-                            radius=radius,
-                            distance=distanceToBall,
-                            angle=angleToBall,
-                            offset=ballOffset,
-                            percent=screenPercent
-                        ))
+                        #Calculate ball metrics and add to return list
+                        ballData.append(ball_object(x, y, radius, ballRadius, cameraWidth, cameraHeight, geometry))
             
                     else:
                         #No more contours meet criteria so break loop
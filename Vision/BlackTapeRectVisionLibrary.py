@@ -1,26 +1,30 @@
-from FRCVisionBase import VisionBase, math, cv, np
+from FRCVisionBase import VisionBase, DetectionBatch, math, cv, np
+from FRCVisionConfig import tape_schema
 
 class BlackTapeRectVisionLibrary(VisionBase):
 
+    # Define the settings of the tape section
+    schema = tape_schema
+
     # Define class initialization
     def __init__(self, cameraFocalLength, cameraMountHeight):
         
+        self.name = "TAPE"
         self.cameraFocalLength = cameraFocalLength
         self.cameraMountHeight = cameraMountHeight
+        self.target = None
 
-    # Locates the cubes and cones in the game (2023)
-    # returns a tuple containing (cubes, cones)
+    # Locates the vision tape target
+    # Returns the tape as a DetectionBatch with one row (empty if no tape was
+    # found), with the angle signed like the rectangle libraries.  The full
+    # target values of the frame are kept in self.target as (camera values,
+    # real world values, foundTape, targetLock, rect, box).
     def find_objects(self, imgRaw, imageWidth, imageHeight, cameraFOV):
         
-        # Read HSV values from dictionary and make tupples
-        hMin = int(VisionBase.config["TAPE"]['HMIN'])
-        hMax = int(VisionBase.config["TAPE"]['HMAX'])
-        sMin = int(VisionBase.config["TAPE"]['SMIN'])
-        sMax = int(VisionBase.config["TAPE"]['SMAX'])
-        vMin = int(VisionBase.config["TAPE"]['VMIN'])
-        vMax = int(VisionBase.config["TAPE"]['VMAX'])
-        tapeHSVMin = (hMin, sMin, vMin)
-        tapeHSVMax = (hMax, sMax, vMax)
+        # Read the compiled tape settings
+        params = self.params()
+        tapeHSVMin = params.hsvMin
+        tapeHSVMax = params.hsvMax
 
         # Initialize processing values
         targetX = 1000 
@@ -58,18 +62,39 @@ class BlackTapeRectVisionLibrary(VisionBase):
         tapeRealWorldValues = {}
         
         # Find alignment tape in image
-        tapeContours = self.process_image_contours(imgRaw, tapeHSVMin, tapeHSVMax, False, True)
+        if self.segmentation() == 'COMPONENTS':
+
+            # Use the largest blob, and its pixels for the angled rectangle
+            # Unlike the contour path this has no Canny step, so the area is
+            # the blob's pixel count and the angled rectangle is fitted to
+            # the filled blob rather than to its edge outline
+            stats, _, labels = self.process_image_components(imgRaw, tapeHSVMin, tapeHSVMax, False)
+            if len(stats) > 0:
+                largest = int(np.argmax(stats[:, cv.CC_STAT_AREA]))
+                largestArea = stats[largest, cv.CC_STAT_AREA]
+                largestRect = tuple(int(value) for value in stats[largest, :4])
+                x, y, w, h = largestRect
+                ox, oy = self.searchWindow[:2] if self.searchWindow is not None else (0, 0)
+                largestContour = cv.findNonZero((labels[y-oy:y-oy+h, x-ox:x-ox+w] == largest + 1).astype(np.uint8)) + np.array([x, y], dtype=np.int32)
+            tapeFound = len(stats) > 0
+
+        else:
+
+            tapeContours = self.process_image_contours(imgRaw, tapeHSVMin, tapeHSVMax, False, True)
+            if len(tapeContours) > 0:
+                largestContour = max(tapeContours, key=cv.contourArea)
+                largestArea = cv.contourArea(largestContour)
+                largestRect = cv.boundingRect(largestContour)
+            tapeFound = len(tapeContours) > 0
   
         # Continue with processing if alignment tape found
-        if len(tapeContours) > 0:
+        if tapeFound:
 
-            # Find the largest contour and check it against the mininum tape area
-            largestContour = max(tapeContours, key=cv.contourArea)
-                        
-            if cv.contourArea(largestContour) > int(VisionBase.config["TAPE"]['MINAREA']):
+            # Check the largest contour against the mininum tape area
+            if largestArea > params.minArea:
                 
                 # Find horizontal rectangle
-                targetX, targetY, targetW, targetH = cv.boundingRect(largestContour)
+                targetX, targetY, targetW, targetH = largestRect
 
                 # Calculate aspect ratio
                 aspectRatio = targetW / targetH
@@ -77,7 +102,7 @@ class BlackTapeRectVisionLibrary(VisionBase):
                 # Find angled rectangle
                 rect = cv.minAreaRect(largestContour)#((x, y), (h, w), angle)
                 box = cv.boxPoints(rect)
-                box = np.int0(box)
+                box = np.intp(box)
 
                 # Find angle of bot to target
                 angle = rect[2]
@@ -94,7 +119,7 @@ class BlackTapeRectVisionLibrary(VisionBase):
             if foundTape:
                 
                 # Adjust tape size for robot angle
-                apparentTapeWidth = float(VisionBase.config["TAPE"]['TAPEWIDTH']) * math.cos(math.radians(botAngle))
+                apparentTapeWidth = params.tapeWidth * math.cos(math.radians(botAngle))
                 
                 # Calculate inches per pixel conversion factor
                 inchesPerPixel = apparentTapeWidth / targetW
@@ -108,7 +133,7 @@ class BlackTapeRectVisionLibrary(VisionBase):
                 
                 # Calculate distance to tape
                 straightLineDistance = apparentTapeWidth * self.cameraFocalLength / targetW
-                distanceArg = math.pow(straightLineDistance, 2) - math.pow((float(VisionBase.config["TAPE"]['GOALHEIGHT']) - self.cameraMountHeight),2)
+                distanceArg = math.pow(straightLineDistance, 2) - math.pow((params.goalHeight - self.cameraMountHeight),2)
                 if (distanceArg > 0):
                     distanceToTape = math.sqrt(distanceArg)
                 distanceToWall = distanceToTape / math.cos(math.radians(botAngle))                
@@ -118,11 +143,11 @@ class BlackTapeRectVisionLibrary(VisionBase):
                 vertAngleToTape = math.degrees(math.atan((vertOffsetInInches / distanceToTape)))
 
                 # Determine if we have target lock
-                if abs(horizOffsetInInches) <= float(VisionBase.config["TAPE"]['LOCKTOLERANCE']):
+                if abs(horizOffsetInInches) <= params.lockTolerance:
                     targetLock = True
 
 
-        return ({
+        self.target = ({
             'TargetX': targetX,
             'TargetY': targetY,
             'TargetW': targetW,
@@ -142,4 +167,10 @@ class BlackTapeRectVisionLibrary(VisionBase):
             'BotAngle': botAngle,
             'ApparentWidth': apparentTapeWidth,
             'VertOffset': vertOffsetInInches
-        }, foundTape, targetLock, rect, box)
\ No newline at end of file
+        }, foundTape, targetLock, rect, box)
+
+        if not foundTape:
+            return DetectionBatch()
+        return DetectionBatch.from_columns(self.name, 1, True, x=targetX, y=targetY, w=targetW, h=targetH,
+                                           distance=distanceToTape, angle=-horizAngleToTape, offset=centerOffset,
+                                           percent=targetW * targetH / (imageWidth * imageHeight))
\ No newline at end of file
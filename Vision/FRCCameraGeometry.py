@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python3
+
+######################################################################
+#                                                                    #
+#                     FRC Camera Geometry Library                    #
+#                                                                    #
+#  This class holds the pixel to angle geometry of a camera.  The    #
+#  horizontal angle of every column and the vertical angle of every  #
+#  row are computed once (from the calibrated camera matrix when     #
+#  there is one, otherwise from the focal length or FOV), so the     #
+#  libraries look angles up instead of doing trig per object.        #
+#                                                                    #
+# @Version: 1.0                                                      #
+# @Created: 2023-03-04                                               #
+# @Author: Team 4121                                                 #
+#                                                                    #
+######################################################################
+
+"""FRC Camera Geometry Library - Provides pixel to angle lookup tables"""
+
+# System imports
+import math
+
+# Module Imports
+import cv2 as cv
+import numpy as np
+
+
+# Define the camera geometry class
+# Tables are sampled every half pixel from 0 to the frame size, so box
+# centers (x + w / 2) of integer boxes are looked up exactly
+class CameraGeometry:
+
+    # Geometries made from a FOV, shared by all libraries
+    cache = {}
+
+    # Define initialization
+    # focalX and focalY are in pixels, centerX and centerY the principal
+    # point (defaults to the frame center).  mountAngle (degrees, up) and
+    # mountHeight (inches) describe how the camera is mounted.  With a
+    # camera matrix and distortion coefficients, angles are corrected for
+    # the lens distortion of frames that were not undistorted.
+    def __init__(self, width, height, focalX, focalY = None, centerX = None, centerY = None,
+                 mountAngle = 0.0, mountHeight = 0.0, camMatrix = None, distortCoeffs = None):
+        self.width = width
+        self.height = height
+        self.focalX = float(focalX)
+        self.focalY = float(focalY if focalY is not None else focalX)
+        self.centerX = float(centerX if centerX is not None else width / 2)
+        self.centerY = float(centerY if centerY is not None else height / 2)
+        self.mountAngle = mountAngle
+        self.mountHeight = mountHeight
+
+        # Normalized image coordinates (tangent of the angle) of every
+        # half pixel column and row
+        columns = np.arange(2 * width + 1, dtype=np.float64) / 2
+        rows = np.arange(2 * height + 1, dtype=np.float64) / 2
+        if camMatrix is not None and distortCoeffs is not None:
+            points = np.concatenate((
+                np.stack((columns, np.full_like(columns, self.centerY)), axis=1),
+                np.stack((np.full_like(rows, self.centerX), rows), axis=1)))
+            normalized = cv.undistortPoints(points.reshape(-1, 1, 2), np.asarray(camMatrix, dtype=np.float64),
+                                            np.asarray(distortCoeffs, dtype=np.float64)).reshape(-1, 2)
+            self.columnTan = normalized[:len(columns), 0].copy()
+            self.rowTan = normalized[len(columns):, 1].copy()
+        else:
+            self.columnTan = (columns - self.centerX) / self.focalX
+            self.rowTan = (rows - self.centerY) / self.focalY
+
+        # Horizontal angle (degrees, right positive) and its cosine per column
+        columnAngle = np.arctan(self.columnTan)
+        self.columnAngle = np.degrees(columnAngle)
+        self.columnCos = np.cos(columnAngle)
+
+        # Vertical angle above horizontal (degrees) per row, including the
+        # mount angle
+        self.rowAngle = mountAngle - np.degrees(np.arctan(self.rowTan))
+
+    # Geometry of a pinhole camera from its FOV (as used by the libraries:
+    # focal length = width / (2 * tan(FOV)))
+    @staticmethod
+    def from_fov(width, height, fov):
+        key = (width, height, fov)
+        geometry = CameraGeometry.cache.get(key)
+        if geometry is None:
+            geometry = CameraGeometry(width, height, width / (2 * math.tan(math.radians(fov))))
+            CameraGeometry.cache[key] = geometry
+        return geometry
+
+    # Geometry of a camera from its compiled settings
+    # Uses the calibrated camera matrix when there is one (undistorter),
+    # otherwise the FOV with the same focal length formula as from_fov, so
+    # the rectangle and ball libraries measure exactly as they always have
+    # (FOCAL_LENGTH is only for the tape libraries, which take it directly).
+    # Returns None if the settings have no FOV.
+    # undistorted tells whether the frames are undistorted (and cropped to
+    # the valid region) before the libraries see them.
+    @staticmethod
+    def from_settings(settings, undistorter = None, undistorted = False):
+        width, height = settings.width, settings.height
+        if undistorter is not None:
+            if undistorted:
+                undistorter.build((height, width, 3))
+                matrix = undistorter.new_matrix
+                x, y, _, _ = undistorter.roi
+                return CameraGeometry(width, height, matrix[0, 0], matrix[1, 1],
+                                      matrix[0, 2] - x, matrix[1, 2] - y,
+                                      settings.mountAngle, settings.mountHeight)
+            matrix = undistorter.cam_matrix
+            return CameraGeometry(width, height, matrix[0, 0], matrix[1, 1], matrix[0, 2], matrix[1, 2],
+                                  settings.mountAngle, settings.mountHeight,
+                                  matrix, undistorter.distort_coeffs)
+        if not settings.fov:
+            return None
+        focal = width / (2 * math.tan(math.radians(settings.fov)))
+        return CameraGeometry(width, height, focal, mountAngle=settings.mountAngle, mountHeight=settings.mountHeight)
+
+    # Return True if the geometry is for frames of this size
+    def matches(self, width, height):
+        return self.width == width and self.height == height
+
+    # Return the table index of x positions (arrays or numbers, in pixels)
+    def column_index(self, x):
+        return np.clip(np.rint(np.multiply(x, 2)), 0, 2 * self.width).astype(np.intp)
+
+    # Return the table index of y positions (arrays or numbers, in pixels)
+    def row_index(self, y):
+        return np.clip(np.rint(np.multiply(y, 2)), 0, 2 * self.height).astype(np.intp)
+
+    # Return the horizontal angle (degrees, right positive) of x positions
+    def horizontal_angle(self, x):
+        return self.columnAngle[self.column_index(x)]
+
+    # Return the vertical angle above horizontal (degrees) of y positions
+    def vertical_angle(self, y):
+        return self.rowAngle[self.row_index(y)]
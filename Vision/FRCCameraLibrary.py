@@ -21,13 +21,22 @@
 # System imports
 import sys
 import os
+import time
 import logging
 
 # Module Imports
 import cv2 as cv
 import numpy as np
-from threading import Thread
+from threading import Thread, Condition, get_ident, enumerate as threads
 from cscore import CvSource, VideoMode
+from FRCVideoRecorder import VideoRecorder, BlackBoxRecorder, DROP_OLDEST
+from FRCVisionBase import PreprocessContext
+from FRCCameraGeometry import CameraGeometry
+from FRCLatencyStats import LatencyStats
+from FRCStageProfiler import StageProfiler, context_stages
+from FRCColorClassifier import ColorClassifier
+from FRCVisionPipeline import VisionPipeline
+from FRCVisionConfig import ConfigSchema, Param, parse_upper
 
 #Set up basic logging
 logging.basicConfig(level=logging.DEBUG)
@@ -35,6 +44,36 @@ logging.basicConfig(level=logging.DEBUG)
 # Set global variables
 calibration_dir = "/home/pi/Team4121/Config"
 
+# Keys of a camera section (the global section supplies defaults)
+camera_schema = ConfigSchema("Camera", [
+    Param('PORT', int, None, False, 'port'),
+    Param('ID', str, "0", False, 'id'),
+    Param('WIDTH', int, 320, True, 'width'),
+    Param('HEIGHT', int, 240, True, 'height'),
+    Param('FOV', float, 0.0, True, 'fov'),
+    Param('FPS', int, 15, True, 'fps'),
+    Param('FOCAL_LENGTH', float, None, False, 'focalLength'),
+    Param('MOUNT_ANGLE', float, 0.0, False, 'mountAngle'),
+    Param('MOUNT_HEIGHT', float, 0.0, False, 'mountHeight'),
+    Param('CAL_FACTOR', float, 1.0, False, 'calFactor'),
+    Param('RESIZE_FACTOR', float, 1.0, False, 'resizeFactor'),
+    Param('STREAM_RES', int, 1, False, 'streamRes'),
+    Param('BRIGHTNESS', float, 0.0, False, 'brightness'),
+    Param('EXPOSURE', int, 0, False, 'exposure'),
+    Param('RING_SIZE', int, 3, False, 'ringSize'),
+    Param('RECORD_QUEUE', int, 30, False, 'recordQueue'),
+    Param('RECORD_DROP', parse_upper, DROP_OLDEST, False, 'recordDrop'),
+    Param('RECORD_DROP_NTH', int, 2, False, 'recordDropNth'),
+    Param('RECORD_MODE', parse_upper, "CONTINUOUS", False, 'recordMode'),
+    Param('BLACKBOX_SECONDS', float, 10.0, False, 'blackboxSeconds'),
+    Param('BLACKBOX_POST', float, 5.0, False, 'blackboxPost'),
+    Param('BLACKBOX_MEMORY_MB', float, 32.0, False, 'blackboxMemoryMB'),
+    Param('BLACKBOX_QUALITY', int, 80, False, 'blackboxQuality'),
+    Param('BLACKBOX_KEY', str, "BlackBox", False, 'blackboxKey'),
+    Param('CLASSIFIER', parse_upper, "NONE", False, 'classifier'),
+    Param('CLASSIFIER_BITS', int, 6, False, 'classifierBits'),
+])
+
 def find_cams(port: int):
     file = f"/sys/devices/platform/scb/fd500000.pcie/pci0000:00/0000:00:00.0/0000:01:00.0/usb1/1-1/1-1.{port}/1-1.{port}:1.0/video4linux"
     if os.path.exists(file):
@@ -44,6 +83,143 @@ def find_cams(port: int):
             return files[0]
 
 
+# Define the undistortion map class
+# Builds the remap tables for a camera calibration once per frame size,
+# so each frame only needs a single remap instead of a full undistort
+class UndistortMap:
+
+    # Define initialization
+    def __init__(self, cam_matrix, distort_coeffs):
+        self.cam_matrix = cam_matrix
+        self.distort_coeffs = distort_coeffs
+        self.key = None
+        self.new_matrix = None
+        self.roi = None
+        self.map1 = None
+        self.map2 = None
+        self.buffer = None
+
+    # Load a calibration from the camera matrix and distortion coefficient files
+    @staticmethod
+    def from_files(cam_matrix_file, cam_coeffs_file):
+        if os.path.isfile(cam_matrix_file) == True and os.path.isfile(cam_coeffs_file) == True:
+            return UndistortMap(np.loadtxt(cam_matrix_file), np.loadtxt(cam_coeffs_file))
+        return None
+
+    # Build the fixed-point remap tables and output buffer for a frame shape
+    # Does nothing if the tables for this shape already exist
+    def build(self, shape):
+        if self.key == shape:
+            return
+        h, w = shape[:2]
+        self.new_matrix, self.roi = cv.getOptimalNewCameraMatrix(self.cam_matrix,
+                                                                 self.distort_coeffs,
+                                                                 (w,h),1,(w,h))
+        self.map1, self.map2 = cv.initUndistortRectifyMap(self.cam_matrix,
+                                                          self.distort_coeffs, None,
+                                                          self.new_matrix, (w,h),
+                                                          cv.CV_16SC2)
+        self.buffer = np.zeros(shape, dtype=np.uint8)
+        self.key = shape
+
+    # Undistort a frame and crop it to the valid region
+    # The result is a view into dst (or the internal buffer), so it is only
+    # valid until the next call that writes into the same buffer
+    def undistort(self, frame, dst = None):
+        self.build(frame.shape)
+        if dst is None:
+            dst = self.buffer
+        cv.remap(frame, self.map1, self.map2, cv.INTER_LINEAR, dst=dst)
+        x,y,w,h = self.roi
+        return dst[y:y+h,x:x+w]
+
+
+# Define the frame ring class
+# A small ring of preallocated frame buffers written by the capture thread.
+# Each frame is tagged with a sequence number and a monotonic timestamp.
+# The writer never touches the newest frame or the frame held by any
+# reader (each reading thread holds its last frame until its next read),
+# so every reader gets complete frames without copying.  The ring grows
+# if the readers hold all the spare slots.
+class FrameRing:
+
+    # Define initialization
+    def __init__(self, shape, size = 3):
+        size = max(3, size)
+        self.buffers = [np.zeros(shape, dtype=np.uint8) for _ in range(size)]
+        self.frames = [None] * size
+        self.seqs = [0] * size
+        self.times = [0.0] * size
+        self.seq = 0
+        self.latest = -1
+        self.held = {}
+        self.writing = 0
+        self.closed = False
+        self.condition = Condition()
+
+    # Choose a free slot and return its buffer for the writer to fill
+    def begin_write(self):
+        with self.condition:
+            slot = self.free_slot()
+            if slot is None:
+                # Forget the frames held by readers that have exited
+                alive = set(thread.ident for thread in threads())
+                self.held = {reader: held for reader, held in self.held.items() if reader in alive}
+                slot = self.free_slot()
+            if slot is None:
+                # More readers than spare slots: add one
+                self.buffers.append(np.zeros_like(self.buffers[0]))
+                self.frames.append(None)
+                self.seqs.append(0)
+                self.times.append(0.0)
+                slot = len(self.buffers) - 1
+            self.writing = slot
+            return self.buffers[slot]
+
+    # Return a slot that is neither the newest nor held, or None (lock held)
+    def free_slot(self):
+        busy = set(self.held.values())
+        for step in range(1, len(self.buffers) + 1):
+            slot = (self.latest + step) % len(self.buffers)
+            if slot != self.latest and slot not in busy:
+                return slot
+        return None
+
+    # Publish the slot being written
+    # buffer is the array that was filled (it replaces the slot buffer if the
+    # capture had to reallocate) and frame is the view handed to readers
+    def commit(self, buffer, frame, timestamp):
+        with self.condition:
+            slot = self.writing
+            self.seq += 1
+            self.buffers[slot] = buffer
+            self.frames[slot] = frame
+            self.seqs[slot] = self.seq
+            self.times[slot] = timestamp
+            self.latest = slot
+            self.condition.notify_all()
+
+    # Return (seq, timestamp, frame) for the newest frame
+    # If after is given, wait for a frame newer than that sequence number
+    # Returns None if no frame is available (or the wait timed out)
+    def read(self, after = None, timeout = None):
+        with self.condition:
+            if after is not None:
+                if not self.condition.wait_for(lambda: self.seq > after or self.closed, timeout):
+                    return None
+            if self.latest < 0 or self.closed:
+                return None
+            slot = self.latest
+            self.held[get_ident()] = slot
+            return (self.seqs[slot], self.times[slot], self.frames[slot])
+
+    # Wake up any waiting readers and stop handing out frames
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+
 # Define the web camera class
 class FRCWebCam:
     config = {"": {}}
@@ -51,11 +227,12 @@ class FRCWebCam:
     # Define initialization
     def __init__(self, name, timestamp, videofile = None, csname = None):
         self.name = name
-        port = self.get_config("PORT", None)
+        self.settings = self.compile_settings()
+        port = self.settings.port
         if port is not None:
             port = find_cams(port)
         if port is None:
-            self.device_id = self.get_config("ID", "0")
+            self.device_id = self.settings.id
             self.device_id = int(self.device_id) if self.device_id.isnumeric() else self.device_id
         else:
             self.device_id = port    
@@ -66,6 +243,8 @@ class FRCWebCam:
             videofile = "{}_{}".format(name, timestamp)
         self.log_file = open(logFilename, "w")
         self.log_file.write("Initializing webcam: {}\n".format(self.name))
+        for problem in self.settingsProblems:
+            self.log_file.write(problem + "\n")
         if self.device_id == "":
             print("Device ID not specified for camera {}".format(self.name))
             self.log_file.write("Device ID not specified for camera {}\n".format(self.name))
@@ -74,19 +253,18 @@ class FRCWebCam:
         self.undistort_img = False
 
         # Store frame size
-        self.height = int(self.get_config("HEIGHT", 240))
-        self.width = int(self.get_config("WIDTH", 320))
-        self.fov = float(self.get_config("FOV", 0.0))
-        self.fps = int(self.get_config("FPS", 15))
-        self.streamRes = int(self.get_config("STREAM_RES", 1))
+        self.height = self.settings.height
+        self.width = self.settings.width
+        self.fov = self.settings.fov
+        self.fps = self.settings.fps
+        self.streamRes = self.settings.streamRes
 
         # Set up web camera
         #self.camStream = cv.VideoCapture(self.device_id)
         self.camStream = cv.VideoCapture(self.device_id)
         self.camStream.set(cv.CAP_PROP_FRAME_WIDTH, self.width)
         self.camStream.set(cv.CAP_PROP_FRAME_HEIGHT, self.height)
-        self.camStream.set(cv.CAP_PROP_BRIGHTNESS, float(self.get_config("BRIGHTNESS", 0)))
-        self.camStream.set(cv.CAP_PROP_EXPOSURE, int(self.get_config("EXPOSURE", 0)))
+        self.set_properties()
         self.camStream.set(cv.CAP_PROP_FPS, self.fps)
 
         # Set up video writer
@@ -96,7 +274,7 @@ class FRCWebCam:
 
         try:
             self.camWriter.open(self.videoFilename, self.fourcc, 
-                                float(self.get_config("FPS", 15)), 
+                                float(self.fps), 
                                 (self.width, self.height),
                                 True)
         except:
@@ -107,6 +285,28 @@ class FRCWebCam:
         else:
             self.log_file.write("Video writer is NOT open\n")
 
+        # Set up background recorder so video writing never blocks the caller
+        self.recorder = VideoRecorder(self.camWriter,
+                                      self.settings.recordQueue,
+                                      self.settings.recordDrop,
+                                      self.settings.recordDropNth,
+                                      self.log_file, self.name + "_recorder")
+        if self.camWriter.isOpened():
+            self.recorder.start()
+
+        # Set up black box recorder (only keeps frames around triggers)
+        self.recordMode = self.settings.recordMode
+        self.blackboxKey = self.settings.blackboxKey
+        self.blackbox = None
+        if self.recordMode == "BLACKBOX":
+            self.blackbox = BlackBoxRecorder("/home/pi/Team4121/Videos", videofile,
+                                             self.settings.blackboxSeconds,
+                                             self.settings.blackboxPost,
+                                             self.fps,
+                                             int(self.settings.blackboxMemoryMB * 1024 * 1024),
+                                             self.settings.blackboxQuality,
+                                             self.log_file, self.name + "_blackbox").start()
+
         # Make sure video capture is opened
         if self.camStream.isOpened() == False:
             print("Camera stream is not open")
@@ -124,13 +324,44 @@ class FRCWebCam:
         # Initialize stop flag
         self.stopped = False
 
+        # Initialize threaded capture ring (created when the thread starts)
+        self.ringSize = self.settings.ringSize
+        self.ring = None
+        self.camThread = None
+        self.frameSeq = 0
+        self.frameTime = 0.0
+
+        # Preprocessing shared by all libraries run on a frame
+        # CLASSIFIER=HSV or BGR labels every color class in one pass
+        classifierMode = self.settings.classifier
+        if classifierMode == "HSV" or classifierMode == "BGR":
+            classifier = ColorClassifier(bits=self.settings.classifierBits,
+                                         useBGR=(classifierMode == "BGR"))
+        else:
+            classifier = None
+        self.context = PreprocessContext(classifier)
+
+        # Rolling latency of each pipeline stage, and the per step timing of
+        # the shared preprocessing (while StageProfiler.enabled is set)
+        self.latency = LatencyStats()
+        self.profiler = StageProfiler(self.name, context_stages)
+        self.context.profiler = self.profiler
+
+        # Persistent vision workers started by use_libs_async
+        self.pipelines = {}
+
         # Read camera calibration files
         cam_matrix_file = calibration_dir + "/Camera_Matrix_Cam" + str(self.device_id) + ".txt"
         cam_coeffs_file = calibration_dir + "/Distortion_Coeffs_Cam" + str(self.device_id) + ".txt"
-        if os.path.isfile(cam_matrix_file) == True and os.path.isfile(cam_coeffs_file) == True:
-            self.cam_matrix = np.loadtxt(cam_matrix_file)
-            self.distort_coeffs = np.loadtxt(cam_coeffs_file)
+        self.undistorter = UndistortMap.from_files(cam_matrix_file, cam_coeffs_file)
+        if self.undistorter is not None:
+            self.cam_matrix = self.undistorter.cam_matrix
+            self.distort_coeffs = self.undistorter.distort_coeffs
+            self.undistorter.build((self.height, self.width, 3))
             self.undistort_img = True
+
+        # Pixel to angle tables shared by the libraries run on this camera
+        self.build_geometry()
         
         if csname is not None:
             self.cvs = CvSource(csname, VideoMode.PixelFormat.kBGR, self.width // self.streamRes, self.height // self.streamRes, self.fps)
@@ -140,21 +371,25 @@ class FRCWebCam:
         # Log init complete message
         self.log_file.write("Webcam initialization complete\n")
 
+    # Read camera settings file
+    # Parsed into a new dictionary that replaces the current settings in
+    # one step (see VisionBase.read_vision_file).  Open cameras pick up
+    # the new settings through apply_settings.
     @staticmethod
     def read_config_file(file, reload = False):
         if FRCWebCam.init and not reload:
             return True
-        FRCWebCam.init = True
         # Declare local variables
         value_section = ''
+        config = {"": {}} if reload else {section: dict(values) for section, values in FRCWebCam.config.items()}
         # Open the file and read contents
         try:
             
             # Open the file for reading
-            in_file = open(file, 'r')
+            with open(file, 'r') as in_file:
             
-            # Read in all lines
-            value_list = in_file.readlines()
+                # Read in all lines
+                value_list = in_file.readlines()
             
             # Process list of lines
             for line in value_list:
@@ -173,38 +408,84 @@ class FRCWebCam:
                 
                 if upper_line[-1] == ':':
                     value_section = upper_line[:-1]
-                    if not value_section in FRCWebCam.config:
-                        FRCWebCam.config[value_section] = {}
+                    if not value_section in config:
+                        config[value_section] = {}
                 elif split_line[0] == '':
                     value_section = ''
-                    if not value_section in FRCWebCam.config:
-                        FRCWebCam.config[value_section] = {}
+                    if not value_section in config:
+                        config[value_section] = {}
                 else:
-                    FRCWebCam.config[value_section][split_line[0].upper()] = split_line[1]
+                    config.setdefault(value_section, {})[split_line[0].upper()] = split_line[1]
         
         except FileNotFoundError:
             return False
+
+        # Swap in the new settings
+        FRCWebCam.config = config
+        FRCWebCam.init = True
         
         return True
 
-    def get_config(self, name, default):
-        if self.name in FRCWebCam.config:
-            cfg = FRCWebCam.config[self.name]
-            if name in cfg:
-                return cfg[name]
-        cfg = FRCWebCam.config[""]
-        if name in cfg:
-            return cfg[name]
-        return default
+    # Compile this camera's settings (its section over the global section)
+    # Missing, bad and unknown keys are printed and kept for the log file
+    def compile_settings(self):
+        values = dict(FRCWebCam.config.get("", {}))
+        values.update(FRCWebCam.config.get(self.name, {}))
+        self.settingsProblems = []
+        settings = camera_schema.compile(values, self.name, self.settingsProblems)
+        for key in camera_schema.unknown(values):
+            self.settingsProblems.append("Unknown parameter {} for camera {}!".format(key, self.name))
+        for problem in self.settingsProblems:
+            print(problem)
+        return settings
+
+    # Recompile this camera's settings after the camera file is reloaded
+    # Capture properties (brightness, exposure) are re-applied to the open
+    # camera without reopening it: by the camera thread between frames if it
+    # is running, otherwise right away.  Frame size and rate changes need a
+    # restart, as the ring, writer and stream are sized for them.
+    def apply_settings(self):
+        settings = self.compile_settings()
+        for problem in self.settingsProblems:
+            self.log_file.write(problem + "\n")
+        if (settings.width, settings.height, settings.fps) != (self.width, self.height, self.fps):
+            self.log_file.write("Frame size and rate changes for {} need a restart\n".format(self.name))
+        self.settings = settings
+        self.blackboxKey = settings.blackboxKey
+        self.build_geometry()
+        if self.camThread is not None and not self.stopped:
+            self.settingsPending = True
+        else:
+            self.set_properties()
+        self.log_file.write("Camera settings reloaded\n")
+
+    # Build the pixel to angle tables of the libraries run on this camera
+    # from its settings and calibration, and share them through its context
+    def build_geometry(self):
+        self.geometry = CameraGeometry.from_settings(self.settings, self.undistorter, self.undistort_img)
+        self.context.geometry = self.geometry
+        return self.geometry
+
+    # Set the adjustable capture properties on the open camera
+    def set_properties(self):
+        self.settingsPending = False
+        self.camStream.set(cv.CAP_PROP_BRIGHTNESS, self.settings.brightness)
+        self.camStream.set(cv.CAP_PROP_EXPOSURE, self.settings.exposure)
 
 
     # Define camera thread start method
+    # While the thread runs, read_frame serves frames from the capture ring
     def start_camera_thread(self):
 
+        # Create the capture ring
+        self.stopped = False
+        self.ring = FrameRing((self.height, self.width, 3), self.ringSize)
+
         # Define camera thread
         camThread = Thread(target=self.update, name=self.name, args=())
         camThread.daemon = True
         camThread.start()
+        self.camThread = camThread
 
         return self
 
@@ -215,10 +496,21 @@ class FRCWebCam:
         # Set stop flag
         self.stopped = True    
 
+        # Wake up anyone waiting on the ring
+        if self.ring is not None:
+            self.ring.close()
+
+        # Wait for the current read to finish before the device is released
+        if self.camThread is not None:
+            self.camThread.join(1.0)
+
 
     # Define threaded update method
     def update(self):
 
+        # Raw frame buffer used when undistorting into the ring
+        rawFrame = np.zeros(shape=(self.height, self.width, 3), dtype=np.uint8)
+
         # Main thread loop
         while True:
 
@@ -226,16 +518,74 @@ class FRCWebCam:
             if self.stopped:
                 return
 
-            # If not stopping, grab new frame
-            self.grabbed, self.frame = self.camStream.read()
+            # Apply reloaded capture properties between frames
+            if self.settingsPending:
+                self.set_properties()
+
+            # If not stopping, grab new frame into a free ring slot
+            try:
+                buffer = self.ring.begin_write()
+                if self.undistort_img == True:
+                    self.grabbed, rawFrame = self.camStream.read(rawFrame)
+                    timestamp = time.monotonic()
+                    if not self.grabbed:
+                        time.sleep(0.01)
+                        continue
+                    if buffer.shape != rawFrame.shape:
+                        buffer = np.zeros(rawFrame.shape, dtype=np.uint8)
+                    frame = self.undistorter.undistort(rawFrame, buffer)
+                else:
+                    self.grabbed, buffer = self.camStream.read(buffer)
+                    timestamp = time.monotonic()
+                    if not self.grabbed:
+                        time.sleep(0.01)
+                        continue
+                    frame = buffer
+                self.ring.commit(buffer, frame, timestamp)
+                self.frame = frame
+
+            except Exception as read_error:
+
+                # Write error to log
+                self.log_file.write("Error reading video:\n    type: {}\n    args: {}\n    {}\n".format(type(read_error), read_error.args, read_error))
+
+
+    # Read the newest frame from the capture ring
+    # Returns (seq, timestamp, frame) or None if no frame is available.
+    # If after is given, waits (up to timeout seconds) for a frame with a
+    # sequence number greater than after.  The returned frame stays valid
+    # until the same thread's next read; pass copy=True if it must be kept
+    # longer.
+    def read_latest(self, after = None, timeout = None, copy = False):
+        if self.ring is None:
+            return None
+        latest = self.ring.read(after, timeout)
+        if latest is None:
+            return None
+        seq, timestamp, frame = latest
+        self.frameSeq = seq
+        self.frameTime = timestamp
+        if copy:
+            frame = frame.copy()
+        return (seq, timestamp, frame)
 
 
     # Define frame read method
-    def read_frame(self):
+    # With the camera thread running this returns the newest captured frame
+    # without blocking, or waits for a frame newer than the after sequence
+    def read_frame(self, after = None, timeout = None):
 
         # Declare frame for undistorted image
         newFrame = np.zeros(shape=(self.width, self.height, 3), dtype=np.uint8)
 
+        if self.ring is not None and not self.stopped:
+            latest = self.read_latest(after, timeout)
+            if latest is not None:
+                newFrame = latest[2]
+            if self.cvs is not None:
+                self.cvs.putFrame(cv.resize(newFrame, (self.width // self.streamRes, self.height // self.streamRes)))
+            return newFrame
+
         try:
 
             # Grab new frame
@@ -243,18 +593,12 @@ class FRCWebCam:
 
             if not self.grabbed:
                 return newFrame
+            self.frameSeq += 1
+            self.frameTime = time.monotonic()
 
             # Undistort image
             if self.undistort_img == True:
-                h, w = frame.shape[:2]
-                new_matrix, roi = cv.getOptimalNewCameraMatrix(self.cam_matrix,
-                                                                self.distort_coeffs,
-                                                                (w,h),1,(w,h))
-                newFrame = cv.undistort(frame, self.cam_matrix,
-                                        self.distort_coeffs, None,
-                                        new_matrix)
-                x,y,w,h = roi
-                newFrame = newFrame[y:y+h,x:x+w]
+                newFrame = self.undistorter.undistort(frame)
 
             else:
 
@@ -273,22 +617,19 @@ class FRCWebCam:
 
 
     # Define video writing method
+    # Frames are queued for the background recorder, so this never blocks
+    # on encoding or disk I/O.  Returns False if the frame was dropped.
     def write_video(self, img):
 
+        # In black box mode frames only go to the in-memory ring
+        if self.blackbox is not None:
+            return self.blackbox.write(img)
+
         # Check if write is opened
         if self.camWriter.isOpened():
 
-            # Write the image
-            try:
-
-                self.camWriter.write(img)
-                return True
-
-            except Exception as write_error:
-
-                # Print exception info
-                self.log_file.write("Error writing video:\n    type: {}\n    args: {}\n    {}\n".format(type(write_error), write_error.args, write_error))
-                return False
+            # Queue the image
+            return self.recorder.write(img)
         
         else:
 
@@ -296,28 +637,78 @@ class FRCWebCam:
             return False
 
 
+    # Flush the black box ring plus the post-trigger window to disk
+    def trigger_blackbox(self, reason = "api"):
+        if self.blackbox is not None:
+            self.blackbox.trigger(reason)
+
+
+    # Trigger the black box from a NetworkTables boolean
+    # The key (BLACKBOX_KEY) is reset once the trigger has been taken
+    def check_blackbox_trigger(self, table):
+        if self.blackbox is not None and table.getBoolean(self.blackboxKey, False):
+            table.putBoolean(self.blackboxKey, False)
+            self.blackbox.trigger("networktables")
+
+
     # Define camera release method
     def release_cam(self):
 
         # Release the camera resource
         self.camStream.release()
 
-        # Release video writer
+        # Stop vision workers
+        for pipeline in self.pipelines.values():
+            pipeline.stop()
+
+        # Finish queued frames and release video writer
+        self.recorder.stop()
+        if self.blackbox is not None:
+            self.blackbox.stop()
         self.camWriter.release()
 
         # Close the log file
+        self.log_file.write("Video frames written: {}, dropped: {}\n".format(self.recorder.written, self.recorder.dropped))
+        self.log_file.write(self.profiler.report() + "\n")
         self.log_file.write("Webcam closed. Video writer closed.\n")
         self.log_file.close()
 
-    def use_libs(self, *libs):
-        frame = self.read_frame()
-        return (frame, *[lib.find_objects(frame, self.width, self.height, self.fov) for lib in libs])
-    
-    def _use_libs_update(self, callback, *libs):
-        callback(*self.use_libs(*libs))
-
+    # Run vision libraries on the next frame
+    # All libraries share one preprocessing context, so the blur and HSV
+    # conversion are done once per frame.  after/timeout are passed to
+    # read_frame to wait for a frame newer than the last one processed, and
+    # copy takes the frame out of the capture ring so it can be kept.
+    # Returns None, without running the libraries, when after is given and
+    # no newer frame arrived before the timeout.
+    # Results are stamped with the frame's capture time, and the capture to
+    # dequeue, preprocessing and detection times go into latency.
+    def use_libs(self, *libs, after = None, timeout = None, copy = False):
+        frame = self.read_frame(after, timeout)
+        if after is not None and self.frameSeq <= after:
+            return None
+        start = time.monotonic()
+        if self.frameTime:
+            self.latency.add('capture', start - self.frameTime)
+        if copy:
+            frame = frame.copy()
+        self.context.set_frame(frame, self.frameSeq, self.frameTime)
+        for lib in libs:
+            lib.context = self.context
+        results = [lib.detect(frame, self.width, self.height, self.fov) for lib in libs]
+        preprocess = self.context.preprocessTime
+        self.latency.add('preprocess', preprocess)
+        self.latency.add('detect', time.monotonic() - start - preprocess)
+        return (frame, *results)
+
+    # Run vision libraries on a persistent worker thread
+    # The worker for each name is created once and reused, so no thread is
+    # started per frame.  Returns the pipeline; call its wait() for results.
     def use_libs_async(self, *libs, callback = lambda _: None, name = "vision"):
-        thread = Thread(target=self._use_libs_update, args=(callback, *libs), name=name)
-        thread.daemon = True
-        thread.start()
-        return thread
+        pipeline = self.pipelines.get(name)
+        if pipeline is None or pipeline.libs != libs or pipeline.callback is not callback:
+            if pipeline is not None:
+                pipeline.stop()
+            pipeline = VisionPipeline(self, *libs, callback=callback, name=name).start()
+            self.pipelines[name] = pipeline
+        pipeline.submit()
+        return pipeline
@@ -0,0 +1,138 @@
+##################################################################
+#                                                                #
+#                   FRC Color Classifier                         #
+#                                                                #
+#  This class compiles all HSV ranges in the vision settings     #
+#  into lookup tables, so one pass over a frame labels every     #
+#  pixel with a bitmask of the game element classes it belongs  #
+#  to.  A quantized 3D table on BGR input skips the HSV          #
+#  conversion entirely.                                          #
+#                                                                #
+#  @Version: 1.0                                                 #
+#  @Created: 2023-03-04                                          #
+#  @Author: Team 4121                                            #
+#                                                                #
+##################################################################
+
+'''FRC Color Classifier - Labels all configured color classes in one pass'''
+
+# Module Imports
+import cv2 as cv
+import numpy as np
+from FRCVisionBase import VisionBase
+from FRCVisionConfig import hsv_schema
+
+# Keys that make a vision settings section a color class
+range_keys = ('HMIN', 'HMAX', 'SMIN', 'SMAX', 'VMIN', 'VMAX')
+
+# Classes fit in the bits of a uint8 label image
+max_classes = 8
+
+
+# Define the class
+class ColorClassifier:
+
+    # Define class initialization
+    # sections limits the classes to the given vision settings sections,
+    # otherwise every section with a full HSV range is used.  bits is the
+    # number of bits per channel kept in the BGR lookup table.
+    def __init__(self, sections = None, bits = 6, useBGR = False):
+        self.sections = sections
+        self.bits = bits
+        self.useBGR = useBGR
+        self.version = None
+        self.classes = {}
+        self.ranges = {}
+        self.hsvLUT = None
+        self.bgrLUT = None
+        self.bgrIndex = None
+        self.build()
+
+
+    # Rebuild the lookup tables if the vision settings have been reloaded
+    def ensure(self):
+        if self.version != VisionBase.version:
+            self.build()
+
+
+    # Compile the HSV ranges of all classes into lookup tables
+    def build(self):
+
+        self.version = VisionBase.version
+        self.classes = {}
+        self.ranges = {}
+
+        # Find the color classes
+        names = self.sections if self.sections is not None else list(VisionBase.config.keys())
+        for name in names:
+            section = VisionBase.config.get(name, {})
+            if not all(key in section for key in range_keys):
+                continue
+            if len(self.classes) >= max_classes:
+                print("Color classifier is full, ignoring {}!".format(name))
+                continue
+            # Use the compiled range, so bad values are reported (and fall
+            # back to their defaults) as they are for the libraries
+            params = VisionBase.compile_params(hsv_schema, name)
+            self.classes[name] = 1 << len(self.classes)
+            self.ranges[name] = (params.hsvMin, params.hsvMax)
+
+        # Separable per-channel tables for HSV input (exact, as the ranges are boxes)
+        self.hsvLUT = [np.zeros(256, dtype=np.uint8) for channel in range(3)]
+        values = np.arange(256)
+        for name, bit in self.classes.items():
+            low, high = self.ranges[name]
+            for channel in range(3):
+                inside = (values >= low[channel]) & (values <= high[channel])
+                self.hsvLUT[channel][inside] |= bit
+
+        # Quantized 3D table for BGR input, built by converting the center of
+        # every BGR cell to HSV and labelling it with the separable table
+        if self.useBGR:
+            shift = 8 - self.bits
+            levels = 1 << self.bits
+            centers = (np.arange(levels, dtype=np.uint16) << shift) + ((1 << shift) >> 1)
+            centers = centers.astype(np.uint8)
+            b, g, r = np.meshgrid(centers, centers, centers, indexing='ij')
+            grid = np.dstack((b.reshape(-1, 1), g.reshape(-1, 1), r.reshape(-1, 1)))
+            labels = self.classify_hsv(cv.cvtColor(grid, cv.COLOR_BGR2HSV))
+            self.bgrLUT = labels.reshape(-1)
+
+            # Per-channel index contributions, so the 3D index is two ORs
+            index = (np.arange(256, dtype=np.uint32) >> shift)
+            self.bgrIndex = (index << (2 * self.bits), index << self.bits, index)
+
+
+    # Label an HSV image, returning a uint8 image of class bitmasks
+    def classify_hsv(self, hsv, out = None):
+        h, s, v = cv.split(hsv)
+        out = cv.bitwise_and(cv.LUT(h, self.hsvLUT[0]), cv.LUT(s, self.hsvLUT[1]), dst=out)
+        return cv.bitwise_and(out, cv.LUT(v, self.hsvLUT[2]), dst=out)
+
+
+    # Label a BGR image with the quantized 3D table
+    def classify_bgr(self, bgr):
+        index = np.take(self.bgrIndex[0], bgr[..., 0])
+        np.bitwise_or(index, np.take(self.bgrIndex[1], bgr[..., 1]), out=index)
+        np.bitwise_or(index, np.take(self.bgrIndex[2], bgr[..., 2]), out=index)
+        return np.take(self.bgrLUT, index)
+
+
+    # Return the bit for a class, or None if the class is not compiled
+    # in with exactly the given range
+    def bit(self, name, hsvMin = None, hsvMax = None):
+        if name not in self.classes:
+            return None
+        if hsvMin is not None and hsvMax is not None:
+            low, high = self.ranges[name]
+            if tuple(hsvMin) != low or tuple(hsvMax) != high:
+                return None
+        return self.classes[name]
+
+
+    # Extract a 0/255 mask for one class from a label image
+    @staticmethod
+    def mask(labels, bit, out = None):
+        out = cv.bitwise_and(labels, bit, dst=out)
+        _, out = cv.threshold(out, 0, 255, cv.THRESH_BINARY, dst=out)
+        return out
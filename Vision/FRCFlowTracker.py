@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python3
+
+######################################################################
+#                                                                    #
+#                      FRC Flow Tracker Library                      #
+#                                                                    #
+#  This class follows a library's found objects between full         #
+#  detections with pyramidal Lucas-Kanade optical flow on a          #
+#  downscaled grayscale image.  Corner points are picked inside each #
+#  object's box on the detection frame, and each following frame     #
+#  moves and scales the box by the median motion of its points.      #
+#                                                                    #
+# @Version: 1.0                                                      #
+# @Created: 2023-03-04                                               #
+# @Author: Team 4121                                                 #
+#                                                                    #
+######################################################################
+
+"""FRC Flow Tracker Library - Provides optical flow tracking of found objects"""
+
+# Module Imports
+import cv2 as cv
+import numpy as np
+from FRCObjectTracker import object_box
+
+# Lucas-Kanade settings
+lk_params = dict(winSize=(11, 11), maxLevel=2,
+                 criteria=(cv.TERM_CRITERIA_EPS | cv.TERM_CRITERIA_COUNT, 10, 0.03))
+
+
+# Define the flow tracker class
+class FlowTracker:
+
+    # Define initialization
+    # maxPoints is the number of corner points followed per object, and
+    # maxError the forward-backward error (downscaled pixels) for a point
+    # to be kept
+    def __init__(self, maxPoints = 12, maxError = 1.0):
+        self.maxPoints = maxPoints
+        self.maxError = maxError
+        self.objects = []
+        self.boxes = []
+        self.points = []
+        self.gray = None
+        self.frames = 0
+        self.scale = 1
+
+    # Start following the objects of a full detection
+    # gray is the frame downscaled by scale, frames is the number of frames
+    # to follow before the next full detection
+    def start(self, gray, objects, scale, frames):
+        self.gray = gray
+        self.scale = scale
+        self.frames = frames
+        self.objects = list(objects)
+        self.boxes = []
+        self.points = []
+        height, width = gray.shape[:2]
+        for obj in self.objects:
+            # Pick corners inside the box (not the background around it)
+            box, _ = object_box(obj)
+            x0 = int(max(0, np.ceil(box[0] / scale)))
+            y0 = int(max(0, np.ceil(box[1] / scale)))
+            x1 = int(min(width, (box[0] + box[2]) / scale))
+            y1 = int(min(height, (box[1] + box[3]) / scale))
+            points = None
+            if x1 - x0 >= 3 and y1 - y0 >= 3:
+                points = cv.goodFeaturesToTrack(gray[y0:y1, x0:x1], self.maxPoints, 0.01, 2)
+                if points is not None:
+                    points += np.array([x0, y0], dtype=np.float32)
+            if points is None or len(points) < 2:
+                # Fall back to the box corners
+                points = np.array([[[x0, y0]], [[x1 - 1, y0]], [[x0, y1 - 1]], [[x1 - 1, y1 - 1]]], dtype=np.float32)
+            self.boxes.append(tuple(float(value) for value in box))
+            self.points.append(points.astype(np.float32))
+
+    # Follow the objects to a new frame
+    # Returns the moved boxes (x, y, w, h) in full frame pixels, or None if
+    # a full detection is due (no objects, frames used up, object lost)
+    def follow(self, gray):
+
+        if self.gray is None or self.frames <= 0 or len(self.objects) == 0 or gray.shape != self.gray.shape:
+            return None
+        self.frames -= 1
+
+        # Track all points at once, checking them forward and backward
+        counts = [len(points) for points in self.points]
+        previous = np.concatenate(self.points)
+        current, status, _ = cv.calcOpticalFlowPyrLK(self.gray, gray, previous, None, **lk_params)
+        back, backStatus, _ = cv.calcOpticalFlowPyrLK(gray, self.gray, current, None, **lk_params)
+        error = np.linalg.norm((previous - back).reshape(-1, 2), axis=1)
+        good = (status.ravel() == 1) & (backStatus.ravel() == 1) & (error < self.maxError)
+
+        # Move and scale each box by the median motion of its good points
+        boxes = []
+        points = []
+        start = 0
+        for count, box in zip(counts, self.boxes):
+            keep = good[start:start+count]
+            old = previous[start:start+count][keep].reshape(-1, 2)
+            new = current[start:start+count][keep].reshape(-1, 2)
+            start += count
+            if len(new) < 2:
+                self.frames = 0
+                return None
+            shift = np.median(new - old, axis=0).astype(np.float64) * self.scale
+            oldSpread = np.linalg.norm(old - old.mean(axis=0), axis=1)
+            newSpread = np.linalg.norm(new - new.mean(axis=0), axis=1)
+            used = oldSpread > 0.5
+            ratio = float(np.median(newSpread[used] / oldSpread[used])) if np.any(used) else 1.0
+            x, y, w, h = box
+            cx = x + w / 2 + shift[0]
+            cy = y + h / 2 + shift[1]
+            w *= ratio
+            h *= ratio
+            boxes.append((cx - w / 2, cy - h / 2, w, h))
+            points.append(new.reshape(-1, 1, 2))
+
+        self.gray = gray
+        self.boxes = boxes
+        self.points = points
+        return boxes
+
+    # Forget the followed objects (the next frame gets a full detection)
+    def reset(self):
+        self.frames = 0
+        self.objects = []
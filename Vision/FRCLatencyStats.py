@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python3
+
+######################################################################
+#                                                                    #
+#                      FRC Latency Stats Library                     #
+#                                                                    #
+#  This class keeps the latency of the last frames through each      #
+#  stage of a camera's vision pipeline (capture to dequeue,          #
+#  preprocessing, detection, publishing and capture to publish) and  #
+#  reports rolling p50, p95 and p99 values, so latency regressions   #
+#  can be seen at events.                                            #
+#                                                                    #
+# @Version: 1.0                                                      #
+# @Created: 2023-03-04                                               #
+# @Author: Team 4121                                                 #
+#                                                                    #
+######################################################################
+
+"""FRC Latency Stats Library - Provides rolling latency percentiles"""
+
+# Module Imports
+import numpy as np
+from threading import Lock
+
+# Stages of a camera's vision pipeline
+latency_stages = ('capture', 'preprocess', 'detect', 'publish', 'total')
+
+# Reported percentiles
+latency_percentiles = (50, 95, 99)
+
+
+# Define the latency stats class
+# Each stage keeps its last window samples (milliseconds) in a ring
+class LatencyStats:
+
+    # Define initialization
+    def __init__(self, stages = latency_stages, window = 300):
+        self.stages = tuple(stages)
+        self.window = window
+        self.samples = np.zeros((len(self.stages), window))
+        self.counts = np.zeros(len(self.stages), dtype=np.int64)
+        self.index = {stage: number for number, stage in enumerate(self.stages)}
+        self.lock = Lock()
+
+    # Add a sample (seconds) to a stage
+    def add(self, stage, seconds):
+        number = self.index[stage]
+        with self.lock:
+            self.samples[number, self.counts[number] % self.window] = seconds * 1000.0
+            self.counts[number] += 1
+
+    # Return the (p50, p95, p99) of a stage in milliseconds, or None if
+    # the stage has no samples
+    def percentiles(self, stage):
+        number = self.index[stage]
+        with self.lock:
+            count = min(self.counts[number], self.window)
+            if count == 0:
+                return None
+            samples = self.samples[number, :count].copy()
+        return tuple(np.percentile(samples, latency_percentiles).tolist())
+
+    # Return the percentiles of every stage as one list (for NetworkTables)
+    # [capture p50, p95, p99, preprocess p50, ...], -1 for empty stages
+    def summary(self):
+        values = []
+        for stage in self.stages:
+            values.extend(self.percentiles(stage) or (-1.0,) * len(latency_percentiles))
+        return values
+
+    # Return a one line report of every stage with samples
+    def report(self, name):
+        parts = []
+        for stage in self.stages:
+            values = self.percentiles(stage)
+            if values is not None:
+                parts.append("{} {:.1f}/{:.1f}/{:.1f}".format(stage, *values))
+        return "{} latency ms (p50/p95/p99): {}".format(name, ", ".join(parts) if parts else "no frames")
@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python3
+
+######################################################################
+#                                                                    #
+#                     FRC Object Tracker Library                     #
+#                                                                    #
+#  This class follows a library's found objects from frame to frame  #
+#  so each one keeps a stable track ID.  Every track has a constant  #
+#  velocity Kalman filter on its center, detections are matched to   #
+#  tracks greedily by box overlap (IoU), distance and angle are      #
+#  smoothed, and tracks coast on their prediction through frames     #
+#  where they were not detected (or detection was skipped).          #
+#                                                                    #
+# @Version: 1.0                                                      #
+# @Created: 2023-03-04                                               #
+# @Author: Team 4121                                                 #
+#                                                                    #
+######################################################################
+
+"""FRC Object Tracker Library - Provides persistent IDs for found objects"""
+
+# System imports
+import copy
+
+# Module Imports
+import numpy as np
+
+
+# Return the box (x, y, w, h) of a found object, and whether its x and y
+# are its center (objects with a radius) rather than its top left corner
+def object_box(obj):
+    if obj.w is not None and obj.h is not None:
+        return (obj.x, obj.y, obj.w, obj.h), False
+    if obj.radius is not None:
+        return (obj.x - obj.radius, obj.y - obj.radius, 2 * obj.radius, 2 * obj.radius), True
+    return (obj.x, obj.y, 0, 0), True
+
+
+# Return the intersection over union of two boxes
+def box_iou(a, b):
+    w = min(a[0] + a[2], b[0] + b[2]) - max(a[0], b[0])
+    h = min(a[1] + a[3], b[1] + b[3]) - max(a[1], b[1])
+    if w <= 0 or h <= 0:
+        return 0.0
+    inter = w * h
+    return inter / (a[2] * a[3] + b[2] * b[3] - inter)
+
+
+# Define the track class
+# One followed object: Kalman state [cx, cy, vx, vy] (pixels and pixels
+# per second), its last box size and its smoothed distance and angle
+class Track:
+
+    # Measurement matrix (the center is measured)
+    H = np.array([[1.0, 0.0, 0.0, 0.0], [0.0, 1.0, 0.0, 0.0]])
+
+    # Define initialization
+    def __init__(self, trackId, obj, timestamp, processNoise, measureNoise):
+        box, centered = object_box(obj)
+        self.id = trackId
+        self.obj = obj
+        self.centered = centered
+        self.size = (box[2], box[3])
+        self.state = np.array([box[0] + box[2] / 2, box[1] + box[3] / 2, 0.0, 0.0])
+        self.cov = np.diag([measureNoise, measureNoise, 1e6, 1e6])
+        self.processNoise = processNoise
+        self.measureNoise = measureNoise
+        self.timestamp = timestamp
+        self.distance = obj.distance
+        self.angle = obj.angle
+        self.hits = 1
+        self.age = 1
+        self.misses = 0
+
+    # Predicted state at a time, without changing the track
+    def predicted(self, timestamp):
+        dt = max(0.0, timestamp - self.timestamp)
+        F = np.eye(4)
+        F[0, 2] = F[1, 3] = dt
+        q = self.processNoise
+        Q = np.zeros((4, 4))
+        Q[0, 0] = Q[1, 1] = q * dt ** 4 / 4
+        Q[0, 2] = Q[2, 0] = Q[1, 3] = Q[3, 1] = q * dt ** 3 / 2
+        Q[2, 2] = Q[3, 3] = q * dt ** 2
+        return F @ self.state, F @ self.cov @ F.T + Q
+
+    # Move the track to a time
+    def predict(self, timestamp):
+        self.state, self.cov = self.predicted(timestamp)
+        self.timestamp = max(self.timestamp, timestamp)
+
+    # Predicted box (x, y, w, h) at a time
+    def box(self, timestamp = None):
+        state = self.state if timestamp is None else self.predicted(timestamp)[0]
+        return (state[0] - self.size[0] / 2, state[1] - self.size[1] / 2, self.size[0], self.size[1])
+
+    # Correct the track with a matched detection
+    def correct(self, obj, smoothing):
+        box, _ = object_box(obj)
+        z = np.array([box[0] + box[2] / 2, box[1] + box[3] / 2])
+        S = self.H @ self.cov @ self.H.T + np.eye(2) * self.measureNoise
+        K = self.cov @ self.H.T @ np.linalg.inv(S)
+        self.state = self.state + K @ (z - self.H @ self.state)
+        self.cov = (np.eye(4) - K @ self.H) @ self.cov
+        self.size = (box[2], box[3])
+        self.obj = obj
+        self.distance = self.smooth(self.distance, obj.distance, smoothing)
+        self.angle = self.smooth(self.angle, obj.angle, smoothing)
+        self.hits += 1
+        self.misses = 0
+
+    # Exponentially smooth a value (None if either value is missing)
+    @staticmethod
+    def smooth(old, new, smoothing):
+        if old is None or new is None:
+            return new
+        return smoothing * old + (1.0 - smoothing) * new
+
+    # Return the track as a found object at its current state
+    def found_object(self):
+        obj = copy.copy(self.obj)
+        cx, cy = self.state[0], self.state[1]
+        if self.centered:
+            x, y = cx, cy
+        else:
+            x, y = cx - self.size[0] / 2, cy - self.size[1] / 2
+        if isinstance(self.obj.x, (int, np.integer)):
+            x, y = int(round(x)), int(round(y))
+        obj.x = x
+        obj.y = y
+        obj.distance = self.distance
+        obj.angle = self.angle
+        obj.trackId = self.id
+        obj.age = self.age
+        return obj
+
+
+# Define the object tracker class
+class ObjectTracker:
+
+    # Define initialization
+    # minIou is the overlap needed to match a detection to a track, coast
+    # is how many frames a track survives without a detection, smoothing
+    # is the weight of the old distance and angle (0 for none) and minHits
+    # is how many detections a track needs before it is reported
+    def __init__(self, minIou = 0.3, coast = 5, smoothing = 0.5, minHits = 1, processNoise = 2.5e5, measureNoise = 4.0):
+        self.tracks = []
+        self.nextId = 1
+        self.processNoise = processNoise
+        self.measureNoise = measureNoise
+        self.configure(minIou, coast, smoothing, minHits)
+
+    # Change the tracker settings (keeps the current tracks)
+    def configure(self, minIou, coast, smoothing, minHits):
+        self.minIou = minIou
+        self.coast = coast
+        self.smoothing = smoothing
+        self.minHits = minHits
+
+    # Match a frame's detections to the tracks and return the tracked
+    # objects (oldest track first), including coasting tracks
+    def update(self, objects, timestamp):
+
+        # Move every track to this frame
+        for track in self.tracks:
+            track.predict(timestamp)
+            track.age += 1
+
+        # Greedy matching, best overlap first
+        boxes = [object_box(obj)[0] for obj in objects]
+        pairs = []
+        for t, track in enumerate(self.tracks):
+            trackBox = track.box()
+            for d, box in enumerate(boxes):
+                iou = box_iou(trackBox, box)
+                if iou >= self.minIou:
+                    pairs.append((iou, t, d))
+        pairs.sort(reverse=True)
+        matchedTracks = set()
+        matchedObjects = set()
+        for iou, t, d in pairs:
+            if t in matchedTracks or d in matchedObjects:
+                continue
+            self.tracks[t].correct(objects[d], self.smoothing)
+            matchedTracks.add(t)
+            matchedObjects.add(d)
+
+        # Age out unmatched tracks and start tracks for new objects
+        for t, track in enumerate(self.tracks):
+            if t not in matchedTracks:
+                track.misses += 1
+        self.tracks = [track for track in self.tracks if track.misses <= self.coast]
+        for d, obj in enumerate(objects):
+            if d not in matchedObjects:
+                self.tracks.append(Track(self.nextId, obj, timestamp, self.processNoise, self.measureNoise))
+                self.nextId += 1
+
+        return self.objects()
+
+    # Return the tracks predicted to a frame where detection was skipped
+    def predict(self, timestamp):
+        for track in self.tracks:
+            track.predict(timestamp)
+            track.age += 1
+        return self.objects()
+
+    # Return the reported tracks as found objects, oldest track first
+    def objects(self):
+        return [track.found_object() for track in self.tracks if track.hits >= self.minHits]
+
+    # Forget all tracks
+    def reset(self):
+        self.tracks = []
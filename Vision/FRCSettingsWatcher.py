@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python3
+
+######################################################################
+#                                                                    #
+#                     FRC Settings Watcher Library                   #
+#                                                                    #
+#  This class watches the vision and camera settings files and       #
+#  reloads them when they change, so HSV ranges and camera settings  #
+#  can be retuned at an event without restarting the program.        #
+#  Files are polled by modification time on a background thread and  #
+#  only reloaded once they have stopped changing.                    #
+#                                                                    #
+# @Version: 1.0                                                      #
+# @Created: 2023-03-04                                               #
+# @Author: Team 4121                                                 #
+#                                                                    #
+######################################################################
+
+"""FRC Settings Watcher Library - Provides hot reload of settings files"""
+
+# System imports
+import os
+import time
+import traceback
+
+# Module Imports
+from threading import Thread, Event
+
+
+# Define the settings watcher class
+class SettingsWatcher:
+
+    # Define initialization
+    # interval is the polling period in seconds
+    def __init__(self, interval = 1.0, log_file = None, name = "settings_watcher"):
+        self.interval = interval
+        self.log_file = log_file
+        self.name = name
+
+        # Watched files: file -> [callback, last loaded stamp, last seen stamp]
+        self.files = {}
+        self.reloads = 0
+        self.errors = 0
+
+        # Initialize stop flag
+        self.stopped = Event()
+        self.thread = None
+
+
+    # Watch a file, calling callback(file) on the watcher thread whenever
+    # it changes.  The callback should parse the file and swap in the new
+    # settings, returning False if the file could not be loaded.
+    def watch(self, file, callback):
+        stamp = self.stamp(file)
+        self.files[file] = [callback, stamp, stamp]
+        return self
+
+
+    # Return (modification time, size) of a file, or None if it is missing
+    def stamp(self, file):
+        try:
+            info = os.stat(file)
+        except OSError:
+            return None
+        return (info.st_mtime_ns, info.st_size)
+
+
+    # Define watcher thread start method
+    def start(self):
+
+        self.stopped.clear()
+        self.thread = Thread(target=self.update, name=self.name, args=())
+        self.thread.daemon = True
+        self.thread.start()
+
+        return self
+
+
+    # Check every watched file once, reloading the ones that changed
+    # A change is only reloaded when the file looks the same on two polls
+    # in a row, so a file that is still being written is not read
+    def check(self):
+
+        for file, entry in self.files.items():
+            callback, loaded, seen = entry
+            stamp = self.stamp(file)
+            entry[2] = stamp
+            if stamp is None or stamp == loaded or stamp != seen:
+                continue
+
+            try:
+                if callback(file) is False:
+                    raise ValueError("settings file could not be loaded")
+                entry[1] = stamp
+                self.reloads += 1
+                self.log("Reloaded settings file {}".format(file))
+            except Exception as reload_error:
+                # Keep the current settings, try again on the next change
+                entry[1] = stamp
+                self.errors += 1
+                self.log("Error reloading settings file {}: {}".format(file, reload_error))
+                traceback.print_exc()
+
+
+    # Define threaded update method
+    def update(self):
+
+        while not self.stopped.wait(self.interval):
+            self.check()
+
+
+    # Write a message to the log file (and the console)
+    def log(self, message):
+        print(message)
+        if self.log_file is not None:
+            self.log_file.write("{}: {}\n".format(time.strftime("%H:%M:%S"), message))
+
+
+    # Stop the watcher thread
+    def stop(self, timeout = None):
+
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join(timeout)
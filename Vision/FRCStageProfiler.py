@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python3
+
+######################################################################
+#                                                                    #
+#                      FRC Stage Profiler Library                    #
+#                                                                    #
+#  This class measures how long each stage of the vision processing  #
+#  takes (blur, color conversion, inRange, Canny, morphology,        #
+#  findContours, the metrics code) with perf_counter_ns.  Times go   #
+#  into fixed size histograms, so profiling adds no per frame        #
+#  allocation, and it can be switched on and off while running.      #
+#                                                                    #
+# @Version: 1.0                                                      #
+# @Created: 2023-03-04                                               #
+# @Author: Team 4121                                                 #
+#                                                                    #
+######################################################################
+
+"""FRC Stage Profiler Library - Provides per stage timing histograms"""
+
+# System imports
+import time
+
+# Stages profiled for each library
+library_stages = ('preprocess', 'inrange', 'canny', 'morphology', 'contours', 'components', 'find_objects', 'metrics')
+
+# Stages profiled for each camera's shared preprocessing
+context_stages = ('blur', 'hsv', 'scaled', 'gray', 'thumbnail', 'labels')
+
+# Histogram layout: 4 bins per power of two of nanoseconds, up to 2^40 ns
+bins_per_octave = 4
+max_bits = 40
+bin_count = bins_per_octave * (max_bits - 1)
+
+
+# Return the histogram bin of a time in nanoseconds
+def histogram_bin(ns):
+    bits = ns.bit_length()
+    if bits <= 2:
+        return ns
+    if bits > max_bits:
+        return bin_count - 1
+    return bins_per_octave * (bits - 2) + ((ns >> (bits - 3)) & 3)
+
+
+# Return the (lower edge, width) in nanoseconds of a histogram bin
+def bin_range(index):
+    if index < bins_per_octave:
+        return index, 1
+    bits = index // bins_per_octave + 2
+    width = 1 << (bits - 3)
+    return (bins_per_octave + index % bins_per_octave) * width, width
+
+
+# Define the stage profiler class
+class StageProfiler:
+
+    # Profiling switch for every profiler (can be changed while running)
+    enabled = False
+
+    # Define initialization
+    def __init__(self, name, stages = library_stages):
+        self.name = name
+        self.stages = tuple(stages)
+        self.index = {stage: number for number, stage in enumerate(self.stages)}
+        self.histograms = [[0] * bin_count for _ in self.stages]
+        self.counts = [0] * len(self.stages)
+        self.totals = [0] * len(self.stages)
+        self.maxima = [0] * len(self.stages)
+        self.measured = 0
+
+    # Return the start time of a stage, or 0 when profiling is off
+    def start(self):
+        return time.perf_counter_ns() if StageProfiler.enabled else 0
+
+    # Record a stage that began at start (from start or mark) and return
+    # the current time, so consecutive stages can be chained
+    def mark(self, stage, start):
+        if not start:
+            return 0
+        now = time.perf_counter_ns()
+        self.add(stage, now - start)
+        return now
+
+    # Add a time in nanoseconds to a stage
+    def add(self, stage, ns):
+        if not StageProfiler.enabled:
+            return
+        number = self.index[stage]
+        self.histograms[number][histogram_bin(ns)] += 1
+        self.counts[number] += 1
+        self.totals[number] += ns
+        if ns > self.maxima[number]:
+            self.maxima[number] = ns
+        self.measured += ns
+
+    # Start timing a call whose own stages are profiled inside it
+    # Returns (start, stage time so far) for end
+    def begin(self):
+        if not StageProfiler.enabled:
+            return (0, 0)
+        return (time.perf_counter_ns(), self.measured)
+
+    # Finish timing a call: the whole call goes to stage and the time not
+    # spent in other profiled stages to rest (such as the metrics code)
+    def end(self, stage, rest, begun):
+        start, measured = begun
+        if not start:
+            return
+        elapsed = time.perf_counter_ns() - start
+        inner = self.measured - measured
+        self.add(stage, elapsed)
+        self.add(rest, max(0, elapsed - inner))
+
+    # Return the estimated percentile (0-100) of a stage in nanoseconds
+    def percentile(self, stage, percent):
+        number = self.index[stage]
+        count = self.counts[number]
+        if count == 0:
+            return None
+        target = percent / 100.0 * count
+        seen = 0
+        for index, binCount in enumerate(self.histograms[number]):
+            seen += binCount
+            if binCount and seen >= target:
+                lower, width = bin_range(index)
+                return min(lower + width / 2, float(self.maxima[number]))
+        return float(self.maxima[number])
+
+    # Forget all measurements
+    def reset(self):
+        for histogram in self.histograms:
+            histogram[:] = [0] * bin_count
+        self.counts[:] = [0] * len(self.stages)
+        self.totals[:] = [0] * len(self.stages)
+        self.maxima[:] = [0] * len(self.stages)
+        self.measured = 0
+
+    # Return a report of every stage with samples (times in milliseconds)
+    def report(self):
+        lines = ["Profile of {}:".format(self.name),
+                 "    {:12s} {:>8s} {:>9s} {:>8s} {:>8s} {:>8s} {:>8s}".format(
+                     "stage", "count", "total", "mean", "p50", "p95", "max")]
+        for number, stage in enumerate(self.stages):
+            count = self.counts[number]
+            if count == 0:
+                continue
+            lines.append("    {:12s} {:8d} {:9.1f} {:8.3f} {:8.3f} {:8.3f} {:8.3f}".format(
+                stage, count, self.totals[number] / 1e6, self.totals[number] / count / 1e6,
+                self.percentile(stage, 50) / 1e6, self.percentile(stage, 95) / 1e6,
+                self.maxima[number] / 1e6))
+        if len(lines) == 2:
+            lines.append("    no samples")
+        return "\n".join(lines)
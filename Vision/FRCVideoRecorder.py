@@ -0,0 +1,370 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python3
+
+######################################################################
+#                                                                    #
+#                      FRC Video Recorder Library                    #
+#                                                                    #
+#  This class writes video frames on a background thread so that     #
+#  the vision thread never blocks on encoding or SD card I/O.        #
+#  Frames are passed through a bounded queue and dropped according   #
+#  to a configurable policy when the writer falls behind.  A black   #
+#  box recorder keeps the last few seconds in memory and only        #
+#  writes them to disk when triggered.                               #
+#                                                                    #
+# @Version: 1.0                                                      #
+# @Created: 2023-03-04                                               #
+# @Author: Team 4121                                                 #
+#                                                                    #
+######################################################################
+
+"""FRC Video Recorder Library - Provides asynchronous video recording"""
+
+# System imports
+import os
+import time
+
+# Module Imports
+import cv2 as cv
+import numpy as np
+from collections import deque
+from threading import Thread, Condition
+
+# Drop policies used when the queue is full
+DROP_OLDEST = "OLDEST"
+DROP_NTH = "NTH"
+
+
+# Define the video recorder class
+class VideoRecorder:
+
+    # Define initialization
+    # writer is any object with write(img) and release() (cv.VideoWriter)
+    # policy is DROP_OLDEST (discard the oldest queued frame) or DROP_NTH
+    # (thin the queued backlog by discarding every nth frame)
+    def __init__(self, writer, queueSize = 30, policy = DROP_OLDEST, dropNth = 2, log_file = None, name = "recorder"):
+        self.writer = writer
+        self.queueSize = max(1, queueSize)
+        self.policy = policy.upper()
+        self.dropNth = max(2, dropNth)
+        self.log_file = log_file
+        self.name = name
+
+        # Queue of frames waiting to be written and spare frame buffers
+        self.queue = deque()
+        self.spare = []
+        self.condition = Condition()
+
+        # Counters
+        self.written = 0
+        self.dropped = 0
+        self.errors = 0
+
+        # Initialize stop flag
+        self.stopped = False
+        self.thread = None
+
+
+    # Define recorder thread start method
+    def start(self):
+
+        self.stopped = False
+        self.thread = Thread(target=self.update, name=self.name, args=())
+        self.thread.daemon = True
+        self.thread.start()
+
+        return self
+
+
+    # Queue a frame for writing, never blocking on the writer
+    # The frame is copied, so the caller may reuse its buffer immediately
+    # Returns False if the frame itself had to be dropped
+    def write(self, img):
+
+        with self.condition:
+
+            if self.stopped:
+                return False
+
+            # Make room according to the drop policy
+            if len(self.queue) >= self.queueSize:
+                if self.policy == DROP_NTH and len(self.queue) >= self.dropNth:
+                    kept = deque()
+                    for count, frame in enumerate(self.queue, 1):
+                        if count % self.dropNth == 0:
+                            self.spare.append(frame)
+                            self.dropped += 1
+                        else:
+                            kept.append(frame)
+                    self.queue = kept
+                else:
+                    self.spare.append(self.queue.popleft())
+                    self.dropped += 1
+
+            # Reuse a spare buffer if one of the right shape is available
+            buffer = None
+            while len(self.spare) > 0 and buffer is None:
+                candidate = self.spare.pop()
+                if candidate.shape == img.shape and candidate.dtype == img.dtype:
+                    buffer = candidate
+
+        if buffer is None:
+            buffer = np.empty_like(img)
+        np.copyto(buffer, img)
+
+        with self.condition:
+            self.queue.append(buffer)
+            self.condition.notify()
+
+        return True
+
+
+    # Define threaded update method
+    def update(self):
+
+        # Main thread loop
+        while True:
+
+            with self.condition:
+                self.condition.wait_for(lambda: len(self.queue) > 0 or self.stopped)
+                if len(self.queue) == 0:
+                    return
+                frame = self.queue.popleft()
+
+            # Write the frame outside the lock
+            try:
+                self.writer.write(frame)
+                self.written += 1
+
+            except Exception as write_error:
+
+                # Write error to log
+                self.errors += 1
+                if self.log_file is not None:
+                    self.log_file.write("Error writing video:\n    type: {}\n    args: {}\n    {}\n".format(type(write_error), write_error.args, write_error))
+
+            with self.condition:
+                if len(self.spare) < self.queueSize:
+                    self.spare.append(frame)
+
+
+    # Number of frames waiting to be written
+    def pending(self):
+        with self.condition:
+            return len(self.queue)
+
+
+    # Stop the recorder, writing out any queued frames first
+    def stop(self, timeout = None):
+
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+
+        if self.thread is not None:
+            self.thread.join(timeout)
+
+
+# Define the black box recorder class
+# Keeps the last few seconds of frames in memory as JPEG images in a fixed
+# size ring.  When triggered, the ring plus a post-trigger window is written
+# to disk as a motion JPEG file (concatenated JPEG images).
+class BlackBoxRecorder:
+
+    # Define initialization
+    # seconds and fps size the ring, maxBytes caps the total JPEG memory
+    def __init__(self, directory, prefix, seconds = 10.0, postSeconds = 5.0, fps = 15, maxBytes = 32 * 1024 * 1024, quality = 80, log_file = None, name = "blackbox"):
+        self.directory = directory
+        self.prefix = prefix
+        self.seconds = seconds
+        self.postSeconds = postSeconds
+        self.maxBytes = maxBytes
+        self.quality = quality
+        self.log_file = log_file
+        self.name = name
+
+        # Fixed size ring of encoded frames (pre plus post-trigger window)
+        self.slots = [None] * max(1, int((seconds + postSeconds) * fps))
+        self.times = [0.0] * len(self.slots)
+        self.next = 0
+        self.count = 0
+        self.bytes = 0
+
+        # Latest frame waiting to be encoded
+        self.pending = None
+        self.pendingTime = 0.0
+        self.spare = None
+        self.condition = Condition()
+
+        # Trigger state
+        self.triggerTime = None
+        self.triggerReason = ""
+        self.flushes = 0
+
+        # Counters
+        self.encoded = 0
+        self.dropped = 0
+
+        # Initialize stop flag
+        self.stopped = False
+        self.thread = None
+
+
+    # Define recorder thread start method
+    def start(self):
+
+        self.stopped = False
+        self.thread = Thread(target=self.update, name=self.name, args=())
+        self.thread.daemon = True
+        self.thread.start()
+
+        return self
+
+
+    # Hand a frame to the recorder without blocking
+    # If the previous frame has not been encoded yet it is replaced
+    def write(self, img, timestamp = None):
+
+        if timestamp is None:
+            timestamp = time.monotonic()
+
+        with self.condition:
+
+            if self.stopped:
+                return False
+
+            buffer = self.spare
+            self.spare = None
+            if self.pending is not None:
+                self.dropped += 1
+                buffer = self.pending
+                self.pending = None
+
+        if buffer is None or buffer.shape != img.shape:
+            buffer = np.empty_like(img)
+        np.copyto(buffer, img)
+
+        with self.condition:
+            self.pending = buffer
+            self.pendingTime = timestamp
+            self.condition.notify()
+
+        return True
+
+
+    # Request a flush of the ring plus the post-trigger window
+    # Triggers while a window is already open are merged into it
+    def trigger(self, reason = "api"):
+
+        with self.condition:
+            if self.triggerTime is None:
+                self.triggerTime = time.monotonic()
+                self.triggerReason = reason
+                self.condition.notify()
+
+
+    # Check if a flush is waiting for its post-trigger window
+    def triggered(self):
+        return self.triggerTime is not None
+
+
+    # Define threaded update method
+    def update(self):
+
+        # Main thread loop
+        while True:
+
+            with self.condition:
+                self.condition.wait_for(lambda: self.pending is not None or self.stopped, 0.1)
+                frame = self.pending
+                timestamp = self.pendingTime
+                self.pending = None
+                stopping = self.stopped
+
+            # Compress the frame into the ring
+            if frame is not None:
+                ok, jpeg = cv.imencode(".jpg", frame, [cv.IMWRITE_JPEG_QUALITY, self.quality])
+                with self.condition:
+                    self.spare = frame
+                if ok:
+                    self.add(jpeg.tobytes(), timestamp)
+
+            # Flush once the post-trigger window has passed (or on shutdown)
+            if self.triggerTime is not None:
+                if stopping or time.monotonic() >= self.triggerTime + self.postSeconds:
+                    self.flush()
+
+            if stopping:
+                return
+
+
+    # Add an encoded frame to the ring, evicting old frames to stay in budget
+    def add(self, jpeg, timestamp):
+
+        # Evict the frame being overwritten
+        old = self.slots[self.next]
+        if old is not None:
+            self.bytes -= len(old)
+            self.count -= 1
+
+        self.slots[self.next] = jpeg
+        self.times[self.next] = timestamp
+        self.next = (self.next + 1) % len(self.slots)
+        self.count += 1
+        self.bytes += len(jpeg)
+        self.encoded += 1
+
+        # Evict the oldest frames if over the memory cap or too old
+        # (while triggered, keep everything back to the start of the window)
+        if self.triggerTime is None:
+            start = timestamp - self.seconds
+        else:
+            start = self.triggerTime - self.seconds
+        oldest = (self.next - self.count) % len(self.slots)
+        while self.count > 1 and (self.bytes > self.maxBytes or self.times[oldest] < start):
+            self.bytes -= len(self.slots[oldest])
+            self.slots[oldest] = None
+            self.count -= 1
+            oldest = (oldest + 1) % len(self.slots)
+
+
+    # Write the ring contents to disk and clear it
+    def flush(self):
+
+        reason = self.triggerReason
+        self.flushes += 1
+        filename = os.path.join(self.directory, "{}_blackbox{}.mjpg".format(self.prefix, self.flushes))
+
+        try:
+            with open(filename, "wb") as out_file:
+                oldest = (self.next - self.count) % len(self.slots)
+                for count in range(self.count):
+                    jpeg = self.slots[(oldest + count) % len(self.slots)]
+                    if jpeg is not None:
+                        out_file.write(jpeg)
+            if self.log_file is not None:
+                self.log_file.write("Black box ({}) wrote {} frames to {}\n".format(reason, self.count, filename))
+
+        except Exception as write_error:
+
+            # Write error to log
+            if self.log_file is not None:
+                self.log_file.write("Error writing black box:\n    type: {}\n    args: {}\n    {}\n".format(type(write_error), write_error.args, write_error))
+
+        # Clear the ring so the next event starts fresh
+        self.slots = [None] * len(self.slots)
+        self.count = 0
+        self.bytes = 0
+        with self.condition:
+            self.triggerTime = None
+
+
+    # Stop the recorder, flushing any pending trigger first
+    def stop(self, timeout = None):
+
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+
+        if self.thread is not None:
+            self.thread.join(timeout)
@@ -18,8 +18,173 @@
 import cv2 as cv
 import numpy as np
 import math
-from threading import Thread
+import time
+import copy
+from threading import Thread, Lock, Event
+from queue import Queue
+from FRCVisionConfig import base_schema
+from FRCObjectTracker import ObjectTracker, object_box
+from FRCFlowTracker import FlowTracker
+from FRCCameraGeometry import CameraGeometry
+from FRCStageProfiler import StageProfiler
 
+# Size of the thumbnails compared by the scene change gate
+gate_size = (32, 24)
+
+# Pixels around each pixel read by the 13x13 preprocessing blur
+blur_margin = 13 // 2
+
+
+# Define the preprocessing context class
+# Holds the blurred and HSV images of the current frame so that every
+# library run on that frame shares a single blur and color conversion.
+# Results are keyed by frame sequence and blur size, and the image
+# buffers are reused from frame to frame.  geometry is the CameraGeometry
+# of the camera the frames come from, if known.  preprocessTime is the
+# time (seconds) spent preprocessing the current frame, and profiler an
+# optional StageProfiler (such as the camera's) each step is recorded in.
+class PreprocessContext:
+
+    # Define initialization
+    # classifier is an optional ColorClassifier used to label every color
+    # class of the frame in one pass
+    def __init__(self, classifier = None):
+        self.frame = None
+        self.seq = None
+        self.timestamp = 0.0
+        self.valid = set()
+        self.blurred = {}
+        self.hsv = {}
+        self.labelled = {}
+        self.classifier = classifier
+        self.geometry = None
+        self.preprocessTime = 0.0
+        self.profiler = None
+        self.lock = Lock()
+
+    # Start a new frame
+    def set_frame(self, frame, seq = None, timestamp = 0.0):
+        with self.lock:
+            self.frame = frame
+            self.seq = seq
+            self.timestamp = timestamp
+            self.preprocessTime = 0.0
+            self.valid.clear()
+
+    # Record a preprocessing step that began at start (perf_counter_ns)
+    def record(self, stage, start):
+        elapsed = time.perf_counter_ns() - start
+        self.preprocessTime += elapsed / 1e9
+        if self.profiler is not None:
+            self.profiler.add(stage, elapsed)
+
+    # Return the blurred image for the given kernel size (lock held)
+    def _blurred(self, imgRaw, ksize):
+        key = (self.seq, ksize, 'blur')
+        if key not in self.valid:
+            start = time.perf_counter_ns()
+            blur = self.blurred.get(ksize)
+            if blur is None or blur.shape != imgRaw.shape:
+                blur = np.empty_like(imgRaw)
+                self.blurred[ksize] = blur
+            cv.GaussianBlur(imgRaw, ksize, 0, dst=blur)
+            self.valid.add(key)
+            self.record('blur', start)
+        return self.blurred[ksize]
+
+    # Return (blurred, hsv) for the given image and blur kernel size
+    # Images that are not the context's current frame are not cached
+    def get(self, imgRaw, ksize = (13, 13)):
+        if imgRaw is not self.frame:
+            blur = cv.GaussianBlur(imgRaw, ksize, 0)
+            return blur, cv.cvtColor(blur, cv.COLOR_BGR2HSV)
+
+        with self.lock:
+            blur = self._blurred(imgRaw, ksize)
+            key = (self.seq, ksize, 'hsv')
+            if key not in self.valid:
+                start = time.perf_counter_ns()
+                hsv = self.hsv.get(ksize)
+                if hsv is None or hsv.shape != imgRaw.shape:
+                    hsv = np.empty_like(imgRaw)
+                    self.hsv[ksize] = hsv
+                cv.cvtColor(blur, cv.COLOR_BGR2HSV, dst=hsv)
+                self.valid.add(key)
+                self.record('hsv', start)
+            return blur, self.hsv[ksize]
+
+    # Return (blurred, hsv) of the image downscaled by scale
+    # Used by the pyramid mode, so libraries with the same scale share it
+    def scaled(self, imgRaw, scale, ksize):
+        size = (imgRaw.shape[1] // scale, imgRaw.shape[0] // scale)
+        if imgRaw is not self.frame:
+            blur = cv.GaussianBlur(cv.resize(imgRaw, size, interpolation=cv.INTER_AREA), ksize, 0)
+            return blur, cv.cvtColor(blur, cv.COLOR_BGR2HSV)
+
+        with self.lock:
+            key = (self.seq, ksize, 'scaled', scale)
+            if key not in self.valid:
+                start = time.perf_counter_ns()
+                blur = cv.GaussianBlur(cv.resize(imgRaw, size, interpolation=cv.INTER_AREA), ksize, 0)
+                self.blurred[key[1:]] = blur
+                self.hsv[key[1:]] = cv.cvtColor(blur, cv.COLOR_BGR2HSV)
+                self.valid.add(key)
+                self.record('scaled', start)
+            return self.blurred[key[1:]], self.hsv[key[1:]]
+
+    # Return the grayscale image downscaled by scale (optical flow mode)
+    def gray(self, imgRaw, scale):
+        if imgRaw is not self.frame:
+            return VisionBase.flow_image(imgRaw, scale)
+
+        with self.lock:
+            key = (self.seq, 'gray', scale)
+            if key not in self.valid:
+                start = time.perf_counter_ns()
+                self.hsv[key[1:]] = VisionBase.flow_image(imgRaw, scale)
+                self.valid.add(key)
+                self.record('gray', start)
+            return self.hsv[key[1:]]
+
+    # Return the tiny thumbnail used by the scene change gate
+    def thumbnail(self, imgRaw):
+        if imgRaw is not self.frame:
+            return VisionBase.gate_image(imgRaw)
+
+        with self.lock:
+            key = (self.seq, 'thumbnail')
+            if key not in self.valid:
+                start = time.perf_counter_ns()
+                self.hsv[key[1:]] = VisionBase.gate_image(imgRaw)
+                self.valid.add(key)
+                self.record('thumbnail', start)
+            return self.hsv[key[1:]]
+
+    # Return the classifier label image (one bit per color class), or None
+    # if there is no classifier or the image is not the current frame
+    def labels(self, imgRaw, ksize = (13, 13)):
+        if self.classifier is None or imgRaw is not self.frame:
+            return None
+        self.classifier.ensure()
+        if self.classifier.useBGR:
+            with self.lock:
+                key = (self.seq, ksize, 'labels')
+                if key not in self.valid:
+                    blur = self._blurred(imgRaw, ksize)
+                    start = time.perf_counter_ns()
+                    self.labelled[ksize] = self.classifier.classify_bgr(blur)
+                    self.valid.add(key)
+                    self.record('labels', start)
+                return self.labelled[ksize]
+        _, hsv = self.get(imgRaw, ksize)
+        with self.lock:
+            key = (self.seq, ksize, 'labels')
+            if key not in self.valid:
+                start = time.perf_counter_ns()
+                self.labelled[ksize] = self.classifier.classify_hsv(hsv, self.labelled.get(ksize))
+                self.valid.add(key)
+                self.record('labels', start)
+            return self.labelled[ksize]
 
 
 class FoundObject:
@@ -27,7 +192,8 @@ class FoundObject:
     # initialize FoundObject, with unused fields defaulting to None
     # ty, x, and y are mandatory
     # all other parameters must be named
-    def __init__(self, ty, x, y, *, w = None, h = None, radius = None, distance = None, angle = None, offset = None, percent = None):
+    # trackId and age are set by the object tracker (TRACK=True)
+    def __init__(self, ty, x, y, *, w = None, h = None, radius = None, distance = None, angle = None, offset = None, percent = None, trackId = None, age = None):
         self.ty = ty
         self.x = x
         self.y = y
@@ -38,10 +204,14 @@ class FoundObject:
         self.angle = angle
         self.offset = offset
         self.percent = percent
+        self.trackId = trackId
+        self.age = age
 
     # pretty printing
     def __str__(self):
         out = "found {}".format(self.ty)
+        if self.trackId is not None:
+            out += " (track {}, age {})".format(self.trackId, self.age)
         out += "\n    location: ({}, {})".format(self.x, self.y)
         if self.radius is not None:
             out += "\n    radius: {}".format(self.radius)
@@ -56,6 +226,245 @@ class FoundObject:
         return out
 
 
+# Columns of a detection batch
+# Missing values are NaN (float columns) or -1 (integer columns)
+detection_dtype = np.dtype([
+    ('ty', 'U16'),
+    ('x', 'f8'), ('y', 'f8'), ('w', 'f8'), ('h', 'f8'), ('radius', 'f8'),
+    ('distance', 'f8'), ('angle', 'f8'), ('offset', 'f8'), ('percent', 'f8'),
+    ('trackId', 'i8'), ('age', 'i8'),
+    ('seq', 'i8'), ('timestamp', 'f8'),
+])
+detection_floats = frozenset(('x', 'y', 'w', 'h', 'radius', 'distance', 'angle', 'offset', 'percent', 'timestamp'))
+detection_boxes = frozenset(('x', 'y', 'w', 'h'))
+detection_ints = frozenset(('trackId', 'age', 'seq'))
+
+
+# Return the values of a detection row, reading them on first use
+def detection_row_values(row):
+    values = row.values
+    if values is None:
+        values = row.values = row.batch.array[row.index].item()
+    return values
+
+
+# Return a detection row attribute getter
+# Missing values read as None and the boxes of integral batches as ints
+def detection_getter(name, position):
+    if name in detection_boxes:
+        def getter(row):
+            value = (row.values or detection_row_values(row))[position]
+            if value != value:
+                return None
+            return int(value) if row.batch.integral else value
+    elif name in detection_floats:
+        def getter(row):
+            value = (row.values or detection_row_values(row))[position]
+            return None if value != value else value
+    elif name in detection_ints:
+        def getter(row):
+            value = (row.values or detection_row_values(row))[position]
+            return None if value < 0 else value
+    else:
+        def getter(row):
+            return (row.values or detection_row_values(row))[position]
+    return getter
+
+
+# Write a detection row attribute through to its batch
+def detection_setter(name):
+    def setter(row, value):
+        row.batch.array[name][row.index] = DetectionBatch.missing(name) if value is None else value
+        row.values = None
+    return setter
+
+
+# Define the detection row class
+# A view of one row of a detection batch with the attributes of a
+# FoundObject (missing values read as None).  The row is read from the
+# batch once, on the first attribute read (or when iterating the batch),
+# so later reads are plain Python values.  Writing an attribute writes
+# the batch; copy.copy gives a detached FoundObject.
+class DetectionRow:
+
+    __slots__ = ('batch', 'index', 'values')
+
+    def __init__(self, batch, index, values = None):
+        self.batch = batch
+        self.index = index
+        self.values = values
+
+    def __copy__(self):
+        return self.found_object()
+
+    def __str__(self):
+        return str(self.found_object())
+
+    # Return the row as a FoundObject
+    def found_object(self):
+        return FoundObject(self.ty, self.x, self.y, w=self.w, h=self.h, radius=self.radius,
+                           distance=self.distance, angle=self.angle, offset=self.offset,
+                           percent=self.percent, trackId=self.trackId, age=self.age)
+
+
+# Add the column attributes to detection rows
+for position, name in enumerate(detection_dtype.names):
+    setattr(DetectionRow, name, property(detection_getter(name, position), detection_setter(name)))
+
+
+# Define the detection batch class
+# The found objects of one library on one frame as a NumPy structured
+# array (detection_dtype), one row per object.  Indexing and iterating
+# give DetectionRows, so code written for lists of FoundObjects keeps
+# working, while publishing and logging can use whole columns.  integral
+# tells whether the boxes are whole pixels (read back as ints), and seq and
+# timestamp are the frame stamp (also kept when the batch is empty).
+class DetectionBatch:
+
+    __slots__ = ('array', 'integral', 'seq', 'timestamp')
+
+    def __init__(self, array = None, integral = False, seq = None, timestamp = None):
+        self.array = np.empty(0, dtype=detection_dtype) if array is None else array
+        self.integral = integral
+        self.seq = seq
+        self.timestamp = timestamp
+
+    # Return the missing value of a column
+    @staticmethod
+    def missing(name):
+        if name in detection_ints:
+            return -1
+        if name == 'ty':
+            return ''
+        return np.nan
+
+    # Make a batch from columns (arrays or single values)
+    # ty is the object type of every row, count the number of rows
+    @staticmethod
+    def from_columns(ty, count, integral = False, **columns):
+        array = np.empty(count, dtype=detection_dtype)
+        array['ty'] = ty
+        for name in detection_dtype.names[1:]:
+            value = columns.get(name)
+            array[name] = DetectionBatch.missing(name) if value is None else value
+        return DetectionBatch(array, integral)
+
+    # Make a batch from a list of FoundObjects (or rows)
+    @staticmethod
+    def from_objects(objects, seq = None, timestamp = None):
+        array = np.empty(len(objects), dtype=detection_dtype)
+        for name in detection_dtype.names:
+            if name == 'seq' or name == 'timestamp':
+                continue
+            empty = DetectionBatch.missing(name)
+            array[name] = [empty if value is None else value for value in (getattr(obj, name) for obj in objects)]
+        batch = DetectionBatch(array, len(objects) > 0 and all(isinstance(obj.x, (int, np.integer)) for obj in objects))
+        batch.stamp(seq, timestamp)
+        return batch
+
+    # Set the frame sequence number and timestamp of every row
+    def stamp(self, seq, timestamp):
+        self.seq = seq
+        self.timestamp = timestamp
+        self.array['seq'] = -1 if seq is None else seq
+        self.array['timestamp'] = np.nan if timestamp is None else timestamp
+        return self
+
+    # Return a copy of the batch (rows are not shared)
+    def copy(self):
+        return DetectionBatch(self.array.copy(), self.integral, self.seq, self.timestamp)
+
+    # Return the rows as detached FoundObjects
+    def objects(self):
+        return [DetectionRow(self, index).found_object() for index in range(len(self.array))]
+
+    # Return the boxes (x, y, w, h) of every row as an (n, 4) array
+    # Objects with a radius but no box use the box around their circle
+    def boxes(self):
+        array = self.array
+        boxes = np.stack((array['x'], array['y'], array['w'], array['h']), axis=1)
+        circles = np.isnan(array['w']) & ~np.isnan(array['radius'])
+        radius = array['radius'][circles]
+        boxes[circles] = np.stack((array['x'][circles] - radius, array['y'][circles] - radius, 2 * radius, 2 * radius), axis=1)
+        return np.nan_to_num(boxes)
+
+    def __len__(self):
+        return len(self.array)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return DetectionBatch(self.array[index], self.integral, self.seq, self.timestamp)
+        if index < 0:
+            index += len(self.array)
+        if index < 0 or index >= len(self.array):
+            raise IndexError("detection index out of range")
+        return DetectionRow(self, index)
+
+    def __iter__(self):
+        # Every row is read in one call, rather than one call per row
+        return (DetectionRow(self, index, item) for index, item in enumerate(self.array.tolist()))
+
+    def __repr__(self):
+        return "DetectionBatch({} objects)".format(len(self.array))
+
+
+# Return True if library results are found objects (a list or a batch)
+# rather than a library specific result
+def is_objects(results):
+    return isinstance(results, (list, DetectionBatch))
+
+
+# Define the search window class
+# Predicts where a library's targets will be in the next frame from its
+# last detections, so only that part of the frame needs to be searched.
+# The window is the union of the last boxes, moved by the motion of the
+# largest target and padded by the pad plus that motion.
+class SearchWindow:
+
+    # Define initialization
+    def __init__(self):
+        self.boxes = None
+        self.center = None
+        self.velocity = (0.0, 0.0)
+        self.frames = 0
+
+    # Return the window (x, y, w, h) to search in the next frame, or None
+    # for a full frame scan (nothing tracked, or a full scan is due)
+    def predict(self, width, height, pad, fullEvery):
+        if self.boxes is None or self.frames >= fullEvery:
+            return None
+        vx, vy = self.velocity
+        padX = pad + abs(vx)
+        padY = pad + abs(vy)
+        x0 = int(max(0, min(box[0] for box in self.boxes) + vx - padX))
+        y0 = int(max(0, min(box[1] for box in self.boxes) + vy - padY))
+        x1 = int(min(width, max(box[0] + box[2] for box in self.boxes) + vx + padX + 1))
+        y1 = int(min(height, max(box[1] + box[3] for box in self.boxes) + vy + padY + 1))
+        if x1 <= x0 or y1 <= y0:
+            return None
+        return (x0, y0, x1 - x0, y1 - y0)
+
+    # Remember the detections of this frame
+    # full tells whether they came from a full frame scan
+    def update(self, results, full):
+        if isinstance(results, DetectionBatch):
+            boxes = [tuple(box) for box in results.boxes().tolist()]
+        else:
+            boxes = [object_box(obj)[0] for obj in results] if is_objects(results) else []
+        if len(boxes) == 0:
+            self.boxes = None
+            self.center = None
+            self.velocity = (0.0, 0.0)
+            return
+        x, y, w, h = boxes[0]
+        center = (x + w / 2, y + h / 2)
+        if self.center is not None:
+            self.velocity = (center[0] - self.center[0], center[1] - self.center[1])
+        self.center = center
+        self.boxes = boxes
+        self.frames = 0 if full else self.frames + 1
+
+
 # Define the class
 class VisionBase:
 
@@ -63,6 +472,40 @@ class VisionBase:
     config = {}
     warned = set()
     init = False
+    version = 0
+
+    # Shared preprocessing context (set by the camera running the library)
+    context = None
+
+    # Search window of the current find_objects call (ROI mode), None for
+    # the full frame, and the window predictor
+    searchWindow = None
+    searchState = None
+
+    # Object tracker (TRACK mode) and the settings it was configured from
+    tracker = None
+    trackerParams = None
+    trackerFrames = 0
+
+    # Optical flow follower (FLOW mode)
+    flowState = None
+
+    # Scene change gate state (GATE mode)
+    gateThumb = None
+    gateParams = None
+    gateResults = None
+    gateSkipped = 0
+    gateSkips = 0
+
+    # Per stage timing of this library (see stage_profiler)
+    profiler = None
+
+    # Settings schema of the library, and the compiled settings of every
+    # (schema, section) pair for the current config version
+    schema = base_schema
+    compiled = {}
+    paramsCache = None
+    paramsVersion = -1
 
     # Class Initialization method
     # Reads the contents of the supplied vision settings file
@@ -72,22 +515,35 @@ class VisionBase:
         self.isFinished = 0
 
 
+    # Drop per-process state (shared context, worker thread) when pickled,
+    # so libraries can be sent to a vision process
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for key in ('context', 'workQueue', 'finished', 'paramsCache', 'paramsVersion', 'searchState', 'tracker', 'trackerParams', 'flowState', 'gateThumb', 'gateParams', 'gateResults', 'profiler'):
+            state.pop(key, None)
+        return state
+
+
     # Read vision settings file
+    # The file is parsed into a new dictionary which then replaces the
+    # current settings in one step, so libraries running on other threads
+    # never see a half read file.  A reload starts from empty settings,
+    # so removed keys go away.
     @staticmethod
     def read_vision_file(file, reload = False):
         if VisionBase.init and not reload:
             return True
-        VisionBase.init = True
         # Declare local variables
         value_section = ''
+        config = {} if reload else {section: dict(values) for section, values in VisionBase.config.items()}
         # Open the file and read contents
         try:
             
             # Open the file for reading
-            in_file = open(file, 'r')
+            with open(file, 'r') as in_file:
             
-            # Read in all lines
-            value_list = in_file.readlines()
+                # Read in all lines
+                value_list = in_file.readlines()
             
             # Process list of lines
             for line in value_list:
@@ -103,20 +559,75 @@ class VisionBase:
                 
                 if upper_line[-1] == ':':
                     value_section = upper_line[:-1]
-                    if not value_section in VisionBase.config:
-                        VisionBase.config[value_section] = {}
+                    if not value_section in config:
+                        config[value_section] = {}
                 elif split_line[0] == '':
                     value_section = ''
-                    if not value_section in VisionBase.config:
-                        VisionBase.config[value_section] = {}
+                    if not value_section in config:
+                        config[value_section] = {}
                 else:
-                    VisionBase.config[value_section][split_line[0].upper()] = split_line[1]
+                    config.setdefault(value_section, {})[split_line[0].upper()] = split_line[1]
         
         except FileNotFoundError:
             return False
+
+        # Swap in the new settings, then bump the version so cached
+        # settings (compiled params, classifier tables) are rebuilt
+        VisionBase.config = config
+        VisionBase.compiled = {}
+        VisionBase.init = True
+        VisionBase.version += 1
         
         return True
 
+    # Return the compiled settings object of a schema and section
+    # Each pair is compiled (and its problems printed) once per config load
+    @staticmethod
+    def compile_params(schema, section):
+        compiled = VisionBase.compiled
+        params = compiled.get((schema.name, section))
+        if params is None:
+            problems = []
+            if section not in VisionBase.config:
+                problems.append("No vision settings section {}!".format(section))
+            params = schema.compile(VisionBase.config.get(section, {}), section, problems)
+            for problem in problems:
+                print(problem)
+            compiled[(schema.name, section)] = params
+        return params
+
+    # Return this library's compiled settings
+    # Per-frame callers only pay for attribute reads, the settings are
+    # recompiled when the vision file is (re)loaded
+    def params(self):
+        if self.paramsVersion != VisionBase.version:
+            version = VisionBase.version
+            self.paramsCache = VisionBase.compile_params(self.schema, self.name)
+            self.paramsVersion = version
+        return self.paramsCache
+
+    # Compile the settings of the given libraries and report problems
+    # Keys that no library reading a section knows about are reported as
+    # unknown.  Returns True if there were no problems.
+    @staticmethod
+    def check_config(*libs):
+        problems = []
+        schemas = {}
+        for lib in libs:
+            schemas.setdefault(lib.name, []).append(lib.schema)
+            if (lib.schema.name, lib.name) in VisionBase.compiled:
+                continue
+            if lib.name not in VisionBase.config:
+                problems.append("No vision settings section {}!".format(lib.name))
+            VisionBase.compiled[(lib.schema.name, lib.name)] = lib.schema.compile(VisionBase.config.get(lib.name, {}), lib.name, problems)
+        for name, sectionSchemas in schemas.items():
+            for key in sorted(VisionBase.config.get(name, {})):
+                if all(key not in schema.keys for schema in sectionSchemas):
+                    problems.append("Unknown parameter {} in {}!".format(key, name))
+        for problem in dict.fromkeys(problems):
+            print(problem)
+        return len(problems) == 0
+
     def cfg(self, name, default = None, datatype = str, warn = True):
         c = VisionBase.config[self.name]
         if name in c:
@@ -127,26 +638,194 @@ class VisionBase:
                 print("No parameter {} available for {}!".format(name, self.name))
             return default
         
+    # Blur the image and convert it to HSV, returning (blurred, hsv)
+    # Uses the shared preprocessing context when one is set, so libraries
+    # run on the same frame only pay for this once
+    def preprocess(self, imgRaw, ksize = (13, 13)):
+        if self.context is not None:
+            return self.context.get(imgRaw, ksize)
+        blur = cv.GaussianBlur(imgRaw, ksize, 0)
+        return blur, cv.cvtColor(blur, cv.COLOR_BGR2HSV)
+
+    # Return the StageProfiler of this library (created on first use)
+    # Stages are only timed while StageProfiler.enabled is set
+    def stage_profiler(self):
+        if self.profiler is None:
+            self.profiler = StageProfiler(getattr(self, 'name', type(self).__name__))
+        return self.profiler
+
+    # Build the mask of pixels inside the HSV range
+    # Uses the shared classifier labels when this library's class is compiled
+    # into the context's classifier with the same range
+    def threshold(self, imgRaw, hsvMin, hsvMax):
+        profiler = self.stage_profiler()
+        start = profiler.start()
+        if self.context is not None and self.context.classifier is not None:
+            labels = self.context.labels(imgRaw)
+            if labels is not None:
+                bit = self.context.classifier.bit(getattr(self, 'name', None), hsvMin, hsvMax)
+                if bit is not None:
+                    start = profiler.mark('preprocess', start)
+                    mask = self.context.classifier.mask(labels, bit)
+                    profiler.mark('inrange', start)
+                    return mask
+        _, hsv = self.preprocess(imgRaw)
+        start = profiler.mark('preprocess', start)
+        mask = cv.inRange(hsv, hsvMin, hsvMax)
+        profiler.mark('inrange', start)
+        return mask
+
     # Define basic image processing method for finding contours
     # Converts image from BGR color space to HSV and then applies a mask
     # based on "learned" HSV values from the config file.
     # Edge detection can also be imployed before contours are found and returned.
+    # With PYRAMID=2 or 4 in the library's settings, candidates are found on
+    # a downscaled image first (see process_image_contours_pyramid).
     def process_image_contours(self, imgRaw, hsvMin, hsvMax, erodeDilate, useCanny):
-        
-        finalImg = ""
 
-        # Blur image to remove noise
-        blur = cv.GaussianBlur(imgRaw, (13, 13), 0)
+        scale = self.params().pyramid
+        if scale > 1:
+            return self.process_image_contours_pyramid(imgRaw, hsvMin, hsvMax, erodeDilate, useCanny, scale)
+        return self.process_window_contours(imgRaw, hsvMin, hsvMax, erodeDilate, useCanny)
+
+
+    # Define coarse to fine contour method
+    # Thresholds the image downscaled by scale to find candidate blobs, then
+    # finds contours at full resolution only inside the (padded, merged)
+    # candidate boxes.  Blobs too small to survive the downscale are missed,
+    # so small or thin targets (far away tape) should keep PYRAMID=1.
+    def process_image_contours_pyramid(self, imgRaw, hsvMin, hsvMax, erodeDilate, useCanny, scale):
+
+        # Region to search (the ROI search window, or the whole frame)
+        window = self.searchWindow
+        if window is None:
+            wx, wy, ww, wh = 0, 0, imgRaw.shape[1], imgRaw.shape[0]
+            region = imgRaw
+        else:
+            wx, wy, ww, wh = window
+            region = imgRaw[wy:wy+wh, wx:wx+ww]
+
+        # Find candidate blobs on the downscaled image
+        profiler = self.stage_profiler()
+        start = profiler.start()
+        ksize = (max(3, (13 // scale) | 1),) * 2
+        if window is None and self.context is not None:
+            _, hsv = self.context.scaled(imgRaw, scale, ksize)
+        else:
+            blur = cv.GaussianBlur(cv.resize(region, (ww // scale, wh // scale), interpolation=cv.INTER_AREA), ksize, 0)
+            hsv = cv.cvtColor(blur, cv.COLOR_BGR2HSV)
+        start = profiler.mark('preprocess', start)
+        mask = cv.inRange(hsv, hsvMin, hsvMax)
+        start = profiler.mark('inrange', start)
+        candidates, _ = cv.findContours(mask, cv.RETR_EXTERNAL, cv.CHAIN_APPROX_SIMPLE)
+        profiler.mark('contours', start)
+
+        # Scale the candidate boxes up, padded to cover the blur and the
+        # rounding of the downscale, and merge the ones that overlap
+        pad = 8 + 2 * scale
+        boxes = []
+        for candidate in candidates:
+            x, y, w, h = cv.boundingRect(candidate)
+            box = [max(wx, wx + x * scale - pad), max(wy, wy + y * scale - pad),
+                   min(wx + ww, wx + (x + w) * scale + pad), min(wy + wh, wy + (y + h) * scale + pad)]
+            merged = True
+            while merged:
+                merged = False
+                for other in boxes:
+                    if box[0] < other[2] and other[0] < box[2] and box[1] < other[3] and other[1] < box[3]:
+                        boxes.remove(other)
+                        box = [min(box[0], other[0]), min(box[1], other[1]), max(box[2], other[2]), max(box[3], other[3])]
+                        merged = True
+                        break
+            boxes.append(box)
+
+        # Find the contours at full resolution inside each box
+        contours = []
+        try:
+            for x0, y0, x1, y1 in boxes:
+                self.searchWindow = (x0, y0, x1 - x0, y1 - y0)
+                contours.extend(self.process_window_contours(imgRaw, hsvMin, hsvMax, erodeDilate, useCanny))
+        finally:
+            self.searchWindow = window
+
+        return contours
+
+
+    # Define basic image processing method for finding contours in the
+    # search window (or the whole frame)
+    def process_window_contours(self, imgRaw, hsvMin, hsvMax, erodeDilate, useCanny):
+        
+        # Build the cleaned up mask
+        finalImg = self.process_image_mask(imgRaw, hsvMin, hsvMax, erodeDilate, useCanny)
+        
+        # Find contours in mask (in full frame coordinates)
+        profiler = self.stage_profiler()
+        start = profiler.start()
+        offset = self.searchWindow[:2] if self.searchWindow is not None else (0, 0)
+        contours, _ = cv.findContours(finalImg, cv.RETR_EXTERNAL, cv.CHAIN_APPROX_SIMPLE, offset=offset)
+        profiler.mark('contours', start)
         
-        # Convert from BGR to HSV colorspace
-        hsv = cv.cvtColor(blur, cv.COLOR_BGR2HSV)
+        return list(contours)
+
+
+    # Define image processing method for finding connected components
+    # Same mask as process_image_contours, but returns the bounding box, area
+    # and centroid of every blob as arrays without building contour point
+    # lists: (stats, centroids, labels), where stats rows are
+    # [x, y, w, h, pixel area] (cv.CC_STAT_*) and the background is removed.
+    # There is no Canny step, as edge outlines have no useful pixel area.
+    def process_image_components(self, imgRaw, hsvMin, hsvMax, erodeDilate):
+
+        # Build the cleaned up mask
+        finalImg = self.process_image_mask(imgRaw, hsvMin, hsvMax, erodeDilate, False)
+
+        # Label the blobs in the mask (8-connected, like findContours)
+        profiler = self.stage_profiler()
+        start = profiler.start()
+        count, labels, stats, centroids = cv.connectedComponentsWithStats(finalImg, connectivity=8)
+        profiler.mark('components', start)
+
+        # Move boxes and centroids to full frame coordinates (labels stay
+        # relative to the search window)
+        if self.searchWindow is not None:
+            stats[:, :2] += self.searchWindow[:2]
+            centroids += self.searchWindow[:2]
+
+        return stats[1:], centroids[1:], labels
+
+
+    # Return the segmentation backend of the library's settings section
+    # SEGMENTATION=COMPONENTS selects process_image_components, anything
+    # else (the default) uses process_image_contours
+    def segmentation(self):
+        return self.params().segmentation
+
+
+    # Define basic image processing method for building a target mask
+    # Thresholds the image in HSV and optionally applies edge detection
+    # and erode/dilate noise removal
+    # In ROI mode only the search window of the image is processed.  The
+    # window is blurred with blur_margin pixels of the frame around it, so
+    # its mask is the same as that part of a full frame mask.
+    def process_image_mask(self, imgRaw, hsvMin, hsvMax, erodeDilate, useCanny):
+
+        finalImg = ""
 
         # Set pixels to white if in target HSV range, else set to black
-        mask = cv.inRange(hsv, hsvMin, hsvMax)
+        if self.searchWindow is not None:
+            x, y, w, h = self.searchWindow
+            x0, y0 = max(0, x - blur_margin), max(0, y - blur_margin)
+            x1, y1 = min(imgRaw.shape[1], x + w + blur_margin), min(imgRaw.shape[0], y + h + blur_margin)
+            mask = self.threshold(imgRaw[y0:y1, x0:x1], hsvMin, hsvMax)[y-y0:y-y0+h, x-x0:x-x0+w]
+        else:
+            mask = self.threshold(imgRaw, hsvMin, hsvMax)
 
         # Detect edges
+        profiler = self.stage_profiler()
+        start = profiler.start()
         if useCanny == True:
             edges = cv.Canny(mask, 35, 125)
+            start = profiler.mark('canny', start)
         else:
             edges = mask
 
@@ -163,24 +842,19 @@ class VisionBase:
             # cv.imshow('dilate', dilate)
             
             finalImg = dilate
+            profiler.mark('morphology', start)
 
         else:
             finalImg = edges
-        
-        # Find contours in mask
-        contours, _ = cv.findContours(finalImg, cv.RETR_EXTERNAL, cv.CHAIN_APPROX_SIMPLE)
-        
-        return list(contours)
+
+        return finalImg
 
 
     # Define basic image processing method for edge detection
     def process_image_edges(self, imgRaw):
 
-        # Blur image to remove noise
-        blur = cv.GaussianBlur(imgRaw, (13, 13), 0)
-        
-        # Convert from BGR to HSV colorspace
-        hsv = cv.cvtColor(blur, cv.COLOR_BGR2HSV)
+        # Blur image to remove noise and convert from BGR to HSV colorspace
+        _, hsv = self.preprocess(imgRaw)
 
         # Detect edges
         edges = cv.Canny(hsv, 35, 125)
@@ -197,19 +871,213 @@ class VisionBase:
 
         pass
 
-    def _update(self, imgRaw, cameraWidth, cameraHeight, cameraFOV):
+    # Run find_objects on a frame, applying the library's detection modes
+    # With FLOW=True, the objects of a full detection are followed with
+    # optical flow for FLOW_FRAMES frames before the next full detection.
+    # With TRACK=True the results are tracked objects with stable IDs, and
+    # with TRACK_DETECT_EVERY=N detection only runs on every Nth frame, the
+    # tracks coasting on their predictions in between.  With GATE=True a
+    # frame that has not changed since the last processed one returns the
+    # previous results as this frame's results.  Found objects are returned
+    # as a DetectionBatch stamped with the frame's sequence and timestamp.
+    def detect(self, imgRaw, cameraWidth, cameraHeight, cameraFOV):
+
+        params = self.params()
+        if params.gate and self.gated(imgRaw, params):
+            results = self.gateResults
+            if isinstance(results, DetectionBatch):
+                results = results.copy()
+        else:
+            results = self.track(imgRaw, cameraWidth, cameraHeight, cameraFOV, params)
+            if isinstance(results, list):
+                results = DetectionBatch.from_objects(results)
+            if params.gate:
+                self.gateResults = results
+
+        # Stamp the objects with the frame they were found in
+        if isinstance(results, DetectionBatch):
+            if self.context is not None and self.context.frame is imgRaw:
+                results.stamp(self.context.seq, self.context.timestamp)
+            else:
+                results.stamp(None, None)
+        return results
+
+    # Return True if the frame looks the same as the last processed one, so
+    # its results can be reused (GATE mode).  The change is the largest
+    # difference between tiny thumbnails (each pixel the mean of a block of
+    # the frame, so sensor noise averages out but a small moving object
+    # still changes its blocks).  Frames are compared to the last processed
+    # frame, so slow motion adds up, and are processed again after
+    # GATE_MAX_SKIP reuses and after the settings change.
+    def gated(self, imgRaw, params):
+
+        thumb = self.context.thumbnail(imgRaw) if self.context is not None else VisionBase.gate_image(imgRaw)
+        if (self.gateThumb is not None and self.gateParams is params and
+                self.gateThumb.shape == thumb.shape and self.gateSkips < params.gateMaxSkip):
+            change = cv.norm(thumb, self.gateThumb, cv.NORM_INF)
+            if change < params.gateThreshold:
+                self.gateSkips += 1
+                self.gateSkipped += 1
+                return True
+
+        self.gateThumb = thumb
+        self.gateParams = params
+        self.gateSkips = 0
+        return False
+
+    # Return the thumbnail of an image compared by the scene change gate
+    @staticmethod
+    def gate_image(imgRaw):
+        return cv.resize(imgRaw, gate_size, interpolation=cv.INTER_AREA)
+
+    # Run the search with the tracking modes (TRACK, FLOW) applied
+    def track(self, imgRaw, cameraWidth, cameraHeight, cameraFOV, params):
+
+        if not params.track and not params.flow:
+            return self.search(imgRaw, cameraWidth, cameraHeight, cameraFOV, params)
+
+        if params.track:
+
+            # Set up (or reconfigure after a reload) the tracker
+            if self.tracker is None:
+                self.tracker = ObjectTracker()
+            if self.trackerParams is not params:
+                self.tracker.configure(params.trackIou, params.trackCoast, params.trackSmoothing, params.trackMinHits)
+                self.trackerParams = params
+
+            # Time of the frame (capture time when run through a camera)
+            timestamp = time.monotonic()
+            if self.context is not None and self.context.frame is imgRaw and self.context.timestamp:
+                timestamp = self.context.timestamp
+
+            # Coast through frames where detection is skipped
+            self.trackerFrames += 1
+            if self.trackerFrames % max(1, params.trackDetectEvery) != 0 and len(self.tracker.tracks) > 0:
+                return self.tracker.predict(timestamp)
+            self.trackerFrames = 0
+
+        # Follow the last detection with optical flow, or detect again
+        results = None
+        if params.flow:
+            if self.flowState is None:
+                self.flowState = FlowTracker()
+            gray = self.context.gray(imgRaw, params.flowScale) if self.context is not None else VisionBase.flow_image(imgRaw, params.flowScale)
+            boxes = self.flowState.follow(gray)
+            if boxes is not None:
+                results = self.remeasure(self.flowState.objects, boxes, cameraWidth, cameraHeight, cameraFOV)
+        if results is None:
+            results = self.search(imgRaw, cameraWidth, cameraHeight, cameraFOV, params)
+            if params.flow:
+                self.flowState.start(gray, list(results) if is_objects(results) else [], params.flowScale, params.flowFrames)
+
+        if params.track and is_objects(results):
+            results = self.tracker.update(results, timestamp)
+        return results
 
-        self.data = self.find_objects(imgRaw, cameraWidth, cameraHeight, cameraFOV)
-        self.isFinished = 1
+    # Return the pixel to angle geometry for frames of a camera
+    # The camera's own geometry (lens calibration, focal length) when the
+    # frames come from one, otherwise a pinhole geometry from the FOV
+    def geometry(self, cameraWidth, cameraHeight, cameraFOV):
+        if self.context is not None and self.context.geometry is not None and self.context.geometry.matches(cameraWidth, cameraHeight):
+            return self.context.geometry
+        return CameraGeometry.from_fov(cameraWidth, cameraHeight, cameraFOV)
 
+    # Return the grayscale image downscaled by scale used for optical flow
+    @staticmethod
+    def flow_image(imgRaw, scale):
+        if scale > 1:
+            imgRaw = cv.resize(imgRaw, (imgRaw.shape[1] // scale, imgRaw.shape[0] // scale), interpolation=cv.INTER_AREA)
+        return cv.cvtColor(imgRaw, cv.COLOR_BGR2GRAY)
+
+    # Return found objects moved to new boxes (x, y, w, h) by optical flow
+    # Libraries override this to recompute their real world metrics, the
+    # default only moves the objects
+    def remeasure(self, objects, boxes, cameraWidth, cameraHeight, cameraFOV):
+
+        moved = []
+        for obj, (x, y, w, h) in zip(objects, boxes):
+            obj = copy.copy(obj)
+            if obj.w is not None and obj.h is not None:
+                obj.x, obj.y, obj.w, obj.h = int(round(x)), int(round(y)), int(round(w)), int(round(h))
+            else:
+                obj.x, obj.y = x + w / 2, y + h / 2
+                if obj.radius is not None:
+                    obj.radius = max(w, h) / 2
+            moved.append(obj)
+        return moved
+
+    # Run find_objects, in ROI mode (ROI=True) searching only a window
+    # predicted from the last detections.  A full frame scan is done every
+    # ROI_FULL_EVERY frames, and right away when the window finds nothing.
+    # Returned objects are always in full frame coordinates.
+    def search(self, imgRaw, cameraWidth, cameraHeight, cameraFOV, params):
+
+        if not params.roi:
+            return self.profile_find_objects(imgRaw, cameraWidth, cameraHeight, cameraFOV)
+
+        if self.searchState is None:
+            self.searchState = SearchWindow()
+        height, width = imgRaw.shape[:2]
+        window = self.searchState.predict(width, height, params.roiPad, params.roiFullEvery)
+
+        results = None
+        if window is not None:
+            self.searchWindow = window
+            try:
+                results = self.profile_find_objects(imgRaw, cameraWidth, cameraHeight, cameraFOV)
+            finally:
+                self.searchWindow = None
+            if is_objects(results) and len(results) == 0:
+                results = None
+
+        full = results is None
+        if full:
+            results = self.profile_find_objects(imgRaw, cameraWidth, cameraHeight, cameraFOV)
+        self.searchState.update(results, full)
+
+        return results
+
+    # Run find_objects, timing the whole call and the part of it not spent
+    # in the profiled image processing stages (the library's metrics code)
+    def profile_find_objects(self, imgRaw, cameraWidth, cameraHeight, cameraFOV):
+
+        profiler = self.stage_profiler()
+        begun = profiler.begin()
+        results = self.find_objects(imgRaw, cameraWidth, cameraHeight, cameraFOV)
+        profiler.end('find_objects', 'metrics', begun)
+
+        return results
+
+    # Define threaded update method for the persistent worker
+    def _update(self):
+
+        while True:
+            imgRaw, cameraWidth, cameraHeight, cameraFOV = self.workQueue.get()
+            try:
+                self.data = self.detect(imgRaw, cameraWidth, cameraHeight, cameraFOV)
+            finally:
+                self.isFinished = 1
+                self.finished.set()
+
+    # Run find_objects on this library's worker thread
+    # The worker is started on first use and reused for every frame
     def find_objects_threaded(self, imgRaw, cameraWidth, cameraHeight, cameraFOV, name = "findThread"):
 
-        self.isFinished = 0
+        if getattr(self, 'workQueue', None) is None:
+            self.workQueue = Queue(maxsize=1)
+            self.finished = Event()
+            calcThread = Thread(target=self._update, name=name, args=())
+            calcThread.daemon = True
+            calcThread.start()
 
-        calcThread = Thread(target=self._update, name=name, args=(imgRaw, cameraWidth, cameraHeight, cameraFOV))
-        calcThread.daemon = True
-        calcThread.start()
+        self.isFinished = 0
+        self.finished.clear()
+        self.workQueue.put((imgRaw, cameraWidth, cameraHeight, cameraFOV))
 
         return self
 
-
+    # Block until the last find_objects_threaded call has finished
+    def wait_finished(self, timeout = None):
+        if getattr(self, 'finished', None) is None:
+            return True
+        return self.finished.wait(timeout)
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python3
+
+######################################################################
+#                                                                    #
+#                      FRC Vision Config Library                     #
+#                                                                    #
+#  This library turns sections of the KEY=VALUE settings files into  #
+#  typed, read only parameter objects.  Each library (and camera)    #
+#  declares a schema of the keys it uses, the schema is compiled     #
+#  once when the settings are loaded, and problems such as missing   #
+#  or unknown keys are reported at startup instead of mid-match.     #
+#                                                                    #
+# @Version: 1.0                                                      #
+# @Created: 2023-03-04                                               #
+# @Author: Team 4121                                                 #
+#                                                                    #
+######################################################################
+
+"""FRC Vision Config Library - Provides typed, validated settings objects"""
+
+
+# Convert a settings value to a bool (TRUE, YES, ON or 1)
+def parse_bool(value):
+    if isinstance(value, bool):
+        return value
+    return str(value).strip().upper() in ('TRUE', 'YES', 'ON', '1')
+
+
+# Convert a settings value to an upper case string
+def parse_upper(value):
+    return str(value).strip().upper()
+
+
+# Define the parameter class
+# One key of a settings section.  attr is the attribute name on the
+# compiled object (defaults to the lower case key).  Required keys that
+# are missing are reported and fall back to the default.
+class Param:
+
+    __slots__ = ('key', 'datatype', 'default', 'required', 'attr')
+
+    def __init__(self, key, datatype = str, default = None, required = False, attr = None):
+        self.key = key
+        self.datatype = datatype
+        self.default = default
+        self.required = required
+        self.attr = attr if attr is not None else key.lower()
+
+
+# Define the compiled settings base class
+# Subclasses are made by ConfigSchema with one slot per parameter
+class ConfigParams:
+
+    __slots__ = ('section',)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("settings for {} are read only".format(self.section))
+
+    def __delattr__(self, name):
+        raise AttributeError("settings for {} are read only".format(self.section))
+
+    def __repr__(self):
+        fields = ", ".join("{}={!r}".format(name, getattr(self, name)) for name in self.__slots__)
+        return "{}({}: {})".format(type(self).__name__, self.section, fields)
+
+
+# Define the config schema class
+# params is a list of Params, derived maps extra attribute names to
+# functions of the compiled object (such as HSV tuples), and extends is
+# a schema whose params and derived values are included first
+class ConfigSchema:
+
+    def __init__(self, name, params, derived = None, extends = None):
+        self.name = name
+        self.params = (extends.params if extends is not None else ()) + tuple(params)
+        self.derived = dict(extends.derived) if extends is not None else {}
+        self.derived.update(derived or {})
+        self.keys = frozenset(param.key for param in self.params)
+        slots = tuple(param.attr for param in self.params) + tuple(self.derived)
+        self.cls = type(name + "Params", (ConfigParams,), {'__slots__': slots})
+
+    # Compile a section dictionary into a read only parameter object
+    # Problems (missing required keys, bad values) are appended to problems
+    def compile(self, values, section, problems = None):
+        params = self.cls.__new__(self.cls)
+        setter = object.__setattr__
+        setter(params, 'section', section)
+        for param in self.params:
+            value = param.default
+            if param.key in values:
+                try:
+                    value = param.datatype(values[param.key])
+                except (TypeError, ValueError):
+                    if problems is not None:
+                        problems.append("Bad value {!r} for {} in {}".format(values[param.key], param.key, section))
+            elif param.required and problems is not None:
+                problems.append("No parameter {} available for {}!".format(param.key, section))
+            setter(params, param.attr, value)
+        for name, function in self.derived.items():
+            setter(params, name, function(params))
+        return params
+
+    # Return the keys of a section dictionary that are not in this schema
+    def unknown(self, values):
+        return sorted(key for key in values if key not in self.keys)
+
+
+# Keys shared by every vision library section
+base_schema = ConfigSchema("Base", [
+    Param('COLOR'),
+    Param('SEGMENTATION', parse_upper, 'CONTOURS'),
+    Param('ROI', parse_bool, False, False, 'roi'),
+    Param('ROI_PAD', int, 32, False, 'roiPad'),
+    Param('ROI_FULL_EVERY', int, 10, False, 'roiFullEvery'),
+    Param('PYRAMID', int, 1, False, 'pyramid'),
+    Param('TRACK', parse_bool, False, False, 'track'),
+    Param('TRACK_IOU', float, 0.3, False, 'trackIou'),
+    Param('TRACK_COAST', int, 5, False, 'trackCoast'),
+    Param('TRACK_SMOOTHING', float, 0.5, False, 'trackSmoothing'),
+    Param('TRACK_MIN_HITS', int, 1, False, 'trackMinHits'),
+    Param('TRACK_DETECT_EVERY', int, 1, False, 'trackDetectEvery'),
+    Param('FLOW', parse_bool, False, False, 'flow'),
+    Param('FLOW_FRAMES', int, 5, False, 'flowFrames'),
+    Param('FLOW_SCALE', int, 2, False, 'flowScale'),
+    Param('GATE', parse_bool, False, False, 'gate'),
+    Param('GATE_THRESHOLD', float, 8.0, False, 'gateThreshold'),
+    Param('GATE_MAX_SKIP', int, 30, False, 'gateMaxSkip'),
+])
+
+# Keys of libraries thresholding a single HSV range
+hsv_schema = ConfigSchema("HSV", [
+    Param('HMIN', int, 0, True, 'hMin'),
+    Param('HMAX', int, 255, True, 'hMax'),
+    Param('SMIN', int, 0, True, 'sMin'),
+    Param('SMAX', int, 255, True, 'sMax'),
+    Param('VMIN', int, 0, True, 'vMin'),
+    Param('VMAX', int, 255, True, 'vMax'),
+], {
+    'hsvMin': lambda params: (params.hMin, params.sMin, params.vMin),
+    'hsvMax': lambda params: (params.hMax, params.sMax, params.vMax),
+}, base_schema)
+
+# Keys of the alignment tape libraries
+tape_schema = ConfigSchema("Tape", [
+    Param('MINAREA', int, 0, True, 'minArea'),
+    Param('TAPEWIDTH', float, None, True, 'tapeWidth'),
+    Param('GOALHEIGHT', float, None, True, 'goalHeight'),
+    Param('LOCKTOLERANCE', float, None, True, 'lockTolerance'),
+    Param('TAPEHEIGHT', float, None, False, 'tapeHeight'),
+    Param('TAPESPACING', float, None, False, 'tapeSpacing'),
+    Param('HEIGHT', float, None, False, 'height'),
+    Param('WIDTH', float, None, False, 'width'),
+    Param('TOLERANCE', float, None, False, 'tolerance'),
+    Param('MINVIS', float, None, False, 'minVis'),
+], extends=hsv_schema)
+
+# Keys of the ball libraries
+ball_schema = ConfigSchema("Ball", [
+    Param('RADIUS', float, None, True, 'radius'),
+    Param('MINRADIUS', float, 0.0, True, 'minRadius'),
+], extends=hsv_schema)
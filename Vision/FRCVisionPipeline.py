@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python3
+
+######################################################################
+#                                                                    #
+#                     FRC Vision Pipeline Library                    #
+#                                                                    #
+#  This class runs a camera and its vision libraries on a single     #
+#  long-lived worker thread.  Frames are taken from the camera's     #
+#  capture ring and results are published through a condition, so   #
+#  the main loop blocks on results instead of polling.  Pipelines    #
+#  can run in lockstep with the main loop or free run at their own   #
+#  camera's rate.                                                    #
+#                                                                    #
+# @Version: 1.0                                                      #
+# @Created: 2023-03-04                                               #
+# @Author: Team 4121                                                 #
+#                                                                    #
+######################################################################
+
+"""FRC Vision Pipeline Library - Provides persistent vision worker threads"""
+
+# System imports
+import time
+import traceback
+
+# Module Imports
+from threading import Thread, Condition
+
+
+# Define the vision pipeline class
+class VisionPipeline:
+
+    # Define initialization
+    # camera is an FRCWebCam, libs are the vision libraries to run on each
+    # frame and callback is called with (frame, *results) on the worker.
+    # With freeRun the worker processes every new frame without waiting for
+    # submit, copying frames out of the capture ring (copyFrames) so results
+    # stay valid while the next frame is captured.  event (a threading.Event)
+    # is set whenever a result is published, so one thread can wait on
+    # several pipelines.
+    def __init__(self, camera, *libs, callback = None, name = "vision", timeout = 1.0, freeRun = False, copyFrames = None, event = None):
+        self.camera = camera
+        self.libs = libs
+        self.callback = callback
+        self.name = name
+        self.timeout = timeout
+        self.freeRun = freeRun
+        self.copyFrames = freeRun if copyFrames is None else copyFrames
+        self.event = event
+
+        # Request and result state
+        self.condition = Condition()
+        self.requested = 0
+        self.completed = 0
+        self.result = None
+        self.resultSeq = 0
+        self.frameSeq = 0
+        self.errors = 0
+
+        # Effective rate, measured over roughly one second windows
+        self.fps = 0.0
+        self.windowStart = time.monotonic()
+        self.windowCount = 0
+
+        # Initialize stop flag
+        self.stopped = False
+        self.thread = None
+
+
+    # Define worker thread start method
+    def start(self):
+
+        self.stopped = False
+        self.thread = Thread(target=self.update, name=self.name, args=())
+        self.thread.daemon = True
+        self.thread.start()
+
+        return self
+
+
+    # Ask the worker to process the next frame (lockstep mode)
+    # Returns the request number to pass to wait
+    def submit(self):
+
+        with self.condition:
+            self.requested += 1
+            self.condition.notify_all()
+            return self.requested
+
+
+    # Wait until the given request (default: the latest) has completed
+    # Returns the result tuple (frame, *results), or None on timeout
+    def wait(self, request = None, timeout = None):
+
+        with self.condition:
+            if request is None:
+                request = self.requested
+            if not self.condition.wait_for(lambda: self.completed >= request or self.stopped, timeout):
+                return None
+            return self.result
+
+
+    # Return (resultSeq, result) for the newest result without blocking
+    # If after is given, wait for a result newer than that sequence number
+    def latest(self, after = None, timeout = None):
+
+        with self.condition:
+            if after is not None:
+                self.condition.wait_for(lambda: self.resultSeq > after or self.stopped, timeout)
+            return (self.resultSeq, self.result)
+
+
+    # Define threaded update method
+    def update(self):
+
+        # Main thread loop
+        while True:
+
+            # Wait for a request (free running pipelines do not wait)
+            with self.condition:
+                if not self.freeRun:
+                    self.condition.wait_for(lambda: self.requested > self.completed or self.stopped)
+                if self.stopped:
+                    return
+                request = self.requested
+
+            # Process the next new frame
+            result = None
+            try:
+                result = self.camera.use_libs(*self.libs, after=self.frameSeq, timeout=self.timeout, copy=self.copyFrames)
+                if result is None:
+                    # No new frame arrived before the timeout, so nothing
+                    # was detected (a requested run still completes)
+                    if self.freeRun:
+                        continue
+                else:
+                    self.frameSeq = self.camera.frameSeq
+                    if self.callback is not None:
+                        self.callback(*result)
+
+            except Exception:
+
+                # Keep the worker alive, the main loop still gets a result
+                self.errors += 1
+                traceback.print_exc()
+
+            # Measure the effective rate
+            self.windowCount += 1
+            now = time.monotonic()
+            if now - self.windowStart >= 1.0:
+                self.fps = self.windowCount / (now - self.windowStart)
+                self.windowStart = now
+                self.windowCount = 0
+
+            # Publish the result
+            with self.condition:
+                self.result = result
+                self.resultSeq += 1
+                self.completed = request
+                self.condition.notify_all()
+            if self.event is not None:
+                self.event.set()
+
+
+    # Stop the worker thread
+    def stop(self, timeout = None):
+
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+
+        if self.thread is not None:
+            self.thread.join(timeout)
+
+
+    # Return the stage profile reports of the pipeline's libraries
+    def report(self):
+        return "\n".join(lib.stage_profiler().report() for lib in self.libs)
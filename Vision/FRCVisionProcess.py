@@ -0,0 +1,344 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python3
+
+######################################################################
+#                                                                    #
+#                     FRC Vision Process Library                     #
+#                                                                    #
+#  This class runs a camera's vision libraries in a separate         #
+#  process so that the pure Python contour math of each camera gets  #
+#  its own core.  Frames are passed through a shared memory ring     #
+#  (only slot numbers are sent between processes) and results come   #
+#  back as the structured arrays of their detection batches.         #
+#                                                                    #
+# @Version: 1.0                                                      #
+# @Created: 2023-03-04                                               #
+# @Author: Team 4121                                                 #
+#                                                                    #
+######################################################################
+
+"""FRC Vision Process Library - Provides multi-process vision execution"""
+
+# System imports
+import time
+import traceback
+import multiprocessing as mp
+from multiprocessing import shared_memory
+
+# Module Imports
+import numpy as np
+from threading import Thread, Condition
+from FRCVisionBase import VisionBase, DetectionBatch, PreprocessContext
+from FRCStageProfiler import StageProfiler, context_stages
+
+
+# Define the shared frame ring class
+# A ring of frame slots in shared memory.  The process that creates the
+# ring owns (and unlinks) it, other processes attach by name.
+class SharedFrameRing:
+
+    # Define initialization
+    def __init__(self, shape, slots = 3, name = None):
+        self.shape = tuple(shape)
+        self.slots = slots
+        self.frameBytes = int(np.prod(self.shape))
+        self.owner = name is None
+        if self.owner:
+            self.shm = shared_memory.SharedMemory(create=True, size=self.frameBytes * slots)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+        self.frames = np.ndarray((slots,) + self.shape, dtype=np.uint8, buffer=self.shm.buf)
+        self.name = self.shm.name
+
+    # Return the frame array of a slot
+    def slot(self, index):
+        return self.frames[index]
+
+    # Detach from (and, if the owner, free) the shared memory
+    # The mapping stays alive while frames from it are still referenced
+    def close(self):
+        self.frames = None
+        try:
+            self.shm.close()
+        except BufferError:
+            pass
+        if self.owner:
+            self.shm.unlink()
+
+
+# Vision process entry point
+# Runs the libraries on each slot sent through workQueue and sends
+# (slot, seq, timestamp, records, times) back through resultQueue, records
+# being the (array, integral) of each library's DetectionBatch and times
+# the capture to dequeue, preprocessing and detection seconds.  A
+# ("CONFIG", config) message replaces the vision settings (hot reload), a
+# ("GEOMETRY", geometry) message replaces the camera geometry (camera
+# settings reload) and ("PROFILE", enabled) switches stage profiling.  On
+# exit the profile reports are sent back as ("PROFILE", reports).
+def vision_process_main(ringName, shape, slots, libs, config, size, workQueue, resultQueue):
+
+    # Set up the vision settings and shared preprocessing in this process
+    VisionBase.config = config
+    VisionBase.init = True
+    context = PreprocessContext()
+    context.profiler = StageProfiler(mp.current_process().name, context_stages)
+    for lib in libs:
+        lib.context = context
+    width, height, fov, geometry = size
+    context.geometry = geometry
+    ring = SharedFrameRing(shape, slots, ringName)
+
+    # Main process loop
+    while True:
+
+        work = workQueue.get()
+        if work is None:
+            break
+        if work[0] == "CONFIG":
+            VisionBase.config = work[1]
+            VisionBase.compiled = {}
+            VisionBase.version += 1
+            continue
+        if work[0] == "GEOMETRY":
+            context.geometry = work[1]
+            continue
+        if work[0] == "PROFILE":
+            StageProfiler.enabled = work[1]
+            continue
+        slot, seq, timestamp = work
+
+        # Run the libraries on the shared frame
+        start = time.monotonic()
+        try:
+            frame = ring.slot(slot)
+            context.set_frame(frame, seq, timestamp)
+            records = [(batch.array, batch.integral) for batch in
+                       (lib.detect(frame, width, height, fov) for lib in libs)]
+        except Exception:
+            traceback.print_exc()
+            records = None
+        preprocess = context.preprocessTime
+        times = (start - timestamp if timestamp else None, preprocess, time.monotonic() - start - preprocess)
+
+        resultQueue.put((slot, seq, timestamp, records, times))
+
+    resultQueue.put(("PROFILE", [context.profiler.report()] + [lib.stage_profiler().report() for lib in libs]))
+    ring.close()
+
+
+# Define the vision process class
+# Same interface as a free running VisionPipeline, but the libraries run
+# in their own process
+class VisionProcess:
+
+    # Define initialization
+    # camera must have read_latest(after, timeout) and width/height/fov, such
+    # as an FRCWebCam with its camera thread started
+    def __init__(self, camera, *libs, callback = None, name = "vision", slots = 3, timeout = 1.0, event = None):
+        self.camera = camera
+        self.libs = libs
+        self.callback = callback
+        self.name = name
+        self.slots = max(3, slots)
+        self.timeout = timeout
+        self.event = event
+
+        # Shared memory ring and free slot tracking
+        self.ring = None
+        self.free = list(range(self.slots))
+        self.condition = Condition()
+
+        # Result state (the result frame lives in resultSlot)
+        self.result = None
+        self.resultSlot = None
+        self.resultSeq = 0
+        self.frameSeq = 0
+        self.errors = 0
+
+        # Effective rate, measured over roughly one second windows
+        self.fps = 0.0
+        self.windowStart = time.monotonic()
+        self.windowCount = 0
+
+        # Vision settings version, camera geometry and profiling switch
+        # last sent to the process, and the profile reports it sent back
+        # when stopping
+        self.configVersion = None
+        self.geometry = None
+        self.profileEnabled = False
+        self.profileReports = []
+
+        # Initialize stop flag
+        self.stopped = False
+        self.process = None
+        self.threads = []
+
+
+    # Start the vision process and the feeder and receiver threads
+    def start(self):
+
+        shape = (self.camera.height, self.camera.width, 3)
+        self.ring = SharedFrameRing(shape, self.slots)
+
+        # Spawn (rather than fork) so camera threads are not copied
+        ctx = mp.get_context("spawn")
+        self.workQueue = ctx.Queue()
+        self.resultQueue = ctx.Queue()
+        self.configVersion = VisionBase.version
+        self.geometry = getattr(self.camera, 'geometry', None)
+        self.process = ctx.Process(target=vision_process_main, name=self.name,
+                                   args=(self.ring.name, shape, self.slots, self.libs,
+                                         VisionBase.config,
+                                         (self.camera.width, self.camera.height, self.camera.fov, self.geometry),
+                                         self.workQueue, self.resultQueue))
+        self.process.daemon = True
+        self.process.start()
+
+        self.stopped = False
+        self.threads = [Thread(target=self.feed, name=self.name + "_feed", args=()),
+                        Thread(target=self.receive, name=self.name + "_receive", args=())]
+        for thread in self.threads:
+            thread.daemon = True
+            thread.start()
+
+        return self
+
+
+    # Feeder thread: copy each new camera frame into a free shared slot
+    def feed(self):
+
+        while not self.stopped:
+
+            # Wait for a free slot
+            with self.condition:
+                self.condition.wait_for(lambda: len(self.free) > 0 or self.stopped)
+                if self.stopped:
+                    return
+                slot = self.free.pop(0)
+
+            # Wait for a new frame
+            latest = self.camera.read_latest(self.frameSeq, self.timeout)
+            if latest is None:
+                with self.condition:
+                    self.free.insert(0, slot)
+                continue
+            seq, timestamp, frame = latest
+            self.frameSeq = seq
+
+            # Send reloaded vision settings and camera geometry ahead of
+            # the frame (a camera settings reload builds a new geometry)
+            if self.configVersion != VisionBase.version:
+                self.configVersion = VisionBase.version
+                self.workQueue.put(("CONFIG", VisionBase.config))
+            geometry = getattr(self.camera, 'geometry', None)
+            if geometry is not self.geometry:
+                self.geometry = geometry
+                self.workQueue.put(("GEOMETRY", geometry))
+            if self.profileEnabled != StageProfiler.enabled:
+                self.profileEnabled = StageProfiler.enabled
+                self.workQueue.put(("PROFILE", self.profileEnabled))
+
+            # Copy it into shared memory and hand the slot to the process
+            target = self.ring.slot(slot)
+            if frame.shape == target.shape:
+                np.copyto(target, frame)
+            else:
+                target[:] = 0
+                h = min(frame.shape[0], target.shape[0])
+                w = min(frame.shape[1], target.shape[1])
+                target[:h, :w] = frame[:h, :w]
+            self.workQueue.put((slot, seq, timestamp))
+
+
+    # Receiver thread: publish results and free their slots
+    def receive(self):
+
+        while True:
+
+            message = self.resultQueue.get()
+            if message is None:
+                return
+            if message[0] == "PROFILE":
+                self.profileReports = message[1]
+                continue
+            slot, seq, timestamp, records, times = message
+
+            # Record the stage latencies with the camera
+            latency = getattr(self.camera, 'latency', None)
+            if latency is not None:
+                capture, preprocess, detect = times
+                if capture is not None:
+                    latency.add('capture', capture)
+                latency.add('preprocess', preprocess)
+                latency.add('detect', detect)
+
+            if records is None:
+                self.errors += 1
+                result = None
+            else:
+                result = (self.ring.slot(slot), *[DetectionBatch(array, integral, seq, timestamp)
+                                                  for array, integral in records])
+                try:
+                    if self.callback is not None:
+                        self.callback(*result)
+                except Exception:
+                    self.errors += 1
+                    traceback.print_exc()
+
+            # Measure the effective rate
+            self.windowCount += 1
+            now = time.monotonic()
+            if now - self.windowStart >= 1.0:
+                self.fps = self.windowCount / (now - self.windowStart)
+                self.windowStart = now
+                self.windowCount = 0
+
+            # Publish the result, keeping its slot until the next result
+            with self.condition:
+                if result is None:
+                    self.free.append(slot)
+                    continue
+                if self.resultSlot is not None:
+                    self.free.append(self.resultSlot)
+                self.result = result
+                self.resultSlot = slot
+                self.resultSeq += 1
+                self.condition.notify_all()
+            if self.event is not None:
+                self.event.set()
+
+
+    # Return (resultSeq, result) for the newest result without blocking
+    # If after is given, wait for a result newer than that sequence number
+    def latest(self, after = None, timeout = None):
+
+        with self.condition:
+            if after is not None:
+                self.condition.wait_for(lambda: self.resultSeq > after or self.stopped, timeout)
+            return (self.resultSeq, self.result)
+
+
+    # Stop the process and threads and free the shared memory
+    def stop(self, timeout = 2.0):
+
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+
+        if self.process is not None:
+            self.workQueue.put(None)
+            self.process.join(timeout)
+            if self.process.is_alive():
+                self.process.terminate()
+            self.resultQueue.put(None)
+        for thread in self.threads:
+            thread.join(timeout)
+        self.result = None
+        if self.ring is not None:
+            self.ring.close()
+            self.ring = None
+
+
+    # Return the stage profile reports of the process (after stop)
+    def report(self):
+        return "\n".join(self.profileReports)
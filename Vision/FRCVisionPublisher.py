@@ -0,0 +1,262 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python3
+
+######################################################################
+#                                                                    #
+#                     FRC Vision Publisher Library                   #
+#                                                                    #
+#  This class publishes vision results to NetworkTables.  All the    #
+#  results of a camera's frame (such as cubes and cones) are packed  #
+#  into one number array stamped with the frame sequence and         #
+#  timestamp, which is only sent when a value moved by more than a   #
+#  deadband.  Sending runs on its own thread at a fixed rate, so     #
+#  the vision pipelines never wait on NetworkTables.  The old per    #
+#  key topics can still be published.                                #
+#                                                                    #
+# @Version: 1.0                                                      #
+# @Created: 2023-03-04                                               #
+# @Author: Team 4121                                                 #
+#                                                                    #
+######################################################################
+
+"""FRC Vision Publisher Library - Provides batched NetworkTables output"""
+
+# System imports
+import time
+import traceback
+
+# Module Imports
+import numpy as np
+from threading import Thread, Condition
+
+# Value published for a missing field
+missing_value = -9999.
+
+# Fields of each object in a packed array
+publish_fields = ('distance', 'angle', 'offset')
+
+
+# Pack the found objects of one kind into a number array
+# [count, then distance, angle, offset of the first maxObjects objects,
+# padded with missing values to maxObjects objects]
+def pack_objects(objects, maxObjects):
+
+    count = len(objects)
+    shown = min(count, maxObjects)
+    values = np.full((maxObjects, len(publish_fields)), missing_value)
+    if hasattr(objects, 'array'):
+        # Detection batch: take whole columns
+        array = objects.array[:shown]
+        for column, field in enumerate(publish_fields):
+            values[:shown, column] = array[field]
+    else:
+        for row, obj in enumerate(objects[:shown]):
+            values[row] = [np.nan if getattr(obj, field) is None else getattr(obj, field) for field in publish_fields]
+    values = np.nan_to_num(values, nan=missing_value)
+    return np.concatenate(([count], values.ravel()))
+
+
+# Pack the results of a camera's frame into one number array
+# [seq, timestamp, then for each kind of object (in results order) its
+# count and maxObjects (distance, angle, offset) slots]
+# The stamp is taken from the first detection batch unless given.  The
+# timestamp is the Pi's monotonic capture time, which send replaces with
+# the age of the frame.
+def pack_results(results, maxObjects, seq = None, timestamp = None):
+
+    if seq is None:
+        for objects in results:
+            if getattr(objects, 'seq', None) is not None:
+                seq, timestamp = objects.seq, objects.timestamp
+                break
+    header = [missing_value if seq is None or seq < 0 else seq,
+              missing_value if timestamp is None or timestamp != timestamp else timestamp]
+    return np.concatenate([header] + [pack_objects(objects, maxObjects) for objects in results])
+
+
+# Define the vision publisher class
+class VisionPublisher:
+
+    # Define initialization
+    # table is the vision table and instance (optional) the NetworkTables
+    # instance flushed after each send.  rate is the sends per second,
+    # deadband the change needed to resend a value and keepAlive the
+    # seconds after which unchanged values are sent anyway.  maxObjects is
+    # the number of objects of each kind packed.  legacy also publishes the
+    # per key topics (Cubes.0.distance, ...).
+    def __init__(self, table, instance = None, rate = 50.0, deadband = 0.01, keepAlive = 0.5,
+                 maxObjects = 3, legacy = False, name = "vision_publisher"):
+        self.table = table
+        self.instance = instance
+        self.rate = rate
+        self.deadband = deadband
+        self.keepAlive = keepAlive
+        self.maxObjects = maxObjects
+        self.legacy = legacy
+        self.name = name
+
+        # Pending (packed array, queue time) by topic, the legacy topics of
+        # each kind in a topic's array, last sent arrays and send times, and
+        # the LatencyStats each topic's publish and capture to publish times
+        # go to (with the last frame sequence recorded)
+        self.pending = {}
+        self.names = {}
+        self.latency = {}
+        self.latencySeq = {}
+        self.sent = {}
+        self.sentTime = {}
+        self.sends = 0
+        self.skipped = 0
+        self.errors = 0
+
+        # Thread state (flushRequested counts flush calls, flushed the
+        # calls that have been sent)
+        self.condition = Condition()
+        self.flushRequested = 0
+        self.flushed = 0
+        self.stopped = False
+        self.thread = None
+
+
+    # Queue the results of a camera's frame for a topic (never blocks on
+    # sending).  results has a DetectionBatch or list of found objects for
+    # each kind of object, and names the legacy topic of each kind
+    # (defaults to the topic).  maxObjects overrides the number of objects
+    # of each kind packed for this topic.
+    def publish(self, topic, results, names = None, seq = None, timestamp = None, maxObjects = None):
+        packed = pack_results(results, self.maxObjects if maxObjects is None else maxObjects, seq, timestamp)
+        with self.condition:
+            self.pending[topic] = (packed, time.monotonic())
+            self.names[topic] = tuple(names) if names is not None else (topic,) * len(results)
+        if self.thread is None:
+            self.send()
+
+
+    # Record the latency of a topic's results in a LatencyStats (such as
+    # its camera's), once per sent or skipped result
+    def track_latency(self, topic, latency):
+        self.latency[topic] = latency
+        return self
+
+
+    # Define publisher thread start method
+    def start(self):
+
+        self.stopped = False
+        self.thread = Thread(target=self.update, name=self.name, args=())
+        self.thread.daemon = True
+        self.thread.start()
+
+        return self
+
+
+    # Return True if a packed array differs from the last one sent
+    def changed(self, topic, packed, now):
+        last = self.sent.get(topic)
+        if last is None or len(last) != len(packed):
+            return True
+        if now - self.sentTime.get(topic, 0.0) >= self.keepAlive:
+            return True
+        return bool(np.any(np.abs(packed[2:] - last[2:]) > self.deadband))
+
+
+    # Send the pending arrays that changed
+    # The Pi's monotonic clock means nothing on the roboRIO, so the
+    # timestamp is sent as the age of the frame in seconds when sent (the
+    # roboRIO subtracts it from the time the value arrived)
+    def send(self):
+
+        with self.condition:
+            pending = self.pending
+            self.pending = {}
+
+        now = time.monotonic()
+        sent = False
+        for topic, (packed, queued) in pending.items():
+            # Record the latency once per new frame
+            latency = self.latency.get(topic)
+            if latency is not None and (packed[0] == missing_value or packed[0] != self.latencySeq.get(topic)):
+                self.latencySeq[topic] = packed[0]
+                latency.add('publish', now - queued)
+                if packed[1] != missing_value:
+                    latency.add('total', now - packed[1])
+            if not self.changed(topic, packed, now):
+                self.skipped += 1
+                continue
+            try:
+                values = packed.tolist()
+                if packed[1] != missing_value:
+                    values[1] = float(now - packed[1])
+                self.table.putNumberArray(topic, values)
+                if self.legacy:
+                    self.send_legacy(topic, packed)
+                self.sent[topic] = packed
+                self.sentTime[topic] = now
+                self.sends += 1
+                sent = True
+            except Exception:
+                self.errors += 1
+                traceback.print_exc()
+
+        # Push the values out now rather than on the next periodic update
+        if sent and self.instance is not None and hasattr(self.instance, 'flush'):
+            self.instance.flush()
+
+
+    # Publish a packed array as the per key topics of each kind
+    # (CubesFound, Cubes.0.distance, ...), only sending keys that changed
+    def send_legacy(self, topic, packed):
+        last = self.sent.get(topic)
+        names = self.names.get(topic, (topic,))
+        size = (len(packed) - 2) // len(names)
+        for kind, name in enumerate(names):
+            start = 2 + kind * size
+            count = int(packed[start])
+            if last is None or last[start] != count:
+                self.table.putNumber(name + "Found", count)
+            for index in range(min(count, (size - 1) // len(publish_fields))):
+                for offset, field in enumerate(publish_fields):
+                    position = start + 1 + index * len(publish_fields) + offset
+                    value = packed[position]
+                    if last is None or abs(value - last[position]) > self.deadband:
+                        self.table.putNumber("{}.{}.{}".format(name, index, field), float(value))
+
+
+    # Send everything pending now, waiting for the publisher thread
+    def flush(self, timeout = 1.0):
+
+        if self.thread is None or self.stopped:
+            self.send()
+            return
+        with self.condition:
+            self.flushRequested += 1
+            request = self.flushRequested
+            self.condition.notify_all()
+            self.condition.wait_for(lambda: self.flushed >= request or self.stopped, timeout)
+
+
+    # Define threaded update method
+    def update(self):
+
+        period = 1.0 / self.rate if self.rate > 0 else None
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.stopped or self.flushRequested > self.flushed, period)
+                if self.stopped:
+                    return
+                request = self.flushRequested
+            self.send()
+            with self.condition:
+                self.flushed = request
+                self.condition.notify_all()
+
+
+    # Stop the publisher thread, sending what is still pending
+    def stop(self, timeout = None):
+
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+        if self.thread is not None:
+            self.thread.join(timeout)
+        self.send()
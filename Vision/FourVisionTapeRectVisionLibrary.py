@@ -1,7 +1,11 @@
-from FRCVisionBase import VisionBase, math, cv, np
+from FRCVisionBase import VisionBase, DetectionBatch, math, cv, np
+from FRCVisionConfig import tape_schema
 
 class FourVisionTapeRectVisionLibrary(VisionBase):
 
+    # Define the settings of the tape section
+    schema = tape_schema
+
     # Define class fields
     tape_values = {}
 
@@ -9,22 +13,22 @@ class FourVisionTapeRectVisionLibrary(VisionBase):
     # Define class initialization
     def __init__(self, cameraFocalLength, cameraMountHeight):
         
+        self.name = "TAPE"
         self.cameraFocalLength = cameraFocalLength
         self.cameraMountHeight = cameraMountHeight
+        self.target = None
 
-    # Locates the cubes and cones in the game (2023)
-    # returns a tuple containing (cubes, cones)
+    # Locates the vision tape target
+    # Returns the tape as a DetectionBatch with one row (empty if no tape was
+    # found), with the angle signed like the rectangle libraries.  The full
+    # target values of the frame are kept in self.target as (camera values,
+    # real world values, foundTape, targetLock, rect, box).
     def find_objects(self, imgRaw, imageWidth, imageHeight, cameraFOV):
         
-        # Read HSV values from dictionary and make tupples
-        hMin = int(VisionBase.config["TAPE"]['HMIN'])
-        hMax = int(VisionBase.config["TAPE"]['HMAX'])
-        sMin = int(VisionBase.config["TAPE"]['SMIN'])
-        sMax = int(VisionBase.config["TAPE"]['SMAX'])
-        vMin = int(VisionBase.config["TAPE"]['VMIN'])
-        vMax = int(VisionBase.config["TAPE"]['VMAX'])
-        tapeHSVMin = (hMin, sMin, vMin)
-        tapeHSVMax = (hMax, sMax, vMax)
+        # Read the compiled tape settings
+        params = self.params()
+        tapeHSVMin = params.hsvMin
+        tapeHSVMax = params.hsvMax
 
         # Initialize processing values
         targetX = 1000 
@@ -56,21 +60,26 @@ class FourVisionTapeRectVisionLibrary(VisionBase):
         foundTape = False
         targetLock = False
         
-        # Find alignment tape in image
-        tapeContours = self.process_image_contours(imgRaw, tapeHSVMin, tapeHSVMax, False, False)
+        # Find alignment tape in image (only the bounding boxes are needed)
+        if self.segmentation() == 'COMPONENTS':
+            stats, _, _ = self.process_image_components(imgRaw, tapeHSVMin, tapeHSVMax, False)
+            tapeRects = [tuple(int(value) for value in stat[:4]) for stat in stats]
+        else:
+            tapeContours = self.process_image_contours(imgRaw, tapeHSVMin, tapeHSVMax, False, False)
+            tapeRects = [cv.boundingRect(contour) for contour in tapeContours]
 
         # Continue with processing if alignment tape found
-        if len(tapeContours) >= 3: #AT LEAST three
+        if len(tapeRects) >= 3: #AT LEAST three
             
             #Process each contour
             firstContour = True
             minOffset = 0
-            for contour in tapeContours:
+            for rect in tapeRects:
               
                 # Find horizontal rectangle
-                rectX, rectY, rectW, rectH = cv.boundingRect(contour) 
+                rectX, rectY, rectW, rectH = rect
 
-                if (rectW * rectH) > int(VisionBase.config["TAPE"]['MINAREA']):
+                if (rectW * rectH) > params.minArea:
                     
                     # Find offset of rectangle from center of image
                     rectOffset = abs((rectX + rectW/2) - imageWidth / 2) #from parameter
@@ -117,7 +126,7 @@ class FourVisionTapeRectVisionLibrary(VisionBase):
             if foundTape:
                                 
                 # Calculate inches per pixel conversion factor
-                inchesPerPixel = float(VisionBase.config["TAPE"]['TAPEWIDTH']) / targetW
+                inchesPerPixel = params.tapeWidth / targetW
 
                 # Find tape offsets
                 horizOffsetPixels = (targetX + targetW/2) - imageWidth / 2 #from parameter
@@ -127,8 +136,8 @@ class FourVisionTapeRectVisionLibrary(VisionBase):
                 centerOffset = -horizOffsetInInches
                 
                 # Calculate distance to tape
-                straightLineDistance = float(VisionBase.config["TAPE"]['TAPEWIDTH']) * self.cameraFocalLength / targetW
-                distanceArg = math.pow(straightLineDistance, 2) - math.pow((float(VisionBase.config["TAPE"]['GOALHEIGHT']) - self.cameraMountHeight),2)
+                straightLineDistance = params.tapeWidth * self.cameraFocalLength / targetW
+                distanceArg = math.pow(straightLineDistance, 2) - math.pow((params.goalHeight - self.cameraMountHeight),2)
                 if (distanceArg > 0):
                     distanceToTape = math.sqrt(distanceArg)
                 else:
@@ -140,11 +149,11 @@ class FourVisionTapeRectVisionLibrary(VisionBase):
                 vertAngleToTape = math.degrees(math.atan((vertOffsetInInches / distanceToTape)))
 
                 # Determine if we have target lock
-                if abs(horizOffsetInInches) <= float(VisionBase.config["TAPE"]['LOCKTOLERANCE']):
+                if abs(horizOffsetInInches) <= params.lockTolerance:
                     targetLock = True
 
 
-        return ({
+        self.target = ({
             'TargetX': targetX,
             'TargetY': targetY,
             'TargetW': targetW,
@@ -164,4 +173,10 @@ class FourVisionTapeRectVisionLibrary(VisionBase):
             'BotAngle': botAngle,
             'ApparentWidth': apparentTapeWidth,
             'VertOffset': vertOffsetInInches
-        }, foundTape, targetLock, rect, box)
\ No newline at end of file
+        }, foundTape, targetLock, rect, box)
+
+        if not foundTape:
+            return DetectionBatch()
+        return DetectionBatch.from_columns(self.name, 1, True, x=targetX, y=targetY, w=targetW, h=targetH,
+                                           distance=distanceToTape, angle=-horizAngleToTape, offset=centerOffset,
+                                           percent=targetW * targetH / (imageWidth * imageHeight))
\ No newline at end of file
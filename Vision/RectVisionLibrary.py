@@ -1,64 +1,112 @@
 from FRCVisionBase import *
+from FRCVisionConfig import ConfigSchema, Param, parse_bool, hsv_schema
 
 class RectVisionLibrary(VisionBase):
 
+    # Define the settings of a rectangle section
+    schema = ConfigSchema("Rect", [
+        Param('HEIGHT', float, None, True, 'height'),
+        Param('WIDTH', float, None, True, 'width'),
+        Param('MINAREA', int, 0, True, 'minArea'),
+        Param('TOLERANCE', float, 1.0, True, 'tolerance'),
+        Param('MINVIS', float, 0.0, False, 'minVis'),
+        Param('RECIPROCAL', parse_bool, False, False, 'reciprocal'),
+    ], extends=hsv_schema)
+
     # Define class initialization
     def __init__(self, name):
         self.name = name
         super()
     
 
+    # Read configuration values from the compiled settings
+    # (height has always been read from WIDTH, which the filters are tuned for)
+    def read_params(self):
+        p = self.params()
+        return p.hsvMin, p.hsvMax, p.minArea, p.tolerance, p.minVis, p.width, p.width, p.reciprocal
+
+
     # Locates the cubes and cones in the game (2023)
-    # returns a tuple containing (cubes, cones)
+    # Contour metrics and filters are computed for all contours at once
+    # as NumPy arrays, giving the same objects as a per contour loop in a
+    # DetectionBatch (see Test/RectVisionBenchmark.py)
     def find_objects(self, imgRaw, cameraWidth, cameraHeight, cameraFOV):
 
-        # Read configuration values from dictionary and make tuples
-        HSVMin    = (self.cfg('HMIN',   0, int), self.cfg('SMIN',   0, int), self.cfg('VMIN',   0, int))
-        HSVMax    = (self.cfg('HMAX', 255, int), self.cfg('SMAX', 255, int), self.cfg('VMAX', 255, int))
-        minArea   = self.cfg('MINAREA', 0, int)
-        tolerance = self.cfg('TOLERANCE', 1.0, float)
-        minVis    = self.cfg('MINVIS', 0.0, float, False)
-        width     = self.cfg('WIDTH', None, float)
-        height    = self.cfg('WIDTH', None, float)
-        recip     = self.cfg('RECIPROCAL', False, bool, False)
+        HSVMin, HSVMax, minArea, tolerance, minVis, width, height, recip = self.read_params()
         aspect    = height / width
-        
-        # Initialize variables
-        data = []
-
-        # Find contours in the mask and clean up the return style from OpenCV
-        contours = self.process_image_contours(imgRaw, HSVMin, HSVMax, False, False)
-        if len(contours) > 0:
-
-            contours.sort(key=cv.contourArea, reverse=True)
-            for contour in contours:
-                x, y, w, h = cv.boundingRect(contour)
-                
-                if w * h < minArea: # in pixel units
-                    break
-                
-                if (abs(h / w / aspect - 1.0) > tolerance and (not recip and abs(w / h / aspect - 1.0) > tolerance)) or cv.contourArea(contour) / (w * h) < minVis:
-                    continue
-
-                # Calculate metrics
-                inches_per_pixel = float(width) / w # set up a general conversion factor
-                distanceToTargetPlane = inches_per_pixel * (cameraWidth / (2 * math.tan(math.radians(cameraFOV))))
-                offsetInInches = inches_per_pixel * ((x + (w / 2)) - (cameraWidth / 2))
-                angleToObject = -1 * math.degrees(math.atan((offsetInInches / distanceToTargetPlane)))
-                distanceToObject = math.cos(math.radians(angleToObject)) * distanceToTargetPlane
-                screenPercent = w * h / (cameraWidth * cameraHeight)
-                offset = -offsetInInches
-                
-                data.append(FoundObject(self.name, x, y,
-                    w=w,
-                    h=h,
-                    distance=distanceToObject,
-                    angle=angleToObject,
-                    offset=offset,
-                    percent=screenPercent
-                ))
-        
-        return data
+
+        # Areas and bounding boxes of all blobs
+        if self.segmentation() == 'COMPONENTS':
+
+            # Connected components give both directly (area is the pixel count)
+            stats, _, _ = self.process_image_components(imgRaw, HSVMin, HSVMax, False)
+            if len(stats) == 0:
+                return DetectionBatch()
+            areas = stats[:, cv.CC_STAT_AREA].astype(np.float64)
+            boxes = stats[:, :4].astype(np.int64)
+
+        else:
+
+            # Find contours in the mask and clean up the return style from OpenCV
+            contours = self.process_image_contours(imgRaw, HSVMin, HSVMax, False, False)
+            if len(contours) == 0:
+                return DetectionBatch()
+            areas = np.array([cv.contourArea(contour) for contour in contours], dtype=np.float64)
+            boxes = np.array([cv.boundingRect(contour) for contour in contours], dtype=np.int64).reshape(-1, 4)
+
+        # Sort largest area first
+        order = np.argsort(-areas, kind='stable')
+        areas = areas[order]
+        x, y, w, h = boxes[order].T
+
+        # Stop at the first box below the minimum area (in pixel units)
+        boxArea = w * h
+        small = np.flatnonzero(boxArea < minArea)
+        keep = np.arange(len(areas)) < (small[0] if len(small) > 0 else len(areas))
+
+        # Drop boxes with the wrong aspect ratio or too little fill
+        with np.errstate(divide='ignore', invalid='ignore'):
+            # Preserves the baseline rule: RECIPROCAL turns the aspect test off
+            badShape = ((np.abs(h / w / aspect - 1.0) > tolerance) & (np.abs(w / h / aspect - 1.0) > tolerance)
+                        if not recip else np.zeros(len(w), bool))
+            keep &= ~(badShape | (areas / boxArea < minVis))
+
+        x, y, w, h = x[keep], y[keep], w[keep], h[keep]
+        if len(x) == 0:
+            return DetectionBatch()
+
+        return self.measure(x, y, w, h, width, cameraWidth, cameraHeight, cameraFOV)
+
+
+    # Turn arrays of boxes into a DetectionBatch with their real world metrics
+    def measure(self, x, y, w, h, width, cameraWidth, cameraHeight, cameraFOV):
+
+        # Calculate metrics (angles are looked up per column)
+        geometry = self.geometry(cameraWidth, cameraHeight, cameraFOV)
+        column = geometry.column_index(x + (w / 2))
+        inches_per_pixel = float(width) / w # set up a general conversion factor
+        distanceToTargetPlane = inches_per_pixel * geometry.focalX
+        offsetInInches = distanceToTargetPlane * geometry.columnTan[column]
+        angleToObject = -1 * geometry.columnAngle[column]
+        distanceToObject = geometry.columnCos[column] * distanceToTargetPlane
+        screenPercent = w * h / (cameraWidth * cameraHeight)
+        offset = -offsetInInches
+
+        return DetectionBatch.from_columns(self.name, len(x), True, x=x, y=y, w=w, h=h,
+                                           distance=distanceToObject, angle=angleToObject,
+                                           offset=offset, percent=screenPercent)
+
+
+    # Measure objects moved to new boxes (optical flow mode), giving the
+    # same fields as find_objects
+    def remeasure(self, objects, boxes, cameraWidth, cameraHeight, cameraFOV):
+
+        if len(boxes) == 0:
+            return DetectionBatch()
+        x, y, w, h = np.maximum(np.rint(np.array(boxes, dtype=np.float64)), 0).astype(np.int64).T
+        w = np.maximum(w, 1)
+        h = np.maximum(h, 1)
+        return self.measure(x, y, w, h, self.params().width, cameraWidth, cameraHeight, cameraFOV)
 
 CubeVisionLibrary = lambda: RectVisionLibrary("CUBE")
 ConeVisionLibrary = lambda: RectVisionLibrary("CONE")
@@ -12,6 +12,7 @@ sys.path.append('/usr/local/lib/vmxpi/')
 import datetime
 import time
 import logging
+import threading
 from platform import node as hostname
 import cv2 as cv
 import ntcore
@@ -19,6 +20,10 @@ from cscore import CameraServer
 
 #Team 4121 module imports
 from FRCCameraLibrary import FRCWebCam
+from FRCVisionPipeline import VisionPipeline
+from FRCSettingsWatcher import SettingsWatcher
+from FRCVisionPublisher import VisionPublisher
+from FRCStageProfiler import StageProfiler
 from FRCVision2023 import *
 
 #Set up basic logging
@@ -35,6 +40,14 @@ videoTesting = True
 resizeVideo = False
 saveVideo = False
 visionTesting = 0 # 0 to disable
+independentCameras = True # each camera runs at its own rate
+visionProcesses = False # run each camera's libraries in its own process (needs independentCameras and Python 3.8)
+hotReload = True # reload the settings files when they change
+publishRate = 50 # NetworkTables sends per second
+publishDeadband = 0.01 # change needed to resend a published value
+legacyTopics = False # also publish the per key topics (Cubes.0.distance, ...)
+latencyPeriod = 2.0 # seconds between latency reports (NetworkTables and run log)
+profileStages = False # time each vision stage (also switched by the vision table's ProfileStages key)
 networkTablesConnected = False
 startupSleep = 0
 
@@ -43,18 +56,9 @@ timeString = "{}-{}-{}_{}:{}:{}".format(currentTime.tm_year, currentTime.tm_mon,
 
 nt = ntcore.NetworkTableInstance.getDefault()
 
-def unwrap_or(val, default):
-    if val is None:
-        return default
-    else:
-        return val
-
 visionTable = None
-done = 0
-fieldFrame = None
-tapeFrame = None
+publisher = None
 def handle_field_objects(frame, cubes, cones):
-    global done, fieldFrame
     if len(cubes) >= 1:
 
         cube = cubes[0]
@@ -98,42 +102,11 @@ def handle_field_objects(frame, cubes, cones):
                 cv.putText(frame, "D: {:6.2f}".format(cone.distance), (cone.x + 10, cone.y + 15), cv.FONT_HERSHEY_SIMPLEX, 0.3, (0, 0, 0), 2)
                 cv.putText(frame, "A: {:6.2f}".format(cone.angle), (cone.x + 10, cone.y + 30), cv.FONT_HERSHEY_SIMPLEX, 0.3, (0, 0, 0), 2)
                 cv.putText(frame, "O: {:6.2f}".format(cone.offset), (cone.x + 10, cone.y + 45), cv.FONT_HERSHEY_SIMPLEX, 0.3, (0, 0, 0), 2)
-    
-    fieldFrame = frame
-
-    if networkTablesConnected:
-        visionTable.putNumber("CubesFound", len(cubes))
-        if len(cubes) >= 1:
-            visionTable.putNumber("Cubes.0.distance", unwrap_or(cubes[0].distance, -9999.))
-            visionTable.putNumber("Cubes.0.angle", unwrap_or(cubes[0].angle, -9999.))
-            visionTable.putNumber("Cubes.0.offset", unwrap_or(cubes[0].offset, -9999.))
-            if len(cubes) >= 2:
-                visionTable.putNumber("Cubes.1.distance", unwrap_or(cubes[1].distance, -9999.))
-                visionTable.putNumber("Cubes.1.angle", unwrap_or(cubes[1].angle, -9999.))
-                visionTable.putNumber("Cubes.1.offset", unwrap_or(cubes[1].offset, -9999.))
-                if len(cubes) >= 3:
-                    visionTable.putNumber("Cubes.2.distance", unwrap_or(cubes[2].distance, -9999.))
-                    visionTable.putNumber("Cubes.2.angle", unwrap_or(cubes[2].angle, -9999.))
-                    visionTable.putNumber("Cubes.2.offset", unwrap_or(cubes[2].offset, -9999.))
-        
-        visionTable.putNumber("ConesFound", len(cones))
-        if len(cones) >= 1:
-            visionTable.putNumber("Cones.0.distance", unwrap_or(cones[0].distance, -9999.))
-            visionTable.putNumber("Cones.0.angle", unwrap_or(cones[0].angle, -9999.))
-            visionTable.putNumber("Cones.0.offset", unwrap_or(cones[0].offset, -9999.))
-            if len(cones) >= 2:
-                visionTable.putNumber("Cones.1.distance", unwrap_or(cones[1].distance, -9999.))
-                visionTable.putNumber("Cones.1.angle", unwrap_or(cones[1].angle, -9999.))
-                visionTable.putNumber("Cones.1.offset", unwrap_or(cones[1].offset, -9999.))
-                if len(cones) >= 3:
-                    visionTable.putNumber("Cones.2.distance", unwrap_or(cones[2].distance, -9999.))
-                    visionTable.putNumber("Cones.2.angle", unwrap_or(cones[2].angle, -9999.))
-                    visionTable.putNumber("Cones.2.offset", unwrap_or(cones[2].offset, -9999.))
-    
-    done += 1
+
+    if publisher is not None:
+        publisher.publish("Field", (cubes, cones), names=("Cubes", "Cones"))
 
 def handle_tapes(frame, tapes):
-    global done, tapeFrame
     if len(tapes) >= 1:
 
         tape = tapes[0]
@@ -162,44 +135,27 @@ def handle_tapes(frame, tapes):
                     cv.putText(frame, "D: {:6.2f}".format(tape.distance), (tape.x + tape.w + 10, tape.y + 15), cv.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 2)
                     cv.putText(frame, "A: {:6.2f}".format(tape.angle), (tape.x + tape.w + 10, tape.y + 30), cv.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 2)
                     cv.putText(frame, "O: {:6.2f}".format(tape.offset), (tape.x + tape.w + 10, tape.y + 45), cv.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 2)
-    
-    tapeFrame = frame
-    
-    if networkTablesConnected:
-        visionTable.putNumber("TapesFound", len(tapes))
-        if len(tapes) >= 1:
-            visionTable.putNumber("Tapes.0.distance", unwrap_or(tapes[0].distance, -9999.))
-            visionTable.putNumber("Tapes.0.angle", unwrap_or(tapes[0].angle, -9999.))
-            visionTable.putNumber("Tapes.0.offset", unwrap_or(tapes[0].offset, -9999.))
-            if len(tapes) >= 2:
-                visionTable.putNumber("Tapes.1.distance", unwrap_or(tapes[1].distance, -9999.))
-                visionTable.putNumber("Tapes.1.angle", unwrap_or(tapes[1].angle, -9999.))
-                visionTable.putNumber("Tapes.1.offset", unwrap_or(tapes[1].offset, -9999.))
-                if len(tapes) >= 3:
-                    visionTable.putNumber("Tapes.2.distance", unwrap_or(tapes[2].distance, -9999.))
-                    visionTable.putNumber("Tapes.2.angle", unwrap_or(tapes[2].angle, -9999.))
-                    visionTable.putNumber("Tapes.2.offset", unwrap_or(tapes[2].offset, -9999.))
-                    if len(tapes) >= 4:
-                        visionTable.putNumber("Tapes.3.distance", unwrap_or(tapes[3].distance, -9999.))
-                        visionTable.putNumber("Tapes.3.angle", unwrap_or(tapes[3].angle, -9999.))
-                        visionTable.putNumber("Tapes.3.offset", unwrap_or(tapes[3].offset, -9999.))
-
-    done += 1
+
+    if publisher is not None:
+        publisher.publish("Tapes", (tapes,), maxObjects=4)
 
 #Define main processing function
 def main():
 
-    global timeString, networkTablesConnected, visionTable, done
+    global timeString, networkTablesConnected, visionTable, publisher
 
     time.sleep(startupSleep)
 
 
     #Define objects
     visionTable = None
+    StageProfiler.enabled = profileStages
     FRCWebCam.read_config_file(cameraFile)
+    VisionBase.read_vision_file(visionFile)
     fieldCam = FRCWebCam('FIELD', timeString, csname="field")
     tapeCam = FRCWebCam('TAPE', timeString, csname="tapes")
-    VisionBase.read_vision_file(visionFile)
+    fieldCam.start_camera_thread()
+    tapeCam.start_camera_thread()
 
     CameraServer.addServer("RobotVision")
     CameraServer.addCamera(fieldCam.cvs)
@@ -208,6 +164,20 @@ def main():
     cubeLib = CubeVisionLibrary()
     coneLib = ConeVisionLibrary()
     tapeLib = TapeRectVisionLibrary()
+
+    #Report missing and unknown vision settings before the match starts
+    VisionBase.check_config(cubeLib, coneLib, tapeLib)
+
+    #Start persistent vision workers
+    resultEvent = threading.Event()
+    if independentCameras and visionProcesses:
+        #Imported here, as shared memory needs Python 3.8 or later
+        from FRCVisionProcess import VisionProcess
+        fieldPipeline = VisionProcess(fieldCam, cubeLib, coneLib, callback=handle_field_objects, name="field", event=resultEvent).start()
+        tapePipeline = VisionProcess(tapeCam, tapeLib, callback=handle_tapes, name="tapes", event=resultEvent).start()
+    else:
+        fieldPipeline = VisionPipeline(fieldCam, cubeLib, coneLib, callback=handle_field_objects, name="field", freeRun=independentCameras, event=resultEvent).start()
+        tapePipeline = VisionPipeline(tapeCam, tapeLib, callback=handle_tapes, name="tapes", freeRun=independentCameras, event=resultEvent).start()
     
     
     #Open a log file
@@ -216,6 +186,24 @@ def main():
         log_file.write('run started on {}.\n'.format(datetime.datetime.now()))
         log_file.write('')
 
+        #Watch the settings files so they can be retuned without a restart
+        def reload_vision(file):
+            if not VisionBase.read_vision_file(file, True):
+                return False
+            VisionBase.check_config(cubeLib, coneLib, tapeLib)
+
+        def reload_cameras(file):
+            if not FRCWebCam.read_config_file(file, True):
+                return False
+            fieldCam.apply_settings()
+            tapeCam.apply_settings()
+
+        watcher = SettingsWatcher(log_file=log_file)
+        if hotReload:
+            watcher.watch(visionFile, reload_vision)
+            watcher.watch(cameraFile, reload_cameras)
+            watcher.start()
+
         #Connect NetworkTables
         try:
             if networkTablesConnected:
@@ -227,6 +215,15 @@ def main():
                 log_file.write('Connected to Networktables on 10.41.21.2 \n')
 
                 visionTable.putNumber("RobotStop", 0)
+                visionTable.putBoolean("ProfileStages", profileStages)
+
+                #Publish each camera's results as one packed array on
+                #their own thread (Field: cubes then cones, Tapes), each
+                #stamped with its frame sequence and age in seconds
+                publisher = VisionPublisher(visionTable, nt, publishRate, publishDeadband,
+                                            legacy=legacyTopics).start()
+                publisher.track_latency("Field", fieldCam.latency)
+                publisher.track_latency("Tapes", tapeCam.latency)
                 
                 timeString = visionTable.getString("Time", timeString)
         except:
@@ -236,24 +233,54 @@ def main():
 
         log_file.write("connected to table\n" if networkTablesConnected else "Failed to connect to table\n")
         stop = False
+        latencyTime = time.monotonic()
+        shownSeqs = {}
         #Start main processing loop
         while not stop:
             
             ###################
             # Process Web Cam #
             ###################
-            done = 0
+            if independentCameras:
 
-            fieldCam.use_libs_async(cubeLib, coneLib, callback=handle_field_objects, name="field")
-            tapeCam.use_libs_async(tapeLib, callback=handle_tapes, name="tapes")
-            
-            while done < 2:
-                time.sleep(0.005)
+                #Each pipeline runs at its own rate, so just wait for
+                #any new result and use the latest from each camera
+                resultEvent.wait(0.1)
+                resultEvent.clear()
+
+            else:
+
+                fieldPipeline.submit()
+                tapePipeline.submit()
+
+                fieldPipeline.wait()
+                tapePipeline.wait()
+
+            if networkTablesConnected:
+                visionTable.putNumber("FieldFPS", fieldPipeline.fps)
+                visionTable.putNumber("TapesFPS", tapePipeline.fps)
+
+            #Report per stage latency percentiles (p50, p95, p99 in ms)
+            if time.monotonic() - latencyTime >= latencyPeriod:
+                latencyTime = time.monotonic()
+                for cam, key in ((fieldCam, "FieldLatency"), (tapeCam, "TapesLatency")):
+                    if networkTablesConnected:
+                        visionTable.putNumberArray(key, cam.latency.summary())
+                    log_file.write(cam.latency.report(cam.name) + "\n")
             
-            if videoTesting:
-                
-                cv.imshow("Field", fieldFrame)
-                cv.imshow("Tapes", tapeFrame)
+            #Record and show each camera's newest frame once (a camera
+            #without a new result is skipped, the other still updates)
+            for cam, pipeline, window in ((fieldCam, fieldPipeline, "Field"), (tapeCam, tapePipeline, "Tapes")):
+                resultSeq, result = pipeline.latest()
+                if result is None or shownSeqs.get(window) == resultSeq:
+                    continue
+                shownSeqs[window] = resultSeq
+
+                if saveVideo:
+                    cam.write_video(result[0])
+
+                if videoTesting:
+                    cv.imshow(window, result[0])
 
             #################################
             # Check for stopping conditions #
@@ -263,6 +290,15 @@ def main():
             if cv.waitKey(1) == 27:
                 break
 
+            #Check for the stage profiling switch
+            if networkTablesConnected:
+                StageProfiler.enabled = visionTable.getBoolean("ProfileStages", StageProfiler.enabled)
+
+            #Check for black box recording triggers
+            if networkTablesConnected:
+                fieldCam.check_blackbox_trigger(visionTable)
+                tapeCam.check_blackbox_trigger(visionTable)
+
             #Check for stop code from network tables
             if networkTablesConnected: 
                 robotStop = visionTable.getNumber("RobotStop", 0)
@@ -270,6 +306,21 @@ def main():
                     break
             
 
+        #Stop the settings watcher, vision workers, capture threads and video recorders
+        watcher.stop()
+        fieldPipeline.stop()
+        tapePipeline.stop()
+        if publisher is not None:
+            publisher.stop()
+        log_file.write(fieldCam.latency.report(fieldCam.name) + "\n")
+        log_file.write(tapeCam.latency.report(tapeCam.name) + "\n")
+        log_file.write(fieldPipeline.report() + "\n")
+        log_file.write(tapePipeline.report() + "\n")
+        fieldCam.stop_camera_thread()
+        tapeCam.stop_camera_thread()
+        fieldCam.release_cam()
+        tapeCam.release_cam()
+
         #Close all open windows (for testing)
         if videoTesting:
             cv.destroyAllWindows()